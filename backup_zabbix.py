@@ -2,35 +2,108 @@
 import pathlib
 import json
 import hashlib
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
-from restore_zabbix import C
+from zbx_colors import C
 from slugify import slugify
-from pyzabbix import ZabbixAPI
+import json_stream
+from storage import Storage, load_images_manifest
+from zbx_metrics import ApiMetrics
+from zbx_scheduler import RequestScheduler
+from zbx_api import (
+    SessionPool,
+    StageSessions,
+    create_api,
+    stream_export,
+    version_tuple,
+)
+from zbx_audit import changed_owners
 
 BASE_DIR = pathlib.Path(__file__).parent
 
-
-(BASE_DIR / "backup").mkdir(exist_ok=True)
-
 STATUS_OK = C.OKGREEN + "завершено" + C.ENDC
 
-
-class BackupZabbix:
-    def __init__(self, url, login, password):
-        self.zbx = ZabbixAPI(server=url)
+# Сколько узлов сети запрашивать за один вызов host.get при разбиении по группам
+HOSTS_PAGE_SIZE = 5000
+
+# Сколько изображений скачивать за один вызов image.get
+IMAGES_BATCH_SIZE = 50
+
+# Сколько шаблонов сохранять в одной части экспорта (и импортировать за один вызов)
+TEMPLATES_CHUNK_SIZE = 50
+
+# Время последнего успешного копирования этапов, для инкрементного копирования
+BACKUP_STATE_NAME = "backup_state.json"
+
+
+class BackupZabbix(StageSessions):
+    def __init__(
+        self,
+        url,
+        login,
+        password,
+        workers: int = 1,
+        compression: str = None,
+        metrics_dir: pathlib.Path = None,
+        backup_dir: pathlib.Path = None,
+        engine: str = "threads",
+        compress_requests: bool = False,
+        storage: Storage = None,
+    ):
+        # Статистика всех вызовов API, сохраняется в конце работы
+        self.metrics = ApiMetrics()
+        self.metrics_dir = metrics_dir
+        # Максимальное количество одновременных запросов к Zabbix API
+        self.workers = max(1, workers)
+        # Фактическое количество подстраивается под нагрузку на сервер
+        self.scheduler = RequestScheduler(self.workers)
+        # Транспорт: "threads" (pyzabbix) или "async" (aiohttp, один сеанс)
+        self.engine = engine
+        self.zbx = create_api(
+            url,
+            engine,
+            max_in_flight=self.workers,
+            metrics=self.metrics,
+            scheduler=self.scheduler,
+            # Большие тела запросов (configuration.import) сжимаются gzip
+            compress_requests=compress_requests,
+        )
         self.login = login
         self.password = password
         self.api_version = self.zbx.api_version()
+        self.pool = None
+        # Состояние копирования общее для этапов, выполняемых одновременно
+        self._state_lock = threading.Lock()
+        # Файлы резервной копии, сжатие: None, "gzip" или "zstd".
+        # Готовое хранилище (MemoryStorage при переносе между серверами) заменяет папку
+        self.storage = storage or Storage(
+            backup_dir or BASE_DIR / "backup", compression
+        )
 
     def __enter__(self):
         self.zbx.login(self.login, self.password)
+        self.pool = SessionPool(self.zbx, self.workers)
         return self
 
     def __exit__(self, exc_type, exc_val, exc_tb):
+        self.pool.close()
         self.zbx.__exit__(exc_type, exc_val, exc_tb)
-        return self
 
-    def images(self):
+        # Отчет о вызовах API: JSON и файл для Prometheus node_exporter
+        report_path = self.metrics.write(
+            self.metrics_dir or self.storage.root,
+            "backup",
+            url=self.zbx.url,
+            api_version=self.api_version,
+            workers=self.workers,
+            engine=self.engine,
+            concurrency=self.scheduler.stats(),
+        )
+        print(f"\n    Отчет о вызовах API сохранен в {report_path}")
+
+    def images(self, full: bool = False):
         """
         Копируем все имеющиеся изображения в Zabbix
 
@@ -53,58 +126,109 @@ class BackupZabbix:
 
         Все файлы располагаются в папке backup/images/
 
+        Сведения о файлах хранятся в манифесте backup/images_manifest.json:
+            {
+                "crypto-router-24": {
+                    "imageid": "5",
+                    "name": "Crypto-router_(24)",
+                    "imagetype": "1",
+                    "file": "crypto-router-24_md5df68f84de7d40c7559ee530b64460c5d.json",
+                    "md5": "df68f84de7d40c7559ee530b64460c5d",
+                    "size": 1543
+                }
+            }
+
+        Копирование выполняется в два этапа: сначала запрашиваются только
+        метаданные изображений (ID, имя, тип) и сравниваются с манифестом,
+        затем пачками по IMAGES_BATCH_SIZE скачиваются только новые или
+        измененные изображения. Манифест перезаписывается атомарно в конце.
+
+        Zabbix не отдает хэш содержимого изображения, поэтому замена картинки
+        с сохранением ID, имени и типа по метаданным не видна. Для такого случая
+        используется `full=True` - повторно скачать все изображения.
+
+        :param full: скачать все изображения, не сверяясь с манифестом
         """
 
         print()
         print(C.OKBLUE, "---> Начинаем копировать изображения", C.ENDC, "\n")
 
-        (BASE_DIR / "backup" / "images").mkdir(exist_ok=True)
-
-        # Все изображения
-        img_list = self.zbx.image.get(output="extend", select_image=True)
-
-        # Существующие изображения
-        existed_files = [p.name for p in BASE_DIR.glob("backup/images/*.json")]
-        existed_images_name = [file.split("_md5")[0] for file in existed_files]
+        # Существующие изображения: слаг -> сведения о файле
+        manifest = load_images_manifest(self.storage)
         new_images_count = 0
         updated_images_count = 0
 
-        for img in img_list:
-            del img["imageid"]  # Удаляем id изображения
+        # Метаданные всех изображений, без содержимого
+        images_meta = self.zbx.image.get(output=["imageid", "name", "imagetype"])
+
+        # Изображения, которые изменились с прошлого копирования
+        changed_images_ids = []
+        for meta in images_meta:
+            saved = manifest.get(slugify(meta["name"]))
+            if (
+                not full
+                and saved is not None
+                and saved["imageid"] == meta["imageid"]
+                and saved["name"] == meta["name"]
+                and saved["imagetype"] == meta["imagetype"]
+            ):
+                continue
+            changed_images_ids.append(meta["imageid"])
 
-            json_str_image = json.dumps(img)
+        for i in range(0, len(changed_images_ids), IMAGES_BATCH_SIZE):
+            img_list = self.zbx.image.get(
+                imageids=changed_images_ids[i : i + IMAGES_BATCH_SIZE],
+                output="extend",
+                select_image=True,
+            )
 
-            image_slug = slugify(img["name"])
-            image_file_name = f"{image_slug}_md5{hashlib.md5(json_str_image.encode()).hexdigest()}.json"
+            for img in img_list:
+                image_id = img.pop("imageid")  # Удаляем id изображения
 
-            # Проверка наличия имени файла изображения в списке существующих файлов.
-            if image_file_name in existed_files:
-                # Пропускаем существующее бэкапы изображений
-                continue
+                json_str_image = json.dumps(img)
 
-            image_status = f"{C.OKGREEN} Добавлено"  # Если изображение новое
-            # Проверка наличия имени изображения в списке существующих изображений.
-            if image_slug in existed_images_name:
-                # Удаляем старые версии
-                old_file = (BASE_DIR / "backup/images").glob(f"{image_slug}_md5*")
-                for f in old_file:
-                    f.unlink()
-                image_status = f"{C.OKBLUE} Изменено "
-
-            with (BASE_DIR / "backup/images" / image_file_name).open("w") as file:
-                # print(image_status, C.OKCYAN, image_file_name, C.ENDC)
-                file.write(json_str_image)
-
-            if "Добавлено" in image_status:
-                new_images_count += 1
-            else:
-                updated_images_count += 1
+                image_slug = slugify(img["name"])
+                image_md5 = hashlib.md5(json_str_image.encode()).hexdigest()
+                image_file_name = f"{image_slug}_md5{image_md5}.json"
+
+                saved = manifest.get(image_slug)
+                manifest[image_slug] = {
+                    "imageid": image_id,
+                    "name": img["name"],
+                    "imagetype": img["imagetype"],
+                    "file": image_file_name,
+                    "md5": image_md5,
+                    "size": len(json_str_image),
+                }
+
+                # Файл с таким содержимым уже имеется
+                if saved is not None and saved["file"] == image_file_name:
+                    # Пропускаем существующее бэкапы изображений
+                    continue
+
+                image_status = f"{C.OKGREEN} Добавлено"  # Если изображение новое
+                # Проверка наличия имени изображения в манифесте.
+                if saved is not None:
+                    # Удаляем старую версию
+                    self.storage.unlink(f"images/{saved['file']}")
+                    image_status = f"{C.OKBLUE} Изменено "
+
+                with self.storage.open(f"images/{image_file_name}", "w") as file:
+                    # print(image_status, C.OKCYAN, image_file_name, C.ENDC)
+                    file.write(json_str_image)
+
+                if "Добавлено" in image_status:
+                    new_images_count += 1
+                else:
+                    updated_images_count += 1
+
+        self.storage.dump_json("images_manifest.json", manifest)
 
         print(
             f"    Резервное копирование изображений {STATUS_OK}\n",
             f"    {C.OKGREEN}Добавлено{C.ENDC}: {new_images_count}\n",
             f"    {C.OKBLUE}Обновлено{C.ENDC}: {updated_images_count}\n",
-            f"    {C.HEADER}Всего изображений{C.ENDC}: {len(existed_files) + new_images_count}",
+            f"    {C.HEADER}Всего изображений{C.ENDC}: {len(manifest)}",
         )
 
     def regexp(self):
@@ -151,10 +275,8 @@ class BackupZabbix:
         # Все макросы
         macros_list = self.zbx.usermacro.get(output="extend", globalmacro=True)
 
-        macros_file_path = BASE_DIR / "backup/global_macros.json"
-        with open(macros_file_path, "w") as file:
-            # Записываем в файл
-            json.dump(macros_list, file)
+        # Записываем в файл
+        self.storage.dump_json("global_macros.json", macros_list)
 
         print(
             f"    Резервное копирование глобальных макросов {STATUS_OK}\n",
@@ -173,52 +295,193 @@ class BackupZabbix:
 
         # Получение всех групп хостов из Zabbix и сохранение их в списке.
         host_groups = [hg["name"] for hg in self.zbx.hostgroup.get(output="extend")]
-        host_groups_file_path = BASE_DIR / "backup/host_groups.json"
-        # Открытие файла в режиме записи.
-        with open(host_groups_file_path, "w") as file:
-            json.dump(host_groups, file)
+        self.storage.dump_json("host_groups.json", host_groups)
 
         print(
             f"    Резервное копирование группы узлов сети {STATUS_OK}\n",
             f"    {C.HEADER}Всего имеется{C.ENDC}: {len(host_groups)}",
         )
 
-    def templates(self):
+    def templates(self, incremental: bool = False):
         """
         Копируем все имеющиеся шаблоны в Zabbix
 
-        Сохраняем в файле backup/templates.json
+        Шаблоны сохраняются частями не более TEMPLATES_CHUNK_SIZE штук в папке
+        backup/templates/. Части разбиты по уровням связей шаблонов: шаблоны уровня 0
+        не связаны с другими шаблонами, шаблоны уровня N связаны только с шаблонами
+        предыдущих уровней. Поэтому при восстановлении родительские шаблоны
+        импортируются раньше дочерних, а части одного уровня - параллельно.
+
+        Порядок и состав частей хранится в индексе backup/templates_index.json:
+            {
+                "levels": [["level-0-1.json", "level-0-2.json"], ["level-1-1.json"]],
+                "files": {"level-0-1.json": ["Template name", ...], ...}
+            }
+
+        Экспорт каждой части записывается на диск потоково, по мере получения ответа
+
+        :param incremental: экспортировать заново только части, в которых изменился
+            состав или шаблоны по журналу аудита с прошлого копирования
         """
 
         print()
         print(C.OKBLUE, "---> Начинаем копировать шаблоны", C.ENDC, "\n")
 
-        # Создание пути к файлу templates.json.
-        templates_file_path = BASE_DIR / "backup" / "templates.json"
+        # Изменения после этого момента попадут в следующее инкрементное копирование
+        started = time.time()
+        templates, index, export_jobs = self._templates_export_plan()
+
+        templates_names = {t["templateid"]: t["host"] for t in templates}
+        parts_count = len(export_jobs)
+        if incremental:
+            changed = self._changed_since_backup("templates", templates_names)
+            if changed is not None:
+                outdated = self._outdated_files("templates", index["files"], changed)
+                export_jobs = [job for job in export_jobs if job[0] in outdated]
+
+        # Экспорт частей выполняется параллельно, не более self.workers одновременно
+        templates_count = 0
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            futures = [
+                executor.submit(self._export_templates_chunk, file_name, templates_ids)
+                for file_name, templates_ids in export_jobs
+            ]
+            for future in as_completed(futures):
+                file_name, count = future.result()
+                templates_count += count
+                print(f"    {file_name} -> {count}")
 
-        templates = self.zbx.template.get(output=["id", "name"])
+        self.storage.dump_json("templates_index.json", index)
 
-        # Экспорт шаблонов в формате JSON.
-        export_template_data = self.zbx.configuration.export(
-            format="json", options={"templates": [t["templateid"] for t in templates]}
-        )
-        with templates_file_path.open("w") as file:
-            file.write(export_template_data)
+        # Удаляем части, которых больше нет, и файл шаблонов прежних версий
+        for old_file in self.storage.glob("templates/*.json"):
+            if old_file[len("templates/") :] not in index["files"]:
+                self.storage.unlink(old_file)
+        self.storage.unlink("templates.json")
+        self._save_backup_state("templates", started, templates=templates_names)
 
         print(
-            f"    Резервное копирование шаблонов {STATUS_OK}\n",
-            f"    {C.HEADER}Всего имеется{C.ENDC}: "
-            f"{len(json.loads(export_template_data)['zabbix_export']['templates'])}",
+            f"\n    Резервное копирование шаблонов {STATUS_OK}\n",
+            f"    {C.HEADER}Экспортировано шаблонов{C.ENDC}: {templates_count}\n",
+            f"    {C.HEADER}Экспортировано частей{C.ENDC}: "
+            f"{len(export_jobs)} из {parts_count}",
+        )
+
+    def _templates_export_plan(self) -> tuple:
+        """
+        Разбивает все шаблоны на части по уровням связей
+
+        :return: (шаблоны из template.get, индекс templates_index.json,
+            [(имя файла части, [ID шаблонов]), ...] в порядке уровней)
+        """
+
+        templates = self.zbx.template.get(
+            output=["templateid", "host"], selectParentTemplates=["templateid"]
         )
 
-    def hosts(self):
+        index = {"levels": [], "files": {}}
+        export_jobs = []
+        for level, level_templates in enumerate(self._templates_levels(templates)):
+            index["levels"].append([])
+            for i in range(0, len(level_templates), TEMPLATES_CHUNK_SIZE):
+                chunk = level_templates[i : i + TEMPLATES_CHUNK_SIZE]
+                file_name = f"level-{level}-{i // TEMPLATES_CHUNK_SIZE + 1}.json"
+                index["levels"][level].append(file_name)
+                index["files"][file_name] = sorted(t["host"] for t in chunk)
+                export_jobs.append((file_name, [t["templateid"] for t in chunk]))
+
+        return templates, index, export_jobs
+
+    @staticmethod
+    def _templates_levels(templates: list) -> list:
+        """
+        Разбивает шаблоны на уровни по связям с родительскими шаблонами
+
+        Уровень шаблона на единицу больше максимального уровня его родителей,
+        шаблоны без родителей имеют уровень 0
+
+        :param templates: шаблоны из template.get с полем parentTemplates
+        :return: список уровней, каждый уровень - список шаблонов
+        """
+
+        parents = {
+            t["templateid"]: [p["templateid"] for p in t.get("parentTemplates", [])]
+            for t in templates
+        }
+        levels = {}
+
+        for templateid in parents:
+            # Обход в глубину без рекурсии: цепочки связей могут быть длинными
+            stack = [templateid]
+            in_progress = set()
+            while stack:
+                current = stack[-1]
+                if current in levels:
+                    stack.pop()
+                    continue
+                unknown = [
+                    p
+                    for p in parents[current]
+                    if p in parents and p not in levels and p not in in_progress
+                ]
+                if unknown:
+                    in_progress.add(current)
+                    stack.extend(unknown)
+                    continue
+                # Родители из другого уровня или циклические ссылки не учитываются
+                levels[current] = 1 + max(
+                    (levels[p] for p in parents[current] if p in levels), default=-1
+                )
+                in_progress.discard(current)
+                stack.pop()
+
+        result = [[] for _ in range(max(levels.values(), default=-1) + 1)]
+        for template in templates:
+            result[levels[template["templateid"]]].append(template)
+        return result
+
+    def _export_templates_chunk(self, file_name: str, templates_ids: list) -> tuple:
+        """
+        Экспортирует часть шаблонов в файл backup/templates/<file_name>
+
+        Выполняется в отдельном потоке, использует сессию из пула
+
+        :return: имя файла и количество шаблонов в нем
+        """
+
+        # Записываем экспорт в файл по мере получения и одновременно считаем
+        # шаблоны, не загружая документ целиком
+        templates_counter = json_stream.ItemCounter("zabbix_export.templates.item")
+        with self.pool.session() as zbx, self.storage.open(
+            f"templates/{file_name}", "w"
+        ) as file:
+            export_chunks = stream_export(zbx, {"templates": templates_ids})
+            for _ in templates_counter(
+                json_stream.parse(json_stream.tee_to_file(export_chunks, file))
+            ):
+                pass
+
+        return file_name, templates_counter.count
+
+    def hosts(self, incremental: bool = False):
         """
         Сохраняем все узлы сети Zabbix
 
-        Узлы поделены на группы, каждая из которых представлена в виде своего .json файла,
-        который хранится в папке backup/hosts/
+        Каждый узел сети сохраняется ровно один раз: в файл первой группы (в порядке
+        hostgroup.get), в которую он входит. Файлы хранятся в папке backup/hosts/,
+        имя файла - слаг имени группы. Группы без "собственных" узлов файла не имеют.
 
-        Имя группы представлено в виде слага
+        Полный состав групп хранится в индексе backup/hosts_index.json:
+            {
+                "groups": {"слаг-группы": {"name": "Имя группы", "hosts": ["host", ...]}},
+                "files": {"слаг-группы.json": ["host", ...]}
+            }
+
+        Группы экспортируются параллельно, количество одновременных
+        запросов ограничено параметром `workers`
+
+        :param incremental: экспортировать заново только файлы, в которых изменился
+            состав или узлы сети по журналу аудита с прошлого копирования
         """
 
         print()
@@ -228,35 +491,246 @@ class BackupZabbix:
             C.ENDC,
         )
 
-        (BASE_DIR / "backup" / "hosts").mkdir(exist_ok=True)  # Создаем папку
+        # Изменения после этого момента попадут в следующее инкрементное копирование
+        started = time.time()
+        hosts_by_group = self._hosts_by_group()
+        index, export_jobs = self._hosts_export_plan(hosts_by_group)
+        hosts_count = sum(len(hosts_ids) for _, hosts_ids in export_jobs)
+
+        # Для поиска узлов сети, связанных с переименованными шаблонами
+        templates = {
+            t["templateid"]: t["host"]
+            for t in self.zbx.template.get(output=["templateid", "host"])
+        }
+
+        files_count = len(export_jobs)
+        if incremental:
+            hosts_names = {
+                hid: name
+                for group_hosts in hosts_by_group.values()
+                for hid, name in group_hosts.items()
+            }
+            changed = self._changed_since_backup("hosts", hosts_names, templates)
+            if changed is not None:
+                outdated = self._outdated_files("hosts", index["files"], changed)
+                export_jobs = [
+                    (group, hosts_ids)
+                    for group, hosts_ids in export_jobs
+                    if f'{slugify(group["name"])}.json' in outdated
+                ]
+
+        # Экспорт групп выполняется параллельно, не более self.workers одновременно
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            futures = [
+                executor.submit(self._export_hosts_group, group, hosts_ids)
+                for group, hosts_ids in export_jobs
+            ]
+            for future in as_completed(futures):
+                group, group_hosts_count = future.result()
+                print(f"    {group['name']} -> {group_hosts_count}")
+
+        self.storage.dump_json("hosts_index.json", index)
+
+        # Удаляем файлы групп, которые больше не содержат собственных узлов сети
+        for old_file in self.storage.glob("hosts/*.json"):
+            if old_file[len("hosts/") :] not in index["files"]:
+                self.storage.unlink(old_file)
+        self._save_backup_state("hosts", started, templates=templates)
+
+        print(
+            f"\n Резервное копирование узлов сети {STATUS_OK}\n",
+            f"   {C.HEADER}Всего узлов сети{C.ENDC}: {hosts_count}\n",
+            f"   {C.HEADER}Экспортировано файлов{C.ENDC}: "
+            f"{len(export_jobs)} из {files_count}",
+        )
+
+    def _hosts_export_plan(self, hosts_by_group: dict) -> tuple:
+        """
+        Распределяет узлы сети по файлам групп: каждый узел сети попадает
+        в файл первой группы, в которую он входит
+
+        :param hosts_by_group: результат _hosts_by_group()
+        :return: (индекс hosts_index.json, [(группа, [ID узлов сети файла]), ...])
+        """
 
         host_groups = self.zbx.hostgroup.get(output=["id", "name"])
 
+        index = {"groups": {}, "files": {}}
+        exported_hosts = set()  # ID узлов сети, которые уже попали в какой-либо файл
+        export_jobs = []
+
         for group in host_groups:
+            group_slug = slugify(group["name"])
+            group_hosts = hosts_by_group.get(group["groupid"], {})
 
-            hosts_file_path = (
-                BASE_DIR / "backup" / "hosts" / f'{slugify(group["name"])}.json'
+            index["groups"][group_slug] = {
+                "name": group["name"],
+                "hosts": sorted(group_hosts.values()),
+            }
+
+            # Узлы сети, которые еще не были сохранены в файлах других групп
+            own_hosts_ids = [hid for hid in group_hosts if hid not in exported_hosts]
+            if not own_hosts_ids:
+                continue
+            exported_hosts.update(own_hosts_ids)
+
+            index["files"][f"{group_slug}.json"] = sorted(
+                group_hosts[hid] for hid in own_hosts_ids
             )
+            export_jobs.append((group, own_hosts_ids))
 
-            hosts_ids = [
-                h["hostid"]
-                for h in self.zbx.host.get(groupids=[group["groupid"]], output="hostid")
-            ]
+        return index, export_jobs
+
+    def _changed_since_backup(self, stage: str, names: dict, templates: dict = None):
+        """
+        Имена узлов сети или шаблонов, экспорт которых изменился после прошлого
+        успешного копирования этапа, по журналу аудита
 
-            export_hosts_group_data = self.zbx.configuration.export(
-                format="json", options={"hosts": hosts_ids}
+        Экспорт содержит имена связанных шаблонов, поэтому переименование шаблона
+        меняет экспорт всех узлов сети и шаблонов, связанных с ним
+
+        :param stage: "hosts" или "templates"
+        :param names: {"ID": "техническое имя"} всех узлов сети или шаблонов этапа
+        :param templates: {"ID": "имя"} всех шаблонов, по умолчанию `names`
+        :return: множество имен или None, если нужно полное копирование
+        """
+
+        templates = names if templates is None else templates
+        state = self.storage.load_json(BACKUP_STATE_NAME, {}).get(stage)
+        owners = None
+        if state is not None:
+            owners = changed_owners(self.zbx, state["since"], self.api_version)
+
+        if owners is not None:
+            saved_templates = state.get("templates", {})
+            if not saved_templates.keys() <= templates.keys():
+                # Удаленный шаблон отвязан без записей о связанных объектах в журнале
+                owners = None
+            else:
+                renamed = [
+                    tid
+                    for tid, name in saved_templates.items()
+                    if templates[tid] != name
+                ]
+                if renamed and stage == "hosts":
+                    linked = self.zbx.host.get(templateids=renamed, output=["hostid"])
+                    owners |= {h["hostid"] for h in linked}
+                elif renamed:
+                    linked = self.zbx.template.get(
+                        parentTemplateids=renamed, output=["templateid"]
+                    )
+                    owners |= {t["templateid"] for t in linked}
+
+        if state is None:
+            print(
+                f"    {C.WARNING}Нет сведений о прошлом копировании,"
+                f" выполняется полное копирование{C.ENDC}"
             )
+            return None
+        if owners is None:
+            print(
+                f"    {C.WARNING}Журнал аудита не покрывает время с прошлого"
+                f" копирования, выполняется полное копирование{C.ENDC}"
+            )
+            return None
+        return {names[oid] for oid in owners if oid in names}
 
-            with hosts_file_path.open("w") as file:
-                file.write(export_hosts_group_data)
+    def _outdated_files(self, folder: str, files: dict, changed: set) -> set:
+        """
+        Файлы, которые нужно экспортировать заново: новые, отсутствующие
+        в резервной копии, с другим составом или с измененными объектами.
+        Остальные файлы уже содержат актуальный экспорт
 
-            print(f"    {group['name']} -> {len(hosts_ids)}")
+        Вызывается до записи нового индекса, прежний индекс берется из резервной копии
 
-        print(f"\n Резервное копирование узлов сети {STATUS_OK}")
+        :param folder: "hosts" или "templates"
+        :param files: новый индекс {"имя файла": [имена объектов], ...}
+        :param changed: имена измененных объектов
+        :return: имена файлов
+        """
+
+        saved_files = self.storage.load_json(f"{folder}_index.json", {}).get(
+            "files", {}
+        )
+        return {
+            file_name
+            for file_name, names in files.items()
+            if saved_files.get(file_name) != names
+            or not changed.isdisjoint(names)
+            or not self.storage.exists(f"{folder}/{file_name}")
+        }
+
+    def _save_backup_state(self, stage: str, since: float, **extra) -> None:
+        """
+        Запоминает время начала успешного копирования этапа
+        """
+
+        with self._state_lock:
+            state = self.storage.load_json(BACKUP_STATE_NAME, {})
+            state[stage] = {"since": since, **extra}
+            self.storage.dump_json(BACKUP_STATE_NAME, state)
+
+    def _hosts_by_group(self) -> dict:
+        """
+        Разбивает все узлы сети по группам за один проход по host.get
+
+        Сначала получаем только ID узлов сети, затем запрашиваем их группы
+        страницами по HOSTS_PAGE_SIZE узлов, вместо отдельного host.get для каждой группы
+
+        :return: словарь {"groupid": {"hostid": "техническое имя узла сети", ...}}
+        """
+
+        # Начиная с Zabbix 6.2 группы узлов сети выбираются через selectHostGroups
+        if version_tuple(self.api_version) >= (6, 2):
+            select_groups, groups_key = "selectHostGroups", "hostgroups"
+        else:
+            select_groups, groups_key = "selectGroups", "groups"
+
+        hosts_ids = [h["hostid"] for h in self.zbx.host.get(output=["hostid"])]
+
+        hosts_by_group = {}
+        for i in range(0, len(hosts_ids), HOSTS_PAGE_SIZE):
+            hosts = self.zbx.host.get(
+                hostids=hosts_ids[i : i + HOSTS_PAGE_SIZE],
+                output=["hostid", "host"],
+                **{select_groups: ["groupid"]},
+            )
+            for host in hosts:
+                for group in host[groups_key]:
+                    hosts_by_group.setdefault(group["groupid"], {})[host["hostid"]] = (
+                        host["host"]
+                    )
+
+        return hosts_by_group
+
+    def _export_hosts_group(self, group: dict, hosts_ids: list) -> tuple:
+        """
+        Экспортирует узлы сети группы в файл backup/hosts/<слаг группы>.json
+
+        Выполняется в отдельном потоке, использует сессию из пула
+
+        :param group: группа узлов сети {"groupid": "...", "name": "..."}
+        :param hosts_ids: ID узлов сети, которые сохраняются в файле этой группы
+        :return: группа и количество узлов сети в ней
+        """
+
+        hosts_file_name = f'hosts/{slugify(group["name"])}.json'
+
+        with self.pool.session() as zbx, self.storage.open(
+            hosts_file_name, "w"
+        ) as file:
+            # Записываем экспорт в файл по мере получения ответа
+            for chunk in stream_export(zbx, {"hosts": hosts_ids}):
+                file.write(chunk)
+
+        return group, len(hosts_ids)
 
     def maps(self):
         """
         Делаем резервное копирование карт сети
+
+        Экспорт обрабатывается потоково: триггеры линий связи удаляются
+        по мере чтения ответа, без загрузки всего документа в память
         """
         print()
         print(
@@ -266,26 +740,23 @@ class BackupZabbix:
         )
 
         maps_id = [m["sysmapid"] for m in self.zbx.map.get(output=["sysmapid"])]
-        export_maps_data = self.zbx.configuration.export(
-            format="json", options={"maps": maps_id}
+        export_chunks = stream_export(self.zbx, {"maps": maps_id})
+
+        # Смотрим все карты
+        maps_counter = json_stream.ItemCounter("zabbix_export.maps.item")
+        # Удаляем триггеры для линий связи, обнуляя триггер каждого линка на карте
+        maps_events = json_stream.replace(
+            maps_counter(json_stream.parse(export_chunks)),
+            "zabbix_export.maps.item.links.item.linktriggers",
+            [],
         )
 
-        # Удаляем триггеры для линий связи
-        maps_dict = json.loads(export_maps_data)
-        # Смотри все карты
-        maps_count = len(maps_dict["zabbix_export"]["maps"])
-        for i in range(maps_count):
-            # Смотрим все линки на карте
-            for j in range(len(maps_dict["zabbix_export"]["maps"][i]["links"])):
-                # Обнуляем триггер линка
-                maps_dict["zabbix_export"]["maps"][i]["links"][j]["linktriggers"] = []
-
-        with (BASE_DIR / "backup" / "maps.json").open("w") as file:
-            file.write(json.dumps(maps_dict))
+        with self.storage.open("maps.json", "w") as file:
+            json_stream.write_events(maps_events, file)
 
         print(
             f"    Резервное копирование {STATUS_OK}\n",
-            f"    {C.HEADER}Всего карт{C.ENDC}: {maps_count}",
+            f"    {C.HEADER}Всего карт{C.ENDC}: {maps_counter.count}",
         )
 
     def scripts(self):
@@ -318,8 +789,7 @@ class BackupZabbix:
         for scr in global_scripts:
             del scr["scriptid"]
 
-        with (BASE_DIR / "backup" / "global_scripts.json").open("w") as file:
-            file.write(json.dumps(global_scripts))
+        self.storage.dump_json("global_scripts.json", global_scripts)
 
         print(
             f"    Резервное копирование {STATUS_OK}\n",
@@ -372,8 +842,7 @@ class BackupZabbix:
                 group["rights"][i]["id"] = host_groups[group["rights"][i]["id"]]
             print(f"    -> {group['name']}")
 
-        with (BASE_DIR / "backup" / "user_groups.json").open("w") as file:
-            file.write(json.dumps(user_groups))
+        self.storage.dump_json("user_groups.json", user_groups)
 
         print(f"\n    Резервное копирование {STATUS_OK}\n")
 
@@ -428,8 +897,7 @@ class BackupZabbix:
 
         media_types = self.zbx.mediatype.get(output="extend", selectMedias="extend")
 
-        with (BASE_DIR / "backup" / "media_types.json").open("w") as file:
-            file.write(json.dumps(media_types))
+        self.storage.dump_json("media_types.json", media_types)
 
         print(f"    Резервное копирование {STATUS_OK}\n")
 
@@ -496,7 +964,6 @@ class BackupZabbix:
                 # Меняем ID на имя
                 mt["mediatypeid"] = media_types[mt["mediatypeid"]]
 
-        with (BASE_DIR / "backup" / "users.json").open("w") as file:
-            file.write(json.dumps(users))
+        self.storage.dump_json("users.json", users)
 
         print(f"    Резервное копирование {STATUS_OK}\n")
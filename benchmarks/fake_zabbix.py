@@ -0,0 +1,689 @@
+"""
+Локальный сервер JSON-RPC, имитирующий Zabbix API для нагрузочных тестов
+
+Объекты (узлы сети, группы, шаблоны, изображения и т.д.) не хранятся, а вычисляются
+по номеру, поэтому сервер может изображать Zabbix со 100 000 узлов сети.
+Созданные через API объекты (*.create, configuration.import) запоминаются,
+так что один и тот же сервер подходит как источник и как целевой сервер.
+
+Каждый вызов можно задержать на `latency` секунд, чтобы имитировать сеть
+и нагрузку на сервер. Сервер считает вызовы методов и переданные байты,
+статистика доступна через служебные методы:
+
+    benchmark.stats - {"calls": {"host.get": 3, ...}, "bytes_received": ..., "bytes_sent": ...}
+    benchmark.reset - обнуляет статистику
+"""
+
+import base64
+import gzip
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Поле с именем объекта и поле ID для объектов, создаваемых через API
+OBJECT_FIELDS = {
+    "hostgroup": ("name", "groupid"),
+    "usermacro": ("macro", "globalmacroid"),
+    "image": ("name", "imageid"),
+    "script": ("name", "scriptid"),
+    "usergroup": ("name", "usrgrpid"),
+    "mediatype": ("name", "mediatypeid"),
+    "user": ("username", "userid"),
+    "host": ("host", "hostid"),
+    "template": ("host", "templateid"),
+    "map": ("name", "sysmapid"),
+}
+
+# Поля, которые добавляются в ответ параметрами select*
+SELECT_FIELDS = {
+    "selectGroups": "groups",
+    "selectHostGroups": "hostgroups",
+    "selectParentTemplates": "parentTemplates",
+    "selectRights": "rights",
+    "selectUsrgrps": "usrgrps",
+    "selectMedias": "medias",
+}
+
+# Ошибка Zabbix API "Invalid params." (в том числе "объект уже существует")
+INVALID_PARAMS = -32602
+
+
+class FakeZabbixError(Exception):
+    def __init__(self, message: str, code: int = INVALID_PARAMS):
+        super().__init__(message)
+        self.code = code
+
+
+class Estate:
+    """
+    Синтетический набор объектов Zabbix
+
+    :param hosts: количество узлов сети
+    :param groups: количество групп узлов сети
+    :param templates: количество шаблонов
+    :param images: количество изображений
+    :param maps: количество карт сети
+    :param macros: количество глобальных макросов
+    :param scripts: количество глобальных скриптов
+    :param user_groups: количество групп пользователей
+    :param users: количество пользователей
+    :param media_types: количество способов оповещения
+    :param items_per_host: элементов данных в каждом узле сети и шаблоне
+    :param template_depth: длина цепочек связанных шаблонов
+    :param image_size: размер изображения в байтах
+    """
+
+    def __init__(
+        self,
+        hosts: int = 0,
+        groups: int = 0,
+        templates: int = 0,
+        images: int = 0,
+        maps: int = 0,
+        macros: int = 0,
+        scripts: int = 0,
+        user_groups: int = 0,
+        users: int = 0,
+        media_types: int = 0,
+        items_per_host: int = 10,
+        template_depth: int = 4,
+        image_size: int = 4096,
+    ):
+        self.hosts = hosts
+        self.groups = max(groups, 1) if hosts else groups
+        self.templates = templates
+        self.images = images
+        self.maps = maps
+        self.macros = macros
+        self.scripts = scripts
+        self.user_groups = user_groups
+        self.users = users
+        self.media_types = media_types
+        self.items_per_host = items_per_host
+        self.template_depth = max(template_depth, 1)
+        self.image_size = image_size
+
+    def as_dict(self) -> dict:
+        return dict(vars(self))
+
+    # Группы узлов сети
+
+    def group(self, g: int) -> dict:
+        return {"groupid": str(g), "name": f"Group {g}", "internal": "0", "flags": "0"}
+
+    # Узлы сети: основная группа по кругу, каждый пятый узел входит еще в одну группу
+
+    @staticmethod
+    def host_id(i: int) -> str:
+        return str(100000 + i)
+
+    def host_groups(self, i: int) -> list:
+        groups = [(i % self.groups) + 1]
+        if i % 5 == 0:
+            groups.append(((i * 7) % self.groups) + 1)
+        return sorted(set(groups))
+
+    def host(self, i: int) -> dict:
+        return {
+            "hostid": self.host_id(i),
+            "host": f"host-{i}",
+            "name": f"Host {i}",
+            "status": "0",
+        }
+
+    def host_export(self, i: int) -> dict:
+        return {
+            "host": f"host-{i}",
+            "name": f"Host {i}",
+            "groups": [{"name": f"Group {g}"} for g in self.host_groups(i)],
+            "interfaces": [
+                {"ip": f"10.{i >> 16 & 255}.{i >> 8 & 255}.{i & 255}", "port": "10050"}
+            ],
+            "items": [
+                {
+                    "name": f"Item {k}",
+                    "key": f"item.key[{k}]",
+                    "delay": "1m",
+                    "history": "7d",
+                    "tags": [{"tag": "component", "value": "system"}],
+                }
+                for k in range(self.items_per_host)
+            ],
+            "valuemaps": [{"name": "Service state", "mappings": [{"value": "0"}]}],
+        }
+
+    # Шаблоны: цепочки длиной template_depth, каждый шаблон связан с предыдущим
+
+    @staticmethod
+    def template_id(t: int) -> str:
+        return str(200000 + t)
+
+    def template_parent(self, t: int):
+        return t - 1 if (t - 1) % self.template_depth else None
+
+    def template(self, t: int) -> dict:
+        return {
+            "templateid": self.template_id(t),
+            "host": f"Template {t}",
+            "name": f"Template {t}",
+        }
+
+    def template_export(self, t: int) -> dict:
+        parent = self.template_parent(t)
+        return {
+            "template": f"Template {t}",
+            "name": f"Template {t}",
+            "groups": [{"name": "Templates"}],
+            "items": [
+                {"name": f"Item {k}", "key": f"template.key[{t},{k}]", "delay": "1m"}
+                for k in range(self.items_per_host)
+            ],
+            "templates": [{"name": f"Template {parent}"}] if parent else [],
+        }
+
+    # Изображения
+
+    def image(self, i: int, with_body: bool) -> dict:
+        image = {"imageid": str(i), "name": f"Image {i}", "imagetype": "1"}
+        if with_body:
+            image["image"] = base64.b64encode(
+                bytes([i % 256]) * self.image_size
+            ).decode()
+        return image
+
+    # Карты сети
+
+    def map_export(self, m: int) -> dict:
+        return {
+            "name": f"Map {m}",
+            "width": "800",
+            "height": "600",
+            "selements": [
+                {"elementtype": "0", "elements": [{"host": f"host-{m}"}]},
+            ],
+            "links": [
+                {
+                    "color": "00CC00",
+                    "linktriggers": [
+                        {"color": "DD0000", "trigger": {"description": "Down"}}
+                    ],
+                }
+            ],
+        }
+
+    # Прочие объекты
+
+    def objects(self, api_object: str) -> list:
+        if api_object == "usermacro":
+            return [
+                {
+                    "globalmacroid": str(i),
+                    "macro": f"{{$MACRO_{i}}}",
+                    "value": f"value {i}",
+                    "description": "",
+                    "type": "0",
+                }
+                for i in range(1, self.macros + 1)
+            ]
+        if api_object == "script":
+            return [
+                {
+                    "scriptid": str(i),
+                    "name": f"Script {i}",
+                    "command": "ping -c 3 {HOST.CONN};",
+                    "host_access": "2",
+                    "usrgrpid": "0",
+                    "groupid": "0",
+                    "description": "",
+                    "confirmation": "",
+                    "type": "0",
+                    "execute_on": "2",
+                }
+                for i in range(1, self.scripts + 1)
+            ]
+        if api_object == "usergroup":
+            return [
+                {
+                    "usrgrpid": str(i),
+                    "name": f"User group {i}",
+                    "gui_access": "0",
+                    "users_status": "0",
+                    "debug_mode": "0",
+                    "rights": (
+                        [{"permission": "2", "id": str((i % self.groups) + 1)}]
+                        if self.groups
+                        else []
+                    ),
+                }
+                for i in range(1, self.user_groups + 1)
+            ]
+        if api_object == "mediatype":
+            return [
+                {
+                    "mediatypeid": str(i),
+                    "name": f"Media type {i}",
+                    "type": "0",
+                    "smtp_server": "mail.example.com",
+                    "smtp_email": "zabbix@example.com",
+                    "status": "0",
+                    "maxsessions": "1",
+                    "parameters": [],
+                }
+                for i in range(1, self.media_types + 1)
+            ]
+        if api_object == "user":
+            return [
+                {
+                    "userid": str(i),
+                    "alias": f"user{i}",
+                    "username": f"user{i}",
+                    "name": f"User {i}",
+                    "surname": "",
+                    "autologin": "0",
+                    "autologout": "15m",
+                    "lang": "ru_RU",
+                    "refresh": "30s",
+                    "theme": "default",
+                    "rows_per_page": "50",
+                    "attempt_clock": "0",
+                    "attempt_failed": "0",
+                    "attempt_ip": "",
+                    "usrgrps": (
+                        [
+                            {
+                                "usrgrpid": str((i % self.user_groups) + 1),
+                                "name": f"User group {(i % self.user_groups) + 1}",
+                            }
+                        ]
+                        if self.user_groups
+                        else []
+                    ),
+                    "medias": (
+                        [
+                            {
+                                "mediaid": str(i),
+                                "userid": str(i),
+                                "mediatypeid": str((i % self.media_types) + 1),
+                                "sendto": [f"user{i}@example.com"],
+                                "active": "0",
+                                "severity": "63",
+                                "period": "1-7,00:00-24:00",
+                            }
+                        ]
+                        if self.media_types
+                        else []
+                    ),
+                }
+                for i in range(1, self.users + 1)
+            ]
+        return []
+
+
+class FakeZabbix:
+    """
+    Имитация Zabbix API поверх набора объектов `estate`
+
+    :param estate: синтетический набор объектов
+    :param latency: задержка каждого вызова в секундах
+    :param version: версия Zabbix API, которую сообщает сервер
+    :param gzip_responses: сжимать ответы, если клиент это поддерживает
+        (как веб-сервер с включенным gzip для application/json)
+    :param error_rate: доля вызовов, на которые сервер отвечает HTTP 503
+    :param capacity: сколько вызовов сервер выполняет одновременно,
+        на остальные он отвечает HTTP 503 (0 - без ограничения)
+    """
+
+    def __init__(
+        self,
+        estate: Estate,
+        latency: float = 0.0,
+        version: str = "6.0.20",
+        gzip_responses: bool = False,
+        error_rate: float = 0.0,
+        capacity: int = 0,
+    ):
+        self.estate = estate
+        self.latency = latency
+        self.version = version
+        self.gzip_responses = gzip_responses
+        self.error_rate = error_rate
+        self.capacity = capacity
+        self.in_flight = 0
+        self._random = random.Random(0)
+        # Объекты, созданные через API: объект -> {имя: объект}
+        self.created = {api_object: {} for api_object in OBJECT_FIELDS}
+        self._lock = threading.Lock()
+        # Начало журнала аудита: сутки назад, чтобы он покрывал и резервные копии,
+        # сделанные прошлыми запусками теста с тем же --backup-dir
+        self.started = time.time() - 24 * 3600
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.calls = {}
+            self.rejected = 0
+            self.bytes_received = 0
+            self.bytes_sent = 0
+
+    def admit(self) -> bool:
+        """
+        Принимает вызов или отклоняет его, имитируя перегрузку
+        """
+
+        with self._lock:
+            if (self.capacity and self.in_flight >= self.capacity) or (
+                self.error_rate and self._random.random() < self.error_rate
+            ):
+                self.rejected += 1
+                return False
+            self.in_flight += 1
+            return True
+
+    def done(self) -> None:
+        with self._lock:
+            self.in_flight -= 1
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "calls": dict(self.calls),
+                "rejected": self.rejected,
+                "bytes_received": self.bytes_received,
+                "bytes_sent": self.bytes_sent,
+            }
+
+    def count(self, method: str, received: int, sent: int):
+        with self._lock:
+            self.calls[method] = self.calls.get(method, 0) + 1
+            self.bytes_received += received
+            self.bytes_sent += sent
+
+    # Обработка вызовов
+
+    def call(self, method: str, params):
+        if method == "apiinfo.version":
+            return self.version
+        if method == "user.login":
+            return "0424bd59b807674191e7d77572075f33"
+        if method in ("user.logout", "user.checkAuthentication"):
+            return True
+        if method == "configuration.export":
+            return self.export(params["options"])
+        if method == "configuration.import":
+            return self.import_(json.loads(params["source"]))
+        if method == "settings.get":
+            return {"auditlog_enabled": "1"}
+        if method == "auditlog.get":
+            return self.auditlog(params)
+
+        api_object, _, api_method = method.partition(".")
+        if api_object not in OBJECT_FIELDS:
+            raise FakeZabbixError(f'Incorrect API "{api_object}".', -32601)
+
+        if api_method == "get":
+            return self.get(api_object, params)
+        if api_method in ("create", "createglobal"):
+            return self.create(api_object, params)
+        if api_method == "update":
+            objects = params if isinstance(params, list) else [params]
+            id_field = OBJECT_FIELDS[api_object][1]
+            return {f"{id_field}s": [obj.get(id_field, "0") for obj in objects]}
+
+        raise FakeZabbixError(f'Incorrect method "{method}".', -32601)
+
+    def get(self, api_object: str, params: dict) -> list:
+        estate = self.estate
+
+        if api_object == "hostgroup":
+            objects = [estate.group(g) for g in range(1, estate.groups + 1)]
+        elif api_object == "host":
+            numbers = range(1, estate.hosts + 1)
+            if "hostids" in params:
+                numbers = sorted(int(hostid) - 100000 for hostid in params["hostids"])
+                numbers = [i for i in numbers if 1 <= i <= estate.hosts]
+            objects = []
+            for i in numbers:
+                host = estate.host(i)
+                groups = [{"groupid": str(g)} for g in estate.host_groups(i)]
+                if "selectGroups" in params:
+                    host["groups"] = groups
+                if "selectHostGroups" in params:
+                    host["hostgroups"] = groups
+                objects.append(host)
+        elif api_object == "template":
+            objects = []
+            for t in range(1, estate.templates + 1):
+                template = estate.template(t)
+                if "selectParentTemplates" in params:
+                    parent = estate.template_parent(t)
+                    template["parentTemplates"] = (
+                        [{"templateid": estate.template_id(parent)}] if parent else []
+                    )
+                objects.append(template)
+        elif api_object == "image":
+            numbers = range(1, estate.images + 1)
+            if "imageids" in params:
+                numbers = [int(imageid) for imageid in params["imageids"]]
+            objects = [
+                estate.image(i, bool(params.get("select_image"))) for i in numbers
+            ]
+        elif api_object == "map":
+            objects = [
+                {"sysmapid": str(m), "name": f"Map {m}"}
+                for m in range(1, estate.maps + 1)
+            ]
+        else:
+            objects = estate.objects(api_object)
+
+        name_field, id_field = OBJECT_FIELDS[api_object]
+        with self._lock:
+            created = list(self.created[api_object].values())
+        objects += created
+
+        if "filter" in params and name_field in params["filter"]:
+            names = params["filter"][name_field]
+            names = set(names if isinstance(names, list) else [names])
+            objects = [obj for obj in objects if obj.get(name_field) in names]
+
+        output = params.get("output", "extend")
+        if isinstance(output, list):
+            fields = set(output) | {id_field}
+            fields |= {SELECT_FIELDS[key] for key in params if key in SELECT_FIELDS}
+            objects = [
+                {key: value for key, value in obj.items() if key in fields}
+                for obj in objects
+            ]
+
+        if params.get("limit"):
+            objects = objects[: int(params["limit"])]
+        return objects
+
+    def auditlog(self, params: dict) -> list:
+        """
+        Журнал аудита для инкрементного копирования. Объекты набора не меняются,
+        поэтому в журнале только одна запись о входе пользователя
+        """
+
+        records = [
+            {
+                "auditid": "1",
+                "clock": str(int(self.started)),
+                "action": "8",
+                "resourcetype": "0",
+                "resourceid": "1",
+            }
+        ]
+        time_from = params.get("time_from")
+        if time_from is not None:
+            records = [r for r in records if int(r["clock"]) >= int(time_from)]
+        output = params.get("output", "extend")
+        if isinstance(output, list):
+            records = [
+                {key: value for key, value in r.items() if key in output}
+                for r in records
+            ]
+        if params.get("limit"):
+            records = records[: int(params["limit"])]
+        return records
+
+    def create(self, api_object: str, params) -> dict:
+        objects = params if isinstance(params, list) else [params]
+        name_field, id_field = OBJECT_FIELDS[api_object]
+        if api_object == "user" and objects and "username" not in objects[0]:
+            name_field = "alias"
+
+        with self._lock:
+            existing = self.created[api_object]
+            estate_names = {o.get(name_field) for o in self.estate.objects(api_object)}
+            names = set()
+            for obj in objects:
+                name = obj.get(name_field)
+                if name in existing or name in estate_names or name in names:
+                    raise FakeZabbixError(f'Object "{name}" already exists.')
+                names.add(name)
+
+            ids = []
+            for obj in objects:
+                obj = dict(obj)
+                obj[id_field] = str(900000 + len(existing))
+                obj.setdefault(OBJECT_FIELDS[api_object][0], obj.get(name_field))
+                existing[obj.get(name_field)] = obj
+                ids.append(obj[id_field])
+        return {f"{id_field}s": ids}
+
+    def export(self, options: dict) -> str:
+        estate = self.estate
+        data = {"version": self.version[:3], "date": "2026-01-01T00:00:00Z"}
+
+        if "hosts" in options:
+            numbers = [int(hostid) - 100000 for hostid in options["hosts"]]
+            groups = sorted({g for i in numbers for g in estate.host_groups(i)})
+            data["groups"] = [{"name": f"Group {g}"} for g in groups]
+            data["hosts"] = [estate.host_export(i) for i in numbers]
+            if len(numbers) > 1:
+                data["triggers"] = [
+                    {
+                        "expression": f"last(/host-{numbers[0]}/item.key[0])"
+                        f"=0 and last(/host-{numbers[1]}/item.key[0])=0",
+                        "name": "Both hosts are down",
+                    }
+                ]
+
+        if "templates" in options:
+            numbers = [int(templateid) - 200000 for templateid in options["templates"]]
+            data["templates"] = [estate.template_export(t) for t in numbers]
+
+        if "maps" in options:
+            data["maps"] = [estate.map_export(int(m)) for m in options["maps"]]
+
+        return json.dumps({"zabbix_export": data})
+
+    def import_(self, source: dict) -> bool:
+        data = source.get("zabbix_export", {})
+        with self._lock:
+            for section, api_object, field in (
+                ("hosts", "host", "host"),
+                ("templates", "template", "template"),
+                ("maps", "map", "name"),
+            ):
+                created = self.created[api_object]
+                name_field, id_field = OBJECT_FIELDS[api_object]
+                for obj in data.get(section, []):
+                    name = obj[field]
+                    if name not in created:
+                        created[name] = {
+                            name_field: name,
+                            id_field: str(900000 + len(created)),
+                        }
+        return True
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    # Заголовки и тело пишутся отдельно, без этого каждый ответ ждет задержанного ACK
+    disable_nagle_algorithm = True
+    server: "FakeZabbixServer"
+
+    def log_message(self, *args):
+        pass
+
+    def do_POST(self):
+        fake = self.server.fake
+        body = self.rfile.read(int(self.headers["Content-Length"]))
+        received = len(body)
+        if self.headers.get("Content-Encoding") == "gzip":
+            body = gzip.decompress(body)
+        request = json.loads(body)
+        method = request["method"]
+
+        if not method.startswith("benchmark.") and not fake.admit():
+            self.send_response(503)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+
+        try:
+            if method == "benchmark.stats":
+                result = fake.stats()
+            elif method == "benchmark.reset":
+                result = fake.reset()
+            else:
+                try:
+                    if fake.latency:
+                        time.sleep(fake.latency)
+                    result = fake.call(method, request.get("params", {}))
+                finally:
+                    fake.done()
+            response = {"jsonrpc": "2.0", "result": result, "id": request["id"]}
+        except FakeZabbixError as e:
+            response = {
+                "jsonrpc": "2.0",
+                "error": {"code": e.code, "message": "Invalid params.", "data": str(e)},
+                "id": request["id"],
+            }
+
+        data = json.dumps(response).encode()
+        accept_encoding = self.headers.get("Accept-Encoding", "")
+        if fake.gzip_responses and "gzip" in accept_encoding and len(data) > 1024:
+            data = gzip.compress(data, compresslevel=1)
+            encoding = "gzip"
+        else:
+            encoding = None
+
+        if not method.startswith("benchmark."):
+            fake.count(method, received, len(data))
+
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        if encoding:
+            self.send_header("Content-Encoding", encoding)
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+
+class FakeZabbixServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, fake: FakeZabbix, port: int = 0):
+        super().__init__(("127.0.0.1", port), _Handler)
+        self.fake = fake
+
+    @property
+    def url(self) -> str:
+        return f"http://127.0.0.1:{self.server_address[1]}"
+
+
+def serve(estate: dict, options: dict, url_queue):
+    """
+    Запускает сервер (в отдельном процессе) и передает его адрес через `url_queue`
+
+    :param estate: параметры Estate
+    :param options: параметры FakeZabbix (latency, version, gzip_responses, ...)
+    """
+
+    server = FakeZabbixServer(FakeZabbix(Estate(**estate), **options))
+    url_queue.put(server.url)
+    server.serve_forever()
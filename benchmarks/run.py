@@ -0,0 +1,377 @@
+"""
+Нагрузочный тест резервного копирования и восстановления
+
+Запускает два локальных сервера, имитирующих Zabbix API (fake_zabbix.py):
+источник с синтетическим набором объектов и пустой целевой сервер. Затем
+выполняет этапы BackupZabbix на источнике и этапы RestoreZabbix на целевом
+сервере. Для каждого этапа измеряется:
+
+    wall_time_s     - время выполнения
+    api_calls       - количество вызовов каждого метода API
+    bytes_sent      - байт отправлено на сервер (тела запросов)
+    bytes_received  - байт получено от сервера (тела ответов)
+    peak_rss_kb     - пиковое потребление памяти процессом этапа
+
+Каждый этап выполняется в отдельном процессе, поэтому пиковое потребление
+памяти относится только к нему. Результаты сохраняются в JSON, чтобы сравнивать
+их между версиями.
+
+Пример:
+
+    python benchmarks/run.py --hosts 100000 --groups 5000 --templates 2000 \\
+        --images 500 --latency 5 --workers 8 --output results.json
+
+Инкрементное копирование: второй запуск с тем же --backup-dir и --incremental
+экспортирует заново только то, что изменилось по журналу аудита (в тестовом
+наборе ничего не меняется).
+"""
+
+import argparse
+import datetime
+import json
+import multiprocessing
+import os
+import pathlib
+import platform
+import queue
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+import requests
+
+BENCHMARKS_DIR = pathlib.Path(__file__).parent
+BASE_DIR = BENCHMARKS_DIR.parent
+
+# Модули проекта и fake_zabbix должны импортироваться и в дочерних процессах
+for path in (str(BASE_DIR), str(BENCHMARKS_DIR)):
+    if path not in sys.path:
+        sys.path.insert(0, path)
+
+import fake_zabbix  # noqa: E402
+
+# Этапы в порядке выполнения (как в zbx_migration.py)
+STAGES = [
+    "images",
+    "global_macros",
+    "host_groups",
+    "templates",
+    "hosts",
+    "maps",
+    "user_groups",
+    "scripts",
+    "media_types",
+    "users",
+]
+
+
+def rpc(url: str, method: str):
+    """
+    Вызов служебного метода тестового сервера
+    """
+
+    response = requests.post(
+        url, json={"jsonrpc": "2.0", "method": method, "params": {}, "id": 1}
+    )
+    response.raise_for_status()
+    return response.json()["result"]
+
+
+def peak_rss_kb() -> int:
+    """
+    Пиковое потребление памяти текущим процессом в килобайтах
+    """
+
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # В macOS значение в байтах, в Linux - в килобайтах
+    return peak // 1024 if sys.platform == "darwin" else peak
+
+
+def run_stage(kind: str, stage: str, url: str, options: dict, result_queue):
+    """
+    Выполняет один этап резервного копирования или восстановления.
+    Запускается в отдельном процессе
+
+    :param kind: "backup" или "restore"
+    :param stage: имя метода BackupZabbix/RestoreZabbix
+    :param url: адрес тестового сервера
+    :param options: workers, compression, backup_dir, engine, compress_requests,
+        incremental, verbose
+    :param result_queue: очередь для результата этапа
+    """
+
+    if not options["verbose"]:
+        sys.stdout = open(os.devnull, "w")
+
+    if kind == "backup":
+        from backup_zabbix import BackupZabbix as Action
+    else:
+        from restore_zabbix import RestoreZabbix as Action
+
+    error = None
+    action = Action(
+        url,
+        "Admin",
+        "zabbix",
+        workers=options["workers"],
+        compression=options["compression"],
+        backup_dir=pathlib.Path(options["backup_dir"]),
+        engine=options["engine"],
+        compress_requests=options["compress_requests"],
+    )
+    # Восстанавливаем узлы сети из всех групп, без вопроса пользователю
+    stage_kwargs = {"groups": []} if kind == "restore" and stage == "hosts" else {}
+    if kind == "backup" and stage in ("hosts", "templates"):
+        stage_kwargs = {"incremental": options["incremental"]}
+
+    with action:
+        # Вход на сервер не учитывается в статистике этапа
+        rpc(url, "benchmark.reset")
+        start = time.perf_counter()
+        try:
+            getattr(action, stage)(**stage_kwargs)
+        except Exception as e:
+            error = f"{type(e).__name__}: {e}"
+        wall_time = time.perf_counter() - start
+        stats = rpc(url, "benchmark.stats")
+
+    result_queue.put(
+        {
+            "kind": kind,
+            "stage": stage,
+            "wall_time_s": round(wall_time, 4),
+            "api_calls": stats["calls"],
+            "api_calls_total": sum(stats["calls"].values()),
+            "rejected_calls": stats["rejected"],
+            # Со стороны клиента: сервер получил - клиент отправил
+            "bytes_sent": stats["bytes_received"],
+            "bytes_received": stats["bytes_sent"],
+            "peak_rss_kb": peak_rss_kb(),
+            "concurrency": action.scheduler.stats(),
+            "error": error,
+        }
+    )
+
+
+def start_server(context, estate: dict, options: dict):
+    """
+    Запускает тестовый сервер в отдельном процессе
+
+    :return: процесс и адрес сервера
+    """
+
+    url_queue = context.Queue()
+    process = context.Process(
+        target=fake_zabbix.serve, args=(estate, options, url_queue), daemon=True
+    )
+    process.start()
+    return process, url_queue.get(timeout=30)
+
+
+def git_revision():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            cwd=BASE_DIR,
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Нагрузочный тест резервного копирования и восстановления Zabbix"
+    )
+    estate = parser.add_argument_group("набор объектов Zabbix")
+    estate.add_argument("--hosts", type=int, default=1000)
+    estate.add_argument("--groups", type=int, default=50)
+    estate.add_argument("--templates", type=int, default=100)
+    estate.add_argument("--images", type=int, default=50)
+    estate.add_argument("--maps", type=int, default=10)
+    estate.add_argument("--macros", type=int, default=50)
+    estate.add_argument("--scripts", type=int, default=10)
+    estate.add_argument("--user-groups", type=int, default=20)
+    estate.add_argument("--users", type=int, default=100)
+    estate.add_argument("--media-types", type=int, default=5)
+    estate.add_argument("--items-per-host", type=int, default=10)
+    estate.add_argument("--template-depth", type=int, default=4)
+    estate.add_argument("--image-size", type=int, default=4096)
+
+    server = parser.add_argument_group("тестовый сервер")
+    server.add_argument(
+        "--latency", type=float, default=0.0, help="задержка каждого вызова, мс"
+    )
+    server.add_argument("--zabbix-version", default="6.0.20")
+    server.add_argument(
+        "--server-gzip", action="store_true", help="сервер сжимает ответы gzip"
+    )
+    server.add_argument(
+        "--error-rate", type=float, default=0.0, help="доля ответов HTTP 503"
+    )
+    server.add_argument(
+        "--capacity",
+        type=int,
+        default=0,
+        help="сколько вызовов сервер выполняет одновременно, остальным HTTP 503",
+    )
+
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument(
+        "--compression", choices=["none", "gzip", "zstd"], default="gzip"
+    )
+    parser.add_argument("--engine", choices=["threads", "async"], default="threads")
+    parser.add_argument(
+        "--compress-requests",
+        action="store_true",
+        help="сжимать gzip большие тела запросов",
+    )
+    parser.add_argument(
+        "--stages",
+        nargs="+",
+        choices=STAGES,
+        default=STAGES,
+        help="этапы (по умолчанию все)",
+    )
+    parser.add_argument(
+        "--skip-restore", action="store_true", help="только резервное копирование"
+    )
+    parser.add_argument(
+        "--incremental",
+        action="store_true",
+        help="инкрементное копирование узлов сети и шаблонов (с --backup-dir"
+        " прошлого запуска)",
+    )
+    parser.add_argument(
+        "--backup-dir",
+        type=pathlib.Path,
+        help="папка резервной копии (по умолчанию временная)",
+    )
+    parser.add_argument(
+        "--verbose", action="store_true", help="показывать вывод этапов"
+    )
+    parser.add_argument(
+        "--output",
+        type=pathlib.Path,
+        default=BENCHMARKS_DIR / "results" / "latest.json",
+        help="файл результатов JSON",
+    )
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+
+    estate = fake_zabbix.Estate(
+        hosts=args.hosts,
+        groups=args.groups,
+        templates=args.templates,
+        images=args.images,
+        maps=args.maps,
+        macros=args.macros,
+        scripts=args.scripts,
+        user_groups=args.user_groups,
+        users=args.users,
+        media_types=args.media_types,
+        items_per_host=args.items_per_host,
+        template_depth=args.template_depth,
+        image_size=args.image_size,
+    ).as_dict()
+    server_options = {
+        "latency": args.latency / 1000,
+        "version": args.zabbix_version,
+        "gzip_responses": args.server_gzip,
+        "error_rate": args.error_rate,
+        "capacity": args.capacity,
+    }
+
+    context = multiprocessing.get_context("spawn")
+    source, source_url = start_server(context, estate, server_options)
+    target, target_url = start_server(context, {}, server_options)
+
+    with tempfile.TemporaryDirectory(prefix="zabbix-backup-") as tmp_dir:
+        stage_options = {
+            "workers": args.workers,
+            "compression": None if args.compression == "none" else args.compression,
+            "backup_dir": str(args.backup_dir or tmp_dir),
+            "engine": args.engine,
+            "compress_requests": args.compress_requests,
+            "incremental": args.incremental,
+            "verbose": args.verbose,
+        }
+
+        jobs = [("backup", stage, source_url) for stage in args.stages]
+        if not args.skip_restore:
+            jobs += [("restore", stage, target_url) for stage in args.stages]
+
+        results = []
+        for kind, stage, url in jobs:
+            result_queue = context.Queue()
+            process = context.Process(
+                target=run_stage, args=(kind, stage, url, stage_options, result_queue)
+            )
+            process.start()
+            process.join()
+            try:
+                result = result_queue.get(timeout=5)
+            except queue.Empty:
+                result = {
+                    "kind": kind,
+                    "stage": stage,
+                    "wall_time_s": 0,
+                    "api_calls": {},
+                    "api_calls_total": 0,
+                    "rejected_calls": 0,
+                    "bytes_sent": 0,
+                    "bytes_received": 0,
+                    "peak_rss_kb": 0,
+                    "concurrency": {},
+                    "error": f"Процесс этапа завершился с кодом {process.exitcode}",
+                }
+            results.append(result)
+
+            print(
+                f"{kind:8} {stage:14}",
+                f"{result['wall_time_s']:9.3f} s",
+                f"{result['api_calls_total']:7} calls",
+                f"{result['rejected_calls']:5} rejected",
+                f"{result['bytes_sent']:>12} B sent",
+                f"{result['bytes_received']:>12} B received",
+                f"{result['peak_rss_kb']:>9} KB RSS",
+                f"ERROR {result['error']}" if result["error"] else "",
+                file=sys.stderr,
+            )
+
+    source.terminate()
+    target.terminate()
+
+    report = {
+        "created": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+        "revision": git_revision(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "estate": estate,
+        "server": server_options,
+        "options": {
+            "workers": args.workers,
+            "compression": args.compression,
+            "engine": args.engine,
+            "compress_requests": args.compress_requests,
+        },
+        "results": results,
+    }
+
+    args.output.parent.mkdir(parents=True, exist_ok=True)
+    with args.output.open("w") as file:
+        json.dump(report, file, indent=2)
+    print(f"Результаты сохранены в {args.output}", file=sys.stderr)
+
+    return 1 if any(result["error"] for result in results) else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
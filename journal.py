@@ -0,0 +1,142 @@
+"""
+Журнал восстановления резервной копии
+
+Во время восстановления в папку резервной копии дописываются строки JSON
+(restore_journal.jsonl) о завершенных этапах и импортированных файлах вместе с
+хешем их содержимого:
+
+    {"url": "https://zabbix.example/api_jsonrpc.php", "started": 1700000000.0}
+    {"stage": "hosts", "item": "hosts/linux-servers.json", "sha256": "...", "time": ...}
+    {"stage": "host_groups", "item": null, "sha256": "...", "time": ...}
+
+При продолжении прерванного восстановления (resume) выполненная работа
+пропускается, если файл резервной копии с тех пор не изменился. Каждая строка
+записывается на диск сразу, поэтому журнал переживает аварийное завершение.
+"""
+
+import hashlib
+import json
+import os
+import threading
+import time
+
+from storage import Storage
+
+JOURNAL_NAME = "restore_journal.jsonl"
+
+# Размер части файла при вычислении хеша
+HASH_CHUNK_SIZE = 1024 * 1024
+
+
+class RestoreJournal:
+    """
+    Журнал выполненной работы восстановления
+
+    Без `resume` прежний журнал заменяется новым при первой записи, поэтому
+    этап plan и другие действия без изменений на сервере его не затрагивают
+
+    :param storage: хранилище резервной копии. Для хранилища без папки на диске
+        (MemoryStorage) журнал не ведется
+    :param url: адрес сервера, на который выполняется восстановление
+    :param resume: продолжить прерванное восстановление
+    """
+
+    def __init__(self, storage: Storage, url: str, resume: bool = False):
+        self.storage = storage
+        self.path = storage.root / JOURNAL_NAME if storage.root is not None else None
+        self.url = url
+        self.resume = resume
+        self._done = {}  # (этап, элемент) -> sha256
+        self._file = None
+        self._lock = threading.Lock()
+        if resume:
+            self._load()
+
+    def _load(self) -> None:
+        if self.path is None or not self.path.exists():
+            return
+
+        with self.path.open(encoding="utf-8") as file:
+            for line in file:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    # Строка, которую не успели дописать при аварийном завершении
+                    continue
+                if "url" in entry:
+                    if entry["url"] != self.url:
+                        # Журнал восстановления на другой сервер
+                        self._done.clear()
+                        return
+                    continue
+                self._done[(entry["stage"], entry["item"])] = entry["sha256"]
+
+    def digest(self, file_names, extra=None) -> str:
+        """
+        Хеш содержимого файлов резервной копии (в том виде, как они лежат на диске)
+
+        :param file_names: логические имена файлов, отсутствующие файлы пропускаются
+        :param extra: дополнительные данные, от которых зависит результат этапа
+            (например, отобранные узлы сети), должны сериализоваться в JSON
+        """
+
+        sha256 = hashlib.sha256()
+        for name in file_names:
+            path = self.storage.find(name)
+            sha256.update(name.encode() + b"\0")
+            if path is None:
+                continue
+            with path.open("rb") as file:
+                while chunk := file.read(HASH_CHUNK_SIZE):
+                    sha256.update(chunk)
+        if extra is not None:
+            sha256.update(json.dumps(extra, sort_keys=True).encode())
+        return sha256.hexdigest()
+
+    def is_done(self, stage: str, item, digest: str) -> bool:
+        """
+        Выполнена ли работа над тем же содержимым в прерванном восстановлении
+
+        :param item: имя файла или None - весь этап
+        """
+
+        return self.resume and self._done.get((stage, item)) == digest
+
+    def record(self, stage: str, item, digest: str) -> None:
+        """
+        Записывает выполненную работу в журнал
+
+        :param item: имя файла или None - весь этап
+        """
+
+        if self.path is None:
+            return
+
+        entry = {"stage": stage, "item": item, "sha256": digest, "time": time.time()}
+        with self._lock:
+            if self._file is None:
+                self._open()
+            self._done[(stage, item)] = digest
+            self._file.write(json.dumps(entry) + "\n")
+            self._file.flush()
+            os.fsync(self._file.fileno())
+
+    def _open(self) -> None:
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        if self.resume and self.path.exists() and self._done:
+            with self.path.open("rb") as file:
+                file.seek(-1, os.SEEK_END)
+                complete = file.read(1) == b"\n"
+            self._file = self.path.open("a", encoding="utf-8")
+            if not complete:
+                # Последняя строка оборвана при аварийном завершении
+                self._file.write("\n")
+            return
+        self._file = self.path.open("w", encoding="utf-8")
+        self._file.write(json.dumps({"url": self.url, "started": time.time()}) + "\n")
+
+    def close(self) -> None:
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
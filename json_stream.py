@@ -0,0 +1,423 @@
+"""
+Потоковая обработка больших JSON документов (экспорт конфигурации Zabbix)
+
+Документ читается частями и разбирается на события, как в ijson:
+
+    ("zabbix_export.maps.item", "start_map", None)
+    ("zabbix_export.maps.item", "map_key", "name")
+    ("zabbix_export.maps.item.name", "string", "Local network")
+
+Поэтому расход памяти не зависит от размера документа.
+"""
+
+import codecs
+import json
+import re
+
+CHUNK_SIZE = 64 * 1024
+
+# Пробелы и один токен: строка, знак пунктуации или литерал (число, true, false, null)
+_TOKEN_RE = re.compile(
+    r'[ \t\n\r]*(?:"([^"\\]*(?:\\.[^"\\]*)*)"|([{}\[\]:,])|([^ \t\n\r{}\[\]:,"]+))'
+)
+
+# Содержимое JSON строки до закрывающей кавычки (или до конца прочитанных данных)
+_STRING_BODY_RE = re.compile(r'[^"\\]*(?:\\.[^"\\]*)*')
+
+# Незавершенная escape-последовательность \uXXXX (или суррогатная пара) в конце данных
+_INCOMPLETE_ESCAPE_RE = re.compile(
+    r"(?<!\\)(?:\\\\)*"
+    r"(\\u(?:[dD][89abAB][0-9a-fA-F]{2}(?:\\(?:u[0-9a-fA-F]{0,3})?)?|[0-9a-fA-F]{0,3}))$"
+)
+
+_RPC_RESULT_RE = re.compile(r'"(result|error)"\s*:\s*')
+
+
+def read_chunks(file, size: int = CHUNK_SIZE):
+    """
+    Читает открытый файл частями по `size` символов
+    """
+
+    while True:
+        chunk = file.read(size)
+        if not chunk:
+            return
+        yield chunk
+
+
+def decode_chunks(byte_chunks, encoding: str = "utf-8"):
+    """
+    Преобразует поток байтов в поток строк, учитывая многобайтовые символы
+    на границе частей
+    """
+
+    decoder = codecs.getincrementaldecoder(encoding)()
+    for chunk in byte_chunks:
+        text = decoder.decode(chunk)
+        if text:
+            yield text
+    tail = decoder.decode(b"", final=True)
+    if tail:
+        yield tail
+
+
+def tee_to_file(chunks, file):
+    """
+    Записывает части документа в файл по мере их поступления и передает их дальше
+    """
+
+    for chunk in chunks:
+        file.write(chunk)
+        yield chunk
+
+
+def _decode_string(body: str) -> str:
+    if "\\" not in body:
+        return body
+    return json.loads(f'"{body}"')
+
+
+def iter_tokens(chunks):
+    """
+    Разбивает поток частей JSON документа на токены
+
+    :return: генератор кортежей (тип, значение), где тип:
+        "s" - строка (значение без кавычек, escape-последовательности не раскрыты),
+        "p" - знак пунктуации {}[]:,
+        "l" - литерал (число, true, false, null)
+    """
+
+    buffer = ""
+    for chunk in chunks:
+        buffer += chunk
+        pos = 0
+        while True:
+            match = _TOKEN_RE.match(buffer, pos)
+            # Токен не закончился в прочитанных данных, ждем следующую часть
+            if match is None or (
+                match.group(3) is not None and match.end() == len(buffer)
+            ):
+                break
+            pos = match.end()
+            string, punct, literal = match.groups()
+            if string is not None:
+                yield "s", string
+            elif punct is not None:
+                yield "p", punct
+            else:
+                yield "l", literal
+        buffer = buffer[pos:]
+
+    buffer = buffer.strip()
+    if buffer:
+        match = _TOKEN_RE.fullmatch(buffer)
+        if match is None or match.group(3) is None:
+            raise ValueError(f"Incomplete JSON document: {buffer[:100]!r}")
+        yield "l", match.group(3)
+
+
+def parse(chunks):
+    """
+    Разбирает JSON документ на события с префиксами в стиле ijson
+
+    События: start_map, map_key, end_map, start_array, end_array,
+    string, number, boolean, null
+
+    :return: генератор кортежей (префикс, событие, значение)
+    """
+
+    # Для каждого открытого контейнера: [тип, префикс контейнера, префикс значения]
+    stack = []
+    value_prefix = ""
+    expect_key = False
+
+    for kind, token in iter_tokens(chunks):
+        if kind == "s":
+            if expect_key:
+                key = _decode_string(token)
+                container = stack[-1]
+                yield container[1], "map_key", key
+                value_prefix = f"{container[1]}.{key}" if container[1] else key
+                container[2] = value_prefix
+                expect_key = False
+            else:
+                yield value_prefix, "string", _decode_string(token)
+
+        elif kind == "l":
+            if token == "true" or token == "false":
+                yield value_prefix, "boolean", token == "true"
+            elif token == "null":
+                yield value_prefix, "null", None
+            else:
+                yield value_prefix, "number", json.loads(token)
+
+        elif token == "{":
+            yield value_prefix, "start_map", None
+            stack.append(["map", value_prefix, value_prefix])
+            expect_key = True
+
+        elif token == "[":
+            yield value_prefix, "start_array", None
+            item_prefix = f"{value_prefix}.item" if value_prefix else "item"
+            stack.append(["array", value_prefix, item_prefix])
+            value_prefix = item_prefix
+
+        elif token == "}" or token == "]":
+            kind_, prefix, _ = stack.pop()
+            yield prefix, "end_map" if kind_ == "map" else "end_array", None
+            value_prefix = stack[-1][2] if stack else ""
+            expect_key = False
+
+        elif token == ",":
+            if stack and stack[-1][0] == "map":
+                expect_key = True
+            elif stack:
+                value_prefix = stack[-1][2]
+
+    if stack:
+        raise ValueError("Incomplete JSON document: unexpected end of data")
+
+
+def build_value(first_event: tuple, events):
+    """
+    Собирает Python объект из событий, начиная с уже прочитанного события `first_event`
+    """
+
+    _, event, value = first_event
+    if event == "start_map":
+        obj = {}
+        for item in events:
+            if item[1] == "end_map":
+                return obj
+            # map_key
+            obj[item[2]] = build_value(next(events), events)
+    if event == "start_array":
+        arr = []
+        for item in events:
+            if item[1] == "end_array":
+                return arr
+            arr.append(build_value(item, events))
+    return value
+
+
+def items(events, prefix: str):
+    """
+    Выдает по одному объекты, находящиеся по префиксу `prefix`
+    (например "zabbix_export.hosts.item")
+    """
+
+    events = iter(events)
+    for event in events:
+        if event[0] == prefix and event[1] not in ("map_key", "end_map", "end_array"):
+            yield build_value(event, events)
+
+
+def iter_value(first_event: tuple, events):
+    """
+    Выдает события одного значения, начиная с уже прочитанного `first_event`,
+    не собирая его целиком
+    """
+
+    yield first_event
+    if first_event[1] not in ("start_map", "start_array"):
+        return
+    depth = 1
+    for event in events:
+        yield event
+        if event[1] in ("start_map", "start_array"):
+            depth += 1
+        elif event[1] in ("end_map", "end_array"):
+            depth -= 1
+            if depth == 0:
+                return
+
+
+def skip_value(first_event: tuple, events) -> None:
+    """
+    Пропускает события значения, начиная с уже прочитанного `first_event`
+    """
+
+    if first_event[1] not in ("start_map", "start_array"):
+        return
+    depth = 1
+    for _, event, _ in events:
+        if event in ("start_map", "start_array"):
+            depth += 1
+        elif event in ("end_map", "end_array"):
+            depth -= 1
+            if depth == 0:
+                return
+
+
+def value_events(value, prefix: str):
+    """
+    Преобразует Python объект в события с префиксом `prefix`
+    """
+
+    if isinstance(value, dict):
+        yield prefix, "start_map", None
+        for key, item in value.items():
+            yield prefix, "map_key", key
+            yield from value_events(item, f"{prefix}.{key}" if prefix else key)
+        yield prefix, "end_map", None
+    elif isinstance(value, list):
+        yield prefix, "start_array", None
+        for item in value:
+            yield from value_events(item, f"{prefix}.item" if prefix else "item")
+        yield prefix, "end_array", None
+    elif isinstance(value, str):
+        yield prefix, "string", value
+    elif isinstance(value, bool):
+        yield prefix, "boolean", value
+    elif value is None:
+        yield prefix, "null", None
+    else:
+        yield prefix, "number", value
+
+
+def replace(events, prefix: str, value):
+    """
+    Заменяет все значения по префиксу `prefix` на `value`
+    """
+
+    events = iter(events)
+    for event in events:
+        if event[0] == prefix and event[1] not in ("map_key", "end_map", "end_array"):
+            skip_value(event, events)
+            yield from value_events(value, prefix)
+        else:
+            yield event
+
+
+class ItemCounter:
+    """
+    Считает объекты по префиксу, пропуская события дальше без изменений
+
+        counter = ItemCounter("zabbix_export.templates.item")
+        write_events(counter(parse(chunks)), file)
+        counter.count
+    """
+
+    def __init__(self, prefix: str):
+        self.prefix = prefix
+        self.count = 0
+
+    def __call__(self, events):
+        for event in events:
+            if event[0] == self.prefix and event[1] not in (
+                "map_key",
+                "end_map",
+                "end_array",
+            ):
+                self.count += 1
+            yield event
+
+
+def write_events(events, file) -> None:
+    """
+    Записывает события обратно в JSON (разделители как у json.dumps)
+    """
+
+    # Для каждого открытого контейнера: записан ли уже хотя бы один элемент
+    not_empty = []
+    after_key = False
+
+    for _, event, value in events:
+        if event == "map_key":
+            if not_empty[-1]:
+                file.write(", ")
+            not_empty[-1] = True
+            file.write(json.dumps(value))
+            file.write(": ")
+            after_key = True
+            continue
+
+        if event == "end_map" or event == "end_array":
+            not_empty.pop()
+            file.write("}" if event == "end_map" else "]")
+            continue
+
+        # Элемент массива
+        if not after_key and not_empty:
+            if not_empty[-1]:
+                file.write(", ")
+            not_empty[-1] = True
+        after_key = False
+
+        if event == "start_map":
+            file.write("{")
+            not_empty.append(False)
+        elif event == "start_array":
+            file.write("[")
+            not_empty.append(False)
+        else:
+            file.write(json.dumps(value))
+
+
+def iter_rpc_result(chunks):
+    """
+    Раскрывает строковый "result" ответа JSON-RPC по частям
+
+    Ответ configuration.export имеет вид {"jsonrpc": "2.0", "result": "<JSON строка>", "id": 1},
+    то есть документ экспорта закодирован как JSON строка. Части строки раскрываются
+    по мере чтения ответа, без загрузки его целиком.
+
+    Если вместо результата пришла ошибка, то ответ разбирается целиком
+    (он небольшой) и возвращается через исключение ValueError с телом ошибки
+    в атрибуте `error`.
+
+    :return: генератор частей раскрытой строки
+    """
+
+    chunks = iter(chunks)
+    head = ""
+
+    # Ищем начало результата
+    for chunk in chunks:
+        head += chunk
+        match = _RPC_RESULT_RE.search(head)
+        if match and match.end() < len(head):
+            break
+    else:
+        match = None
+
+    if match is None or match.group(1) == "error" or head[match.end()] != '"':
+        # Ошибка или нестроковый результат - небольшой ответ, читаем целиком
+        response = json.loads(head + "".join(chunks))
+        if "error" in response:
+            error = RPCError(response["error"].get("message", "Error"))
+            error.error = response["error"]
+            raise error
+        result = response["result"]
+        yield result if isinstance(result, str) else json.dumps(result)
+        return
+
+    buffer = head[match.end() + 1 :]
+    while True:
+        body = _STRING_BODY_RE.match(buffer).end()
+        closed = body < len(buffer) and buffer[body] == '"'
+
+        cut = body
+        if not closed:
+            incomplete = _INCOMPLETE_ESCAPE_RE.search(buffer, 0, body)
+            if incomplete:
+                cut = incomplete.start(1)
+
+        if cut:
+            yield _decode_string(buffer[:cut])
+        if closed:
+            return
+
+        buffer = buffer[cut:]
+        chunk = next(chunks, None)
+        if chunk is None:
+            raise ValueError("Unexpected end of JSON-RPC response")
+        buffer += chunk
+
+
+class RPCError(ValueError):
+    """
+    Ошибка JSON-RPC, полученная при потоковом чтении ответа
+    """
+
+    error: dict = None
@@ -0,0 +1,319 @@
+"""
+Перенос данных с одного сервера Zabbix на другой без промежуточных файлов
+
+MigrateZabbix подключается к обоим серверам одновременно. Экспорт BackupZabbix
+записывается в общее хранилище в памяти (MemoryStorage), откуда его читает
+импорт RestoreZabbix. Шаблоны и узлы сети передаются конвейером: части шаблонов
+и группы узлов сети экспортируются с источника и сразу импортируются в целевой
+сервер, поэтому время переноса близко к времени более медленной стороны,
+а не к сумме времени резервного копирования и восстановления.
+"""
+
+import collections
+import pathlib
+import queue
+import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+from slugify import slugify
+
+from backup_zabbix import BackupZabbix
+from restore_zabbix import (
+    IMPORT_BATCH_SECONDS,
+    PARENT_LEVEL_FAILED,
+    RestoreZabbix,
+    StageFailed,
+)
+from storage import MemoryStorage
+from zbx_colors import C
+
+BASE_DIR = pathlib.Path(__file__).parent
+
+STATUS_OK = C.OKGREEN + "завершено" + C.ENDC
+
+# Сколько экспортированных частей может ожидать импорта (помимо выполняемых)
+QUEUE_SIZE = 8
+
+# Файлы небольших этапов в хранилище (шаблоны fnmatch), удаляются после импорта.
+# Этапы могут выполняться одновременно, поэтому каждый удаляет только свои файлы
+STAGE_FILES = {
+    "images": ("images_manifest.json", "images/*"),
+    "global_macros": ("global_macros.json",),
+    "host_groups": ("host_groups.json",),
+    "maps": ("maps.json",),
+    "user_groups": ("user_groups.json",),
+    "scripts": ("global_scripts.json",),
+    "media_types": ("media_types.json",),
+    "users": ("users.json",),
+}
+
+
+class MigrateZabbix:
+    """
+    Перенос данных с сервера-источника на целевой сервер
+
+    Этапы называются так же, как этапы BackupZabbix и RestoreZabbix
+
+    :param source: (url, login, password) сервера-источника
+    :param target: (url, login, password) целевого сервера
+    :param workers: максимальное количество одновременных запросов к каждому серверу
+    :param queue_size: сколько экспортированных частей может ожидать импорта.
+        В памяти одновременно находится не более workers + queue_size частей
+    :param import_batch_seconds: желаемое время импорта одной пачки узлов сети
+    :param metrics_dir: папка для отчетов о вызовах API обоих серверов
+    :param kwargs: engine, compress_requests - для обоих серверов
+    """
+
+    def __init__(
+        self,
+        source: tuple,
+        target: tuple,
+        workers: int = 1,
+        queue_size: int = QUEUE_SIZE,
+        import_batch_seconds: float = IMPORT_BATCH_SECONDS,
+        metrics_dir: pathlib.Path = None,
+        **kwargs,
+    ):
+        self.workers = max(1, workers)
+        self.queue_size = max(1, queue_size)
+        self.storage = MemoryStorage()
+        metrics_dir = metrics_dir or BASE_DIR / "backup"
+        self.backup = BackupZabbix(
+            *source,
+            workers=self.workers,
+            metrics_dir=metrics_dir,
+            storage=self.storage,
+            **kwargs,
+        )
+        self.restore = RestoreZabbix(
+            *target,
+            workers=self.workers,
+            metrics_dir=metrics_dir,
+            storage=self.storage,
+            import_batch_seconds=import_batch_seconds,
+            **kwargs,
+        )
+
+    def __enter__(self):
+        self.backup.__enter__()
+        try:
+            self.restore.__enter__()
+        except BaseException:
+            self.backup.__exit__(*sys.exc_info())
+            raise
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        try:
+            self.restore.__exit__(exc_type, exc_val, exc_tb)
+        finally:
+            self.backup.__exit__(exc_type, exc_val, exc_tb)
+
+    @contextmanager
+    def stage_session(self):
+        """
+        Выполнение этапа в отдельном потоке с собственными сессиями обоих серверов
+        """
+        with self.backup.stage_session(), self.restore.stage_session():
+            yield self
+
+    def _copy_stage(self, stage: str):
+        """
+        Небольшой этап: экспорт с источника целиком, затем импорт в целевой сервер
+        """
+
+        try:
+            getattr(self.backup, stage)()
+            getattr(self.restore, stage)()
+        finally:
+            for pattern in STAGE_FILES[stage]:
+                for name in self.storage.glob(pattern):
+                    self.storage.unlink(name)
+
+    def images(self):
+        self._copy_stage("images")
+
+    def global_macros(self):
+        self._copy_stage("global_macros")
+
+    def host_groups(self):
+        self._copy_stage("host_groups")
+
+    def maps(self):
+        self._copy_stage("maps")
+
+    def user_groups(self):
+        self._copy_stage("user_groups")
+
+    def scripts(self):
+        self._copy_stage("scripts")
+
+    def media_types(self):
+        self._copy_stage("media_types")
+
+    def users(self):
+        self._copy_stage("users")
+
+    def templates(self):
+        """
+        Переносим шаблоны частями по уровням связей: части уровня N импортируются
+        только после всех частей предыдущих уровней, экспорт идет с опережением
+        """
+
+        print()
+        print(C.OKBLUE, "---> Начинаем переносить шаблоны", C.ENDC, "\n")
+
+        _, index, export_jobs = self.backup._templates_export_plan()
+        file_levels = {
+            file_name: level
+            for level, files in enumerate(index["levels"])
+            for file_name in files
+        }
+        rules = self.restore._templates_rules()
+
+        imported, failed = self._pipeline(
+            [
+                (file_levels[file_name], f"templates/{file_name}", (file_name, ids))
+                for file_name, ids in export_jobs
+            ],
+            self.backup._export_templates_chunk,
+            lambda name: self.restore._import_templates_file(name, rules),
+        )
+
+        print(f"    Перенос шаблонов {STATUS_OK}")
+        print(f"    Было перенесено шаблонов: {sum(imported.values())}")
+        self._print_failed(failed)
+
+    def hosts(self):
+        """
+        Переносим узлы сети: каждая группа импортируется, как только она экспортирована
+        """
+
+        print()
+        print(C.OKBLUE, "---> Начинаем переносить узлы сети", C.ENDC, "\n")
+
+        _, export_jobs = self.backup._hosts_export_plan(self.backup._hosts_by_group())
+        rules = self.restore._hosts_rules()
+
+        imported, failed = self._pipeline(
+            [
+                (0, f'hosts/{slugify(group["name"])}.json', (group, hosts_ids))
+                for group, hosts_ids in export_jobs
+            ],
+            self.backup._export_hosts_group,
+            lambda name: self.restore._import_hosts_file(
+                name[len("hosts/") :], None, rules
+            ),
+        )
+
+        print(f"    Перенос узлов сети {STATUS_OK}")
+        print(f"    {C.OKGREEN}Перенесено групп{C.ENDC}: {len(imported)}")
+        self._print_failed(failed)
+
+    @staticmethod
+    def _print_failed(failed: dict):
+        """
+        Выводит ошибки частей, этап с ошибками завершается StageFailed
+        """
+        if failed:
+            print(f"    {C.FAIL}Ошибки переноса{C.ENDC}: {len(failed)}")
+            for name, error in sorted(failed.items()):
+                print(f"      {name}: {C.FAIL}{error}{C.ENDC}")
+            raise StageFailed(len(failed))
+
+    def _pipeline(self, jobs: list, export, import_) -> tuple:
+        """
+        Экспорт с источника и импорт в целевой сервер одновременно
+
+        Части экспортируются параллельно, не более `workers`, и передаются на импорт
+        по мере готовности, импорт также выполняется не более чем в `workers` потоков.
+        Часть уровня N импортируется только после всех частей предыдущих уровней,
+        и только если все они импортированы без ошибок. Экспорт следующей части
+        начинается, только когда в памяти меньше workers + queue_size частей. Места занимаются в порядке `jobs`, поэтому
+        части текущего уровня всегда получают место и конвейер не останавливается
+
+        :param jobs: [(уровень, имя файла в хранилище, аргументы export), ...]
+            в порядке уровней
+        :param export: экспорт части в хранилище, вызывается с аргументами из jobs
+        :param import_: импорт части по имени файла в хранилище
+        :return: ({имя файла: результат import_}, {имя файла: ошибка})
+        """
+
+        slots = threading.Semaphore(self.workers + self.queue_size)
+        # События потоков экспорта и импорта: (вид, уровень, имя файла, значение)
+        events = queue.Queue()
+        remaining = collections.Counter(level for level, _, _ in jobs)
+        levels = sorted(remaining)
+        pending = {level: [] for level in levels}
+        imported, failed = {}, {}
+        # Наименьший уровень с ошибкой: части следующих уровней не импортируются
+        failed_level = None
+
+        def run_export(level: int, name: str, args: tuple):
+            try:
+                export(*args)
+            except Exception as e:
+                events.put(("failed", level, name, e))
+            else:
+                events.put(("exported", level, name, None))
+
+        def run_import(level: int, name: str):
+            try:
+                result = import_(name)
+            except Exception as e:
+                events.put(("failed", level, name, e))
+            else:
+                events.put(("imported", level, name, result))
+
+        with ThreadPoolExecutor(
+            max_workers=self.workers
+        ) as exporters, ThreadPoolExecutor(max_workers=self.workers) as importers:
+
+            def feed():
+                for level, name, args in jobs:
+                    slots.acquire()
+                    exporters.submit(run_export, level, name, args)
+
+            feeder = threading.Thread(target=feed, name="migrate-feeder", daemon=True)
+            feeder.start()
+
+            current = 0
+            finished = 0
+            while finished < len(jobs):
+                kind, level, name, value = events.get()
+                if kind == "exported":
+                    pending[level].append(name)
+                else:
+                    # Часть импортирована или не удалась - освобождаем память и место
+                    self.storage.unlink(name)
+                    slots.release()
+                    remaining[level] -= 1
+                    finished += 1
+                    if kind == "imported":
+                        imported[name] = value
+                        print(f"    -> {name}")
+                    else:
+                        failed[name] = value
+                        print(f"    -> {name} {C.FAIL}ошибка{C.ENDC}")
+                        if failed_level is None or level < failed_level:
+                            failed_level = level
+
+                # Переходим к следующему уровню, когда текущий полностью импортирован
+                while current < len(levels) and remaining[levels[current]] == 0:
+                    current += 1
+                if current < len(levels):
+                    current_level = levels[current]
+                    blocked = failed_level is not None and current_level > failed_level
+                    for pending_name in pending[current_level]:
+                        if blocked:
+                            error = PARENT_LEVEL_FAILED
+                            events.put(("failed", current_level, pending_name, error))
+                        else:
+                            importers.submit(run_import, current_level, pending_name)
+                    pending[current_level].clear()
+
+            feeder.join()
+
+        return imported, failed
@@ -1,44 +1,237 @@
+import functools
+import itertools
 import pathlib
 import json
 import random
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, as_completed, wait
 from string import ascii_letters, digits
 
 from slugify import slugify
-from pyzabbix import ZabbixAPI
 from pyzabbix import api
+import json_stream
+from journal import RestoreJournal
+from storage import Storage, load_images_manifest
+from zbx_metrics import ApiMetrics
+from zbx_scheduler import BatchSizer, RequestScheduler, is_overload_error
+from zbx_colors import C
+from zbx_api import SessionPool, StageSessions, create_api, version_tuple
+from zbx_export import export_object_names, iter_export_parts, join_parts
+from zbx_resolver import NameResolver
 
+BASE_DIR = pathlib.Path(__file__).parent
+STATUS_OK = C.OKGREEN + "завершено" + C.ENDC
 
-class C:
-    HEADER = "\033[95m"
-    OKBLUE = "\033[94m"
-    OKCYAN = "\033[96m"
-    OKGREEN = "\033[92m"
-    WARNING = "\033[93m"
-    FAIL = "\033[91m"
-    ENDC = "\033[0m"
-    BOLD = "\033[1m"
-    UNDERLINE = "\033[4m"
+# Сколько объектов передавать в одном вызове *.create
+BULK_CREATE_CHUNK_SIZE = 200
 
+# Сколько байт изображений (base64) карт сети передавать в одном configuration.import
+MAP_IMAGES_BATCH_SIZE = 4 * 1024 * 1024
 
-BASE_DIR = pathlib.Path(__file__).parent
-STATUS_OK = C.OKGREEN + "завершено" + C.ENDC
+# Желаемое время одного configuration.import узлов сети, секунд. Должно быть
+# заметно меньше таймаутов веб-сервера Zabbix (max_execution_time, proxy_read_timeout)
+IMPORT_BATCH_SECONDS = 20.0
+
+# Причина пропуска частей шаблонов следующих уровней
+PARENT_LEVEL_FAILED = "не импортирована часть предыдущего уровня"
+
+
+class StageFailed(Exception):
+    """
+    Этап выполнен не полностью: часть объектов не восстановлена.
+    Ошибки объектов уже выведены, этап считается завершившимся ошибкой
+    """
+
+    def __init__(self, failed: int):
+        super().__init__(f"не восстановлено объектов: {failed}")
+        self.failed = failed
 
 
-class RestoreZabbix:
-    def __init__(self, url, login, password):
-        self.zbx = ZabbixAPI(server=url)
+def journaled(*file_names):
+    """
+    Этап, который при продолжении восстановления (resume) пропускается,
+    если уже был выполнен с теми же файлами резервной копии
+
+    Этап записывается в журнал, только если он выполнен без ошибок: этап,
+    не восстановивший часть объектов (StageFailed), будет выполнен заново
+
+    :param file_names: файлы резервной копии, из которых восстанавливает этап
+    """
+
+    def decorator(stage):
+        @functools.wraps(stage)
+        def wrapper(self, *args, **kwargs):
+            digest = self.journal.digest(file_names)
+            if self.journal.is_done(stage.__name__, None, digest):
+                print()
+                print(C.OKBLUE, f"---> Этап {stage.__name__} уже выполнен", C.ENDC)
+                return None
+            try:
+                result = stage(self, *args, **kwargs)
+            except StageFailed:
+                print(
+                    f"    {C.WARNING}Этап {stage.__name__} не записан в журнал,"
+                    f" при продолжении он будет выполнен заново{C.ENDC}"
+                )
+                raise
+            self.journal.record(stage.__name__, None, digest)
+            return result
+
+        return wrapper
+
+    return decorator
+
+
+class RestoreZabbix(StageSessions):
+    def __init__(
+        self,
+        url,
+        login,
+        password,
+        workers: int = 1,
+        compression: str = None,
+        metrics_dir: pathlib.Path = None,
+        backup_dir: pathlib.Path = None,
+        engine: str = "threads",
+        compress_requests: bool = False,
+        storage: Storage = None,
+        resume: bool = False,
+        import_batch_seconds: float = IMPORT_BATCH_SECONDS,
+    ):
+        # Статистика всех вызовов API, сохраняется в конце работы
+        self.metrics = ApiMetrics()
+        self.metrics_dir = metrics_dir
+        # Максимальное количество одновременных запросов к Zabbix API
+        self.workers = max(1, workers)
+        # Фактическое количество подстраивается под нагрузку на сервер
+        self.scheduler = RequestScheduler(self.workers)
+        # Вес пачек импорта узлов сети подстраивается под время их импорта
+        self.batch_sizer = BatchSizer(import_batch_seconds)
+        # Транспорт: "threads" (pyzabbix) или "async" (aiohttp, один сеанс)
+        self.engine = engine
+        self.zbx = create_api(
+            url,
+            engine,
+            max_in_flight=self.workers,
+            metrics=self.metrics,
+            scheduler=self.scheduler,
+            # Большие тела запросов (configuration.import) сжимаются gzip
+            compress_requests=compress_requests,
+        )
         self.login = login
         self.password = password
         self.api_version = self.zbx.api_version()
+        # Имя -> ID групп, способов оповещения и т.п., общие для всех этапов
+        # (этапы могут выполняться одновременно, запросы - через сессию потока этапа)
+        self.resolver = NameResolver(lambda: self.zbx)
+        self.pool = None
+        # Файлы резервной копии, сжатие: None, "gzip" или "zstd".
+        # Готовое хранилище (MemoryStorage при переносе между серверами) заменяет папку
+        self.storage = storage or Storage(
+            backup_dir or BASE_DIR / "backup", compression
+        )
+        # Журнал выполненной работы, resume - пропускать то, что уже восстановлено
+        self.journal = RestoreJournal(self.storage, self.zbx.url, resume)
 
     def __enter__(self):
         self.zbx.login(self.login, self.password)
+        self.pool = SessionPool(self.zbx, self.workers)
         return self
 
     def __exit__(self, exc_type, exc_val, exc_tb):
+        self.pool.close()
+        self.journal.close()
         self.zbx.__exit__(exc_type, exc_val, exc_tb)
-        return self
 
+        # Отчет о вызовах API: JSON и файл для Prometheus node_exporter
+        report_path = self.metrics.write(
+            self.metrics_dir or self.storage.root,
+            "restore",
+            url=self.zbx.url,
+            api_version=self.api_version,
+            workers=self.workers,
+            engine=self.engine,
+            concurrency=self.scheduler.stats(),
+            import_batches=self.batch_sizer.stats(),
+        )
+        print(f"\n    Отчет о вызовах API сохранен в {report_path}")
+
+    def _bulk_create(self, method: str, objects: list) -> tuple:
+        """
+        Создает объекты пачками по BULK_CREATE_CHUNK_SIZE в одном вызове API
+
+        Zabbix отклоняет всю пачку, если хотя бы один объект не удалось создать.
+        В этом случае пачка делится пополам до тех пор, пока ошибочный объект
+        не останется один.
+
+        :param method: метод API, принимающий массив объектов, например "hostgroup.create"
+        :param objects: список объектов для создания
+        :return: (созданные объекты с ID из ответа API, уже существующие объекты,
+            [(объект, ошибка), ...])
+        """
+
+        api_object, api_method = method.split(".")
+        create = self.zbx[api_object][api_method]
+
+        created, existed, failed = [], [], []
+
+        # Стек пачек, первая пачка - в конце
+        chunks = [
+            objects[i : i + BULK_CREATE_CHUNK_SIZE]
+            for i in range(0, len(objects), BULK_CREATE_CHUNK_SIZE)
+        ][::-1]
+
+        while chunks:
+            chunk = chunks.pop()
+            try:
+                result = create(*chunk)
+                # Ответ вида {"groupids": [...]} - ID созданных объектов по порядку
+                for ids_field, ids in (result or {}).items():
+                    for obj, obj_id in zip(chunk, ids):
+                        obj[ids_field[:-1]] = obj_id
+                created.extend(chunk)
+            except api.ZabbixAPIException as e:
+                if len(chunk) > 1:
+                    # Делим пачку, чтобы найти объект с ошибкой
+                    middle = len(chunk) // 2
+                    chunks.extend([chunk[middle:], chunk[:middle]])
+                elif e.error and e.error["code"] == -32602:  # Уже есть такой объект
+                    existed.extend(chunk)
+                else:
+                    failed.append((chunk[0], e))
+
+        return created, existed, failed
+
+    def _resolve_created(
+        self, entity: str, created: list, existed: list, id_field: str
+    ) -> None:
+        """
+        Передает созданные _bulk_create объекты в self.resolver
+
+        :param existed: объекты, которые уже существовали: их ID неизвестны,
+            поэтому соответствие будет загружено заново
+        """
+
+        for obj in created:
+            self.resolver.add(entity, obj["name"], obj[id_field])
+        if existed:
+            self.resolver.invalidate(entity)
+
+    def _existing_names(self, method: str, field: str = "name", **params) -> set:
+        """
+        Одним запросом получает имена уже имеющихся на сервере объектов,
+        чтобы создавать только недостающие
+
+        :param method: метод API, например "hostgroup.get"
+        :param field: поле с именем объекта
+        :return: множество имен
+        """
+
+        api_object, api_method = method.split(".")
+        objects = self.zbx[api_object][api_method](output=[field], **params)
+        return {obj[field] for obj in objects}
+
+    @journaled("images_manifest.json")
     def images(self):
         """
         Восстанавливает изображения из резервной папки
@@ -49,12 +242,25 @@ class RestoreZabbix:
 
         existed_images = 0
         added_images = 0
+        failed_images = 0
 
-        # Поиск всех файлов в папке backup/images, которые заканчиваются на .json
-        for image_file in BASE_DIR.glob("backup/images/*.json"):
-            with open(image_file.absolute()) as file:
+        # Имеющиеся на сервере изображения
+        existed_names = self._existing_names("image.get")
+
+        # Файлы изображений берем из манифеста, без просмотра папки
+        for image in load_images_manifest(self.storage).values():
+            # Имя известно из манифеста, файл можно не читать
+            if image["name"] in existed_names:
+                existed_images += 1
+                continue
+
+            image_file = f"images/{image['file']}"
+            with self.storage.open(image_file) as file:
                 try:
                     image_data = json.load(file)
+                    if image_data["name"] in existed_names:
+                        existed_images += 1
+                        continue
                     # Создание нового изображения на сервере Zabbix.
                     self.zbx.image.create(**image_data)
                     added_images += 1
@@ -62,54 +268,66 @@ class RestoreZabbix:
                     print(
                         C.FAIL,
                         "Error to decode image file",
-                        image_file.absolute(),
+                        self.storage.find(image_file),
                         C.ENDC,
                     )
+                    failed_images += 1
 
                 except api.ZabbixAPIException as e:
                     if e.error["code"] == -32602:  # Уже есть такое изображение
                         existed_images += 1
                     else:
                         print(C.FAIL, e, C.ENDC)
+                        failed_images += 1
 
         print(f"    Восстановление {STATUS_OK}")
         print(f"    {C.OKGREEN}Было добавлено картинок{C.ENDC}: {added_images}")
         if existed_images:
             print(f"    {C.OKBLUE}Уже существовали{C.ENDC}: {existed_images}")
+        if failed_images:
+            raise StageFailed(failed_images)
 
+    @journaled("global_macros.json")
     def global_macros(self):
         print()
         print(
             C.OKBLUE, "---> Начинаем восстанавливать глобальные макросы", C.ENDC, "\n"
         )
 
-        macros_file = BASE_DIR / "backup" / "global_macros.json"
         existed_macros = 0
         added_macros = 0
+        failed = []
 
-        # Проверяем, существует ли файл macros_file.
-        if macros_file.exists():
-            # Открытие файла в режиме чтения.
-            with macros_file.open("r") as file:
-                data = json.load(file)
+        # Проверяем, существует ли файл global_macros.json.
+        if self.storage.exists("global_macros.json"):
+            data = self.storage.load_json("global_macros.json")
 
             for macro in data:
                 # Удаление ключа globalmacroid из словаря.
                 del macro["globalmacroid"]
-                try:
-                    self.zbx.usermacro.createglobal(**macro)
-                    added_macros += 1
-                except api.ZabbixAPIException as e:
-                    if e.error["code"] == -32602:  # Уже есть такой макрос
-                        existed_macros += 1
-                    else:
-                        print(C.FAIL, e, C.ENDC)
+
+            # Создаем только те макросы, которых еще нет на сервере
+            existed_names = self._existing_names(
+                "usermacro.get", "macro", globalmacro=True
+            )
+            new_macros = [m for m in data if m["macro"] not in existed_names]
+
+            created, existed, failed = self._bulk_create(
+                "usermacro.createglobal", new_macros
+            )
+            added_macros = len(created)
+            existed_macros = len(data) - len(new_macros) + len(existed)
+            for _, e in failed:
+                print(C.FAIL, e, C.ENDC)
 
         print(f"    Восстановление {STATUS_OK}")
         print(f"    {C.OKGREEN}Было добавлено макросов{C.ENDC}: {added_macros}")
         if existed_macros:
             print(f"    {C.OKBLUE}Уже существовали{C.ENDC}: {existed_macros}")
+        if failed:
+            raise StageFailed(len(failed))
 
+    @journaled("host_groups.json")
     def host_groups(self):
         """
         This function restores the host groups from the backup file
@@ -117,26 +335,31 @@ class RestoreZabbix:
         print()
         print(C.OKBLUE, "---> Начинаем восстанавливать группы узлов сети", C.ENDC, "\n")
 
-        host_groups_file = BASE_DIR / "backup" / "host_groups.json"
         existed_host_groups = 0
         added_host_groups = 0
+        failed = []
 
         # Проверка существования файла.
-        if host_groups_file.exists():
-            with host_groups_file.open("r") as file:
-                host_groups = json.load(file)
-
-            # Итерация по списку host_groups и присвоение значения каждого элемента в списке переменной gr_name.
-            for gr_name in host_groups:
-                try:
-                    # Создание группы хостов в Zabbix.
-                    self.zbx.hostgroup.create(name=gr_name)
-                    added_host_groups += 1
-                except api.ZabbixAPIException as e:
-                    if e.error["code"] == -32602:  # Уже есть такой макрос
-                        existed_host_groups += 1
-                    else:
-                        print(C.FAIL, e, C.ENDC)
+        if self.storage.exists("host_groups.json"):
+            host_groups = self.storage.load_json("host_groups.json")
+
+            # Создаем только те группы, которых еще нет на сервере
+            existed_names = self.resolver.names("hostgroup")
+            new_host_groups = [
+                {"name": gr_name}
+                for gr_name in host_groups
+                if gr_name not in existed_names
+            ]
+
+            # Создание групп хостов в Zabbix.
+            created, existed, failed = self._bulk_create(
+                "hostgroup.create", new_host_groups
+            )
+            added_host_groups = len(created)
+            existed_host_groups = len(host_groups) - len(new_host_groups) + len(existed)
+            for _, e in failed:
+                print(C.FAIL, e, C.ENDC)
+            self._resolve_created("hostgroup", created, existed, "groupid")
 
         print(f"    Восстановление {STATUS_OK}")
         print(
@@ -144,12 +367,65 @@ class RestoreZabbix:
         )
         if existed_host_groups:
             print(f"    {C.OKBLUE}Уже существовали{C.ENDC}: {existed_host_groups}")
+        if failed:
+            raise StageFailed(len(failed))
 
     def templates(self):
         print()
         print(C.OKBLUE, "---> Начинаем восстанавливать шаблоны", C.ENDC, "\n")
 
-        template_file_path = BASE_DIR / "backup" / "templates.json"
+        rules = self._templates_rules()
+
+        # Уровни выполняются по очереди, чтобы родительские шаблоны появились раньше
+        # дочерних. Части одного уровня импортируются параллельно, не более
+        # self.workers одновременно. Если часть уровня не импортирована, то
+        # следующие уровни не импортируются: их шаблоны могут ссылаться на нее
+        failed = {}
+        imported = 0
+        skipped = 0
+        for level in self._templates_levels():
+            if failed:
+                for file_name in level:
+                    failed[file_name] = PARENT_LEVEL_FAILED
+                    print(f"    -> {file_name} {C.FAIL}пропущен{C.ENDC}")
+                continue
+            with ThreadPoolExecutor(max_workers=self.workers) as executor:
+                futures = {
+                    executor.submit(
+                        self._import_templates_file, file_name, rules
+                    ): file_name
+                    for file_name in level
+                }
+                for future in as_completed(futures):
+                    file_name = futures[future]
+                    try:
+                        count = future.result()
+                    except Exception as e:
+                        failed[file_name] = e
+                        print(f"    -> {file_name} {C.FAIL}ошибка{C.ENDC}")
+                    else:
+                        if count is None:
+                            skipped += 1
+                            continue
+                        imported += count
+                        print(f"    -> {file_name}: {count}")
+
+        print(f"    Восстановление {STATUS_OK}")
+        print(f"    Было восстановлено шаблонов: {imported}")
+        if skipped:
+            print(
+                f"    {C.OKBLUE}Пропущено уже импортированных файлов{C.ENDC}: {skipped}"
+            )
+        if failed:
+            print(f"    {C.FAIL}Ошибки импорта{C.ENDC}: {len(failed)}")
+            for file_name, error in sorted(failed.items()):
+                print(f"      {file_name}: {C.FAIL}{error}{C.ENDC}")
+            raise StageFailed(len(failed))
+
+    def _templates_rules(self) -> dict:
+        """
+        Правила configuration.import для шаблонов с учетом версии Zabbix
+        """
 
         rules = {
             "templates": {
@@ -181,34 +457,167 @@ class RestoreZabbix:
 
             rules["templates"]["updateExisting"] = True
 
-        with template_file_path.open("r") as t_file:
-            template_data = t_file.read()
-        try:
-            # Импорт функции zbx.configuration.import из модуля zabbix_api.
-            zbx_import = getattr(self.zbx.configuration, "import")
-            # Импорт шаблона в Zabbix.
-            zbx_import(format="json", rules=rules, source=template_data)
-        except Exception as e:
-            print(C.FAIL, e, C.ENDC)
+        return rules
+
+    def _import_templates_file(self, file_name: str, rules: dict) -> int:
+        """
+        Импортирует одну часть шаблонов, используя сессию из пула
+
+        :param file_name: имя файла в резервной копии, например "templates/level-0-1.json"
+        :param rules: правила configuration.import
+        :return: количество шаблонов в файле, None - файл уже импортирован
+            в прерванном восстановлении
+        """
+
+        digest = self.journal.digest([file_name])
+        if self.journal.is_done("templates", file_name, digest):
+            return None
+
+        if file_name.startswith("templates/"):
+            # Шаблоны одного уровня не зависят друг от друга, поэтому часть
+            # импортируется пачками, не загружая файл целиком
+            count = 0
+            parts = self._file_parts(file_name, "templates", "template")
+            for batch in self._pack_parts(parts):
+                failed = self._import_batch(batch, "templates", rules)
+                if failed:
+                    raise failed[0][1]
+                count += sum(len(part["templates"]) for _, part in batch)
         else:
-            print(f"    Восстановление {STATUS_OK}")
-            print(
-                f"    Было восстановлено шаблонов:",
-                f"{len(json.loads(template_data)['zabbix_export']['templates'])}",
-            )
+            # Резервная копия прежних версий: все шаблоны в одном файле
+            # импортируются одним вызовом, чтобы связанные шаблоны создавались
+            # в нужном порядке
+            with self.storage.open(file_name) as t_file:
+                template_data = t_file.read()
+
+            with self.pool.session() as zbx:
+                # Импорт функции zbx.configuration.import из модуля zabbix_api.
+                zbx_import = getattr(zbx.configuration, "import")
+                # Импорт шаблонов в Zabbix.
+                zbx_import(format="json", rules=rules, source=template_data)
+            count = len(export_object_names([template_data], "templates", "template"))
+
+        # Импорт создает шаблоны (и группы в Zabbix 6.2+) без известных ID
+        self.resolver.invalidate("template")
+        self.resolver.invalidate("hostgroup")
+        self.journal.record("templates", file_name, digest)
+        return count
+
+    def _templates_levels(self) -> list:
+        """
+        Порядок импорта частей шаблонов из индекса backup/templates_index.json
+
+        Резервная копия прежних версий содержит все шаблоны в одном файле
+        backup/templates.json, он импортируется одним вызовом
+
+        :return: список уровней, каждый уровень - список имен файлов
+        """
+
+        index = self.storage.load_json("templates_index.json")
+        if index is None:
+            return [["templates.json"]] if self.storage.exists("templates.json") else []
+        return [
+            [f"templates/{file_name}" for file_name in level]
+            for level in index["levels"]
+        ]
+
+    @staticmethod
+    def ask_groups() -> list:
+        """
+        Запрашивает у пользователя группы узлов сети для восстановления
+        """
 
-    def hosts(self):
         input_groups = input(
-            "    Укажите названия файлов узлов сети через пробел (без .json),\n"
+            "    Укажите названия групп узлов сети через пробел (имена файлов без .json),\n"
             "    которые надо восстановить. Ничего не указывайте, если надо все.\n"
             " > "
         )
-        from_groups = [slugify(gr) for gr in input_groups.split()]
+        return input_groups.split()
+
+    def hosts(self, groups: list = None):
+        """
+        Восстанавливаем узлы сети
+
+        :param groups: имена групп узлов сети (или имена их файлов без .json),
+            которые надо восстановить, пустой список - все группы.
+            Если не указаны, то группы запрашиваются у пользователя
+        """
+
+        if groups is None:
+            groups = self.ask_groups()
+        from_groups = [slugify(gr) for gr in groups]
 
         print()
         print(C.OKBLUE, "---> Начинаем восстанавливать узлы сети", C.ENDC, "\n")
 
-        hosts_dir = BASE_DIR / "backup" / "hosts"
+        rules = self._hosts_rules()
+
+        # Узлы сети всех файлов потоково собираются в пачки по весу (см. _pack_parts),
+        # пачки импортируются параллельно, не более self.workers одновременно.
+        # Файл считается восстановленным, когда прочитаны и импортированы все его
+        # части. Ошибки собираются и выводятся в конце, не прерывая восстановление
+        files = {}  # имя файла -> состояние, см. _hosts_parts
+        skipped = []
+        failed = {}
+        imported = 0
+        batches = self._pack_parts(
+            self._hosts_parts(self._hosts_files(from_groups), files, skipped, failed)
+        )
+
+        def submit(batch):
+            running[executor.submit(self._import_batch, batch, "hosts", rules)] = batch
+
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            running = {}
+            for batch in itertools.islice(batches, self.workers):
+                submit(batch)
+            while running:
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    batch = running.pop(future)
+                    try:
+                        errors = {id(part): e for part, e in future.result()}
+                    except Exception as e:
+                        errors = {id(part): e for _, part in batch}
+                    for _, part in batch:
+                        file_name = part["file"]
+                        state = files[file_name]
+                        state["left"] -= 1
+                        if id(part) in errors:
+                            failed.setdefault(file_name, errors[id(part)])
+                        # Пачка с последней частью файла собирается только после
+                        # того, как файл дочитан, поэтому "read" здесь уже известно
+                        if state["left"] or not state["read"] or file_name in failed:
+                            continue
+                        self.journal.record("hosts", file_name, state["digest"])
+                        imported += 1
+                        print(f"    -> {file_name}")
+
+                    # Следующая пачка собирается с учетом времени импорта предыдущих
+                    for next_batch in itertools.islice(batches, 1):
+                        submit(next_batch)
+
+        for file_name in sorted(failed):
+            print(f"    -> {file_name} {C.FAIL}ошибка{C.ENDC}")
+
+        print(f"    Восстановление узлов сети {STATUS_OK}")
+        print(f"    {C.OKGREEN}Импортировано файлов{C.ENDC}: {imported}")
+        print(f"    {C.OKGREEN}Пачек импорта{C.ENDC}: {self.batch_sizer.batches}")
+        if skipped:
+            print(
+                f"    {C.OKBLUE}Пропущено уже импортированных файлов{C.ENDC}:"
+                f" {len(skipped)}"
+            )
+        if failed:
+            print(f"    {C.FAIL}Ошибки импорта{C.ENDC}: {len(failed)}")
+            for file_name, error in sorted(failed.items()):
+                print(f"      {file_name}: {C.FAIL}{error}{C.ENDC}")
+            raise StageFailed(len(failed))
+
+    def _hosts_rules(self) -> dict:
+        """
+        Правила configuration.import для узлов сети с учетом версии Zabbix
+        """
 
         rules = {
             "hosts": {
@@ -232,35 +641,206 @@ class RestoreZabbix:
         if self.api_version.startswith("5"):
             rules["applications"] = {"createMissing": True}
 
-        for hosts_file_path in hosts_dir.glob("*.json"):
+        return rules
 
-            # Проверка наличия имени файла в списке from_groups.
-            if from_groups and hosts_file_path.name[:-5] not in from_groups:
-                # Пропускаем ненужные файлы
-                continue
+    def _import_hosts_file(self, file_name: str, hosts_filter, rules: dict) -> bool:
+        """
+        Импортирует один файл узлов сети пачками по весу (см. _pack_parts)
+
+        :param file_name: имя файла группы узлов сети в папке hosts
+        :param hosts_filter: узлы сети, которые нужно оставить в файле, None - все
+        :param rules: правила configuration.import
+        :return: False, если файл уже импортирован в прерванном восстановлении
+        """
+
+        digest = self._hosts_file_digest(file_name, hosts_filter)
+        if self.journal.is_done("hosts", file_name, digest):
+            return False
+
+        parts = self._file_parts(f"hosts/{file_name}", "hosts", "host", hosts_filter)
+        for batch in self._pack_parts(parts):
+            failed = self._import_batch(batch, "hosts", rules)
+            if failed:
+                raise failed[0][1]
+
+        self.journal.record("hosts", file_name, digest)
+        return True
 
-            print(f"    -> {hosts_file_path.name}")
+    def _hosts_file_digest(self, file_name: str, hosts_filter) -> str:
+        # Результат зависит и от содержимого файла, и от выбранных узлов сети
+        return self.journal.digest(
+            [f"hosts/{file_name}"],
+            sorted(hosts_filter) if hosts_filter is not None else None,
+        )
+
+    def _file_parts(self, file_name: str, section: str, field: str, names=None):
+        """
+        Потоково делит файл экспорта на части (см. zbx_export.iter_export_parts),
+        файл не загружается в память целиком
 
-            # Открытие файла в режиме чтения.
-            with hosts_file_path.open("r") as file:
-                hosts_data = file.read()
+        :param file_name: имя файла в резервной копии
+        :param names: оставить только объекты с этими именами, None - все
+        :return: генератор (остальные секции части, часть)
+        """
+
+        def read_chunks():
+            with self.storage.open(file_name) as file:
+                yield from json_stream.read_chunks(file)
+
+        return iter_export_parts(read_chunks, section, field, names)
+
+    def _hosts_parts(self, files, progress: dict, skipped: list, failed: dict):
+        """
+        Перебирает части всех файлов узлов сети, которые нужно импортировать.
+        Файлы читаются по мере сборки пачек
+
+        :param files: результат _hosts_files()
+        :param progress: заполняется {имя файла: {"left": выдано и еще не импортировано
+            частей, "digest": хеш для журнала, "read": файл прочитан полностью}}
+        :param skipped: заполняется файлами, уже импортированными
+            в прерванном восстановлении
+        :param failed: заполняется {имя файла: ошибка} для файлов,
+            которые не удалось прочитать
+        :return: генератор (остальные секции части, часть с именем файла в "file")
+        """
+
+        for file_name, hosts_filter in files:
+            digest = self._hosts_file_digest(file_name, hosts_filter)
+            if self.journal.is_done("hosts", file_name, digest):
+                skipped.append(file_name)
+                continue
 
+            state = progress[file_name] = {"left": 0, "digest": digest, "read": False}
+            parts = self._file_parts(
+                f"hosts/{file_name}", "hosts", "host", hosts_filter
+            )
             try:
-                # Импорт функции zbx.configuration.import из модуля zabbix_api.
-                zbx_import = getattr(self.zbx.configuration, "import")
-                zbx_import(format="json", rules=rules, source=hosts_data)
+                for shared, part in parts:
+                    part["file"] = file_name
+                    state["left"] += 1
+                    yield shared, part
             except Exception as e:
-                print(C.FAIL, e, C.ENDC)
+                failed[file_name] = e
+                continue
+            state["read"] = True
+            if not state["left"]:
+                # В файле нет узлов сети для импорта
+                self.journal.record("hosts", file_name, digest)
 
-        print(f"    Восстановление узлов сети {STATUS_OK}")
+    def _pack_parts(self, parts):
+        """
+        Собирает части экспорта в пачки для configuration.import
+
+        Вес пачки не превышает текущий вес self.batch_sizer, который подстраивается
+        под время импорта: маленькие файлы объединяются в одну пачку, большие
+        делятся на несколько. Часть тяжелее этого веса импортируется отдельно.
+        Части читаются по мере сборки, поэтому в памяти находятся только
+        собираемая пачка и пачки в импорте
+
+        :param parts: итератор (остальные секции части, часть)
+        :return: генератор пачек [(остальные секции части, часть), ...]
+        """
+
+        batch, weight = [], 0
+        for shared, part in parts:
+            if batch and weight + part["weight"] > self.batch_sizer.weight:
+                yield batch
+                batch, weight = [], 0
+            batch.append((shared, part))
+            weight += part["weight"]
+        if batch:
+            yield batch
+
+    def _import_batch(self, batch: list, section: str, rules: dict) -> list:
+        """
+        Импортирует пачку узлов сети или шаблонов одним configuration.import,
+        используя сессию из пула. Если веб-сервер не успел ее импортировать
+        (перегрузка, таймаут), то пачка делится пополам и импортируется по частям
+
+        Zabbix отклоняет всю пачку из-за ошибки в одном объекте. Как и в _bulk_create,
+        такая пачка делится пополам, пока ошибка не останется в частях одного файла,
+        чтобы не считать ошибочными остальные файлы пачки
+
+        :param batch: [(остальные секции части, часть), ...]
+        :param section: "hosts" или "templates"
+        :param rules: правила configuration.import
+        :return: [(часть, ошибка), ...] - части, которые не удалось импортировать
+        """
+
+        source = json.dumps(join_parts(batch, section))
+        weight = sum(part["weight"] for _, part in batch)
+
+        started = time.perf_counter()
+        try:
+            with self.pool.session() as zbx:
+                # Импорт функции zbx.configuration.import из модуля zabbix_api.
+                zbx_import = getattr(zbx.configuration, "import")
+                zbx_import(format="json", rules=rules, source=source)
+        except Exception as e:
+            if len(batch) > 1 and is_overload_error(e):
+                self.batch_sizer.shrink()
+            elif len({part.get("file") for _, part in batch}) == 1:
+                # Части одного файла (или шаблоны): делить дальше незачем
+                return [(part, e) for _, part in batch]
+            # Половины собираются заново, большой документ больше не нужен
+            del source
+            middle = len(batch) // 2
+            failed = self._import_batch(batch[:middle], section, rules)
+            return failed + self._import_batch(batch[middle:], section, rules)
+
+        self.batch_sizer.record(weight, time.perf_counter() - started)
+        return []
+
+    def _hosts_files(self, from_groups: list):
+        """
+        Перебирает файлы узлов сети, которые нужно импортировать
+
+        Если имеется индекс backup/hosts_index.json, то каждый узел сети хранится
+        только в одном файле, а состав групп берется из индекса. При выборе
+        отдельных групп из файлов удаляются узлы сети, не входящие в эти группы.
+
+        Для резервных копий без индекса просто выбираются файлы по имени группы.
+
+        :param from_groups: слаги групп узлов сети, пустой список - все группы
+        :return: генератор кортежей (имя файла в папке hosts, узлы сети для фильтрации или None)
+        """
+
+        index = self.storage.load_json("hosts_index.json")
+
+        if index is None:
+            for hosts_file in self.storage.glob("hosts/*.json"):
+                file_name = hosts_file[len("hosts/") :]
+                # Проверка наличия имени файла в списке from_groups.
+                if from_groups and file_name[:-5] not in from_groups:
+                    # Пропускаем ненужные файлы
+                    continue
+                yield file_name, None
+            return
+
+        selected_hosts = set()
+        for group_slug in from_groups:
+            if group_slug not in index["groups"]:
+                print(f"    {C.WARNING}Нет такой группы{C.ENDC}: {group_slug}")
+                continue
+            selected_hosts.update(index["groups"][group_slug]["hosts"])
+
+        for file_name, file_hosts in index["files"].items():
+            if not from_groups:
+                yield file_name, None
+                continue
+
+            hosts_filter = selected_hosts.intersection(file_hosts)
+            if not hosts_filter:
+                continue
+            # Файл содержит только выбранные узлы сети, фильтр не нужен
+            if len(hosts_filter) == len(file_hosts):
+                hosts_filter = None
+            yield file_name, hosts_filter
 
     def maps(self):
         print()
         print(C.OKBLUE, "---> Начинаем восстанавливать карты сети", C.ENDC, "\n")
 
-        # Создание пути к файлу maps.json.
-        maps_file_path = BASE_DIR / "backup" / "maps.json"
-
         rules = {
             "images": {
                 "createMissing": True,
@@ -269,20 +849,74 @@ class RestoreZabbix:
             "maps": {"createMissing": True, "updateExisting": True},
         }
 
-        # Открытие файла в режиме чтения.
-        with maps_file_path.open("r") as file:
-            maps_data = file.read()
-
-        try:
-            # Импорт функции zbx.configuration.import из модуля zabbix_api.
-            zbx_import = getattr(self.zbx.configuration, "import")
-            # Импорт файла json в zabbix.
-            zbx_import(format="json", rules=rules, source=maps_data)
-        except Exception as e:
-            print(C.FAIL, e, C.ENDC)
+        digest = self.journal.digest(["maps.json"])
+        if self.journal.is_done("maps", None, digest):
+            print(f"    {C.OKBLUE}Карты сети уже восстановлены{C.ENDC}")
+            return
+
+        # Файл читается потоково: карты могут ссылаться друг на друга, поэтому
+        # импортируются одним вызовом, а изображения (иконки и фоны карт, основная
+        # часть экспорта) - заранее, пачками по MAP_IMAGES_BATCH_SIZE
+        maps_data = self._maps_export()
+
+        # Импорт функции zbx.configuration.import из модуля zabbix_api.
+        zbx_import = getattr(self.zbx.configuration, "import")
+        # Импорт файла json в zabbix. Ошибка импорта - ошибка этапа
+        for images in self._maps_images():
+            source = {"zabbix_export": {"version": maps_data["version"], **images}}
+            zbx_import(format="json", rules=rules, source=json.dumps(source))
+        zbx_import(
+            format="json", rules=rules, source=json.dumps({"zabbix_export": maps_data})
+        )
+        self.journal.record("maps", None, digest)
 
         print(f"    Восстановление карт сети {STATUS_OK}")
 
+    def _maps_events(self):
+        def read_chunks():
+            with self.storage.open("maps.json") as file:
+                yield from json_stream.read_chunks(file)
+
+        return json_stream.parse(read_chunks())
+
+    def _maps_export(self) -> dict:
+        """
+        Секции экспорта карт сети без изображений, см. _maps_images
+        """
+
+        events = self._maps_events()
+        data = {}
+        for prefix, event, value in events:
+            if prefix != "zabbix_export" or event != "map_key":
+                continue
+            first_event = next(events)
+            if value == "images":
+                json_stream.skip_value(first_event, events)
+            else:
+                data[value] = json_stream.build_value(first_event, events)
+        return data
+
+    def _maps_images(self):
+        """
+        Потоково читает изображения из экспорта карт сети
+
+        :return: генератор секций {"images": [...]} размером
+            не более MAP_IMAGES_BATCH_SIZE (изображение больше - отдельно)
+        """
+
+        batch, size = [], 0
+        for image in json_stream.items(
+            self._maps_events(), "zabbix_export.images.item"
+        ):
+            if batch and size + len(image["encodedImage"]) > MAP_IMAGES_BATCH_SIZE:
+                yield {"images": batch}
+                batch, size = [], 0
+            batch.append(image)
+            size += len(image["encodedImage"])
+        if batch:
+            yield {"images": batch}
+
+    @journaled("global_scripts.json")
     def scripts(self):
         """
         Восстанавливаем все глобальные скрипты Zabbix
@@ -295,29 +929,32 @@ class RestoreZabbix:
             C.ENDC,
         )
 
-        scripts_file_path = BASE_DIR / "backup" / "global_scripts.json"
-
-        with scripts_file_path.open("r") as file:
-            global_scripts: list = json.load(file)
-
-        new_scripts = 0
-        existed_scripts = 0
+        global_scripts: list = self.storage.load_json("global_scripts.json")
 
         for scr in global_scripts:
-
             scr.update({"scope": "2"})
-            try:
-                self.zbx.script.create(**scr)
-                new_scripts += 1
-            except Exception as e:
-                if "already exists" not in str(e):
-                    existed_scripts += 1
-                    print(C.FAIL, e, C.ENDC)
+
+        # Создаем только те скрипты, которых еще нет на сервере
+        existed_names = self._existing_names("script.get")
+        new_global_scripts = [
+            scr for scr in global_scripts if scr["name"] not in existed_names
+        ]
+
+        created, existed, failed = self._bulk_create(
+            "script.create", new_global_scripts
+        )
+        new_scripts = len(created)
+        existed_scripts = len(global_scripts) - len(new_global_scripts) + len(existed)
+        for _, e in failed:
+            print(C.FAIL, e, C.ENDC)
 
         print(f"    Восстановление {STATUS_OK}")
         print(f"    Добавлено {new_scripts}")
         print(f"    Уже имелось {existed_scripts}")
+        if failed:
+            raise StageFailed(len(failed))
 
+    @journaled("user_groups.json")
     def user_groups(self):
         """
         Восстанавливаем все группы пользователей Zabbix
@@ -329,35 +966,50 @@ class RestoreZabbix:
             C.ENDC,
         )
 
-        user_groups_file_path = BASE_DIR / "backup" / "user_groups.json"
-
-        with user_groups_file_path.open("r") as file:
-            user_groups: list = json.load(file)
+        user_groups: list = self.storage.load_json("user_groups.json")
 
         # Словарь групп узлов сети -> NAME: ID
         # Для того, чтобы сопоставить Имя текущей группы узлов сети с ID
         # Так как для восстановления требуется указать ID группы
-        host_groups = {
-            hg["name"]: hg["groupid"] for hg in self.zbx.hostgroup.get(output="extend")
-        }
+        host_groups = self.resolver.ids("hostgroup")
+
+        # Имеющиеся на сервере группы пользователей
+        existed_names = self.resolver.names("usergroup")
 
         # Итерация по списку user_groups и назначение каждой группы переменной group.
+        prepared_groups = []
+        not_prepared = 0
         for group in user_groups:
+            if group["name"] in existed_names:
+                print(f"    -> {group['name']} {C.OKBLUE}exists{C.ENDC}")
+                continue
             try:
                 for i, _ in enumerate(group["rights"]):
                     # Меняем имена разрешенных групп узлов сети на их актуальный ID
                     group["rights"][i]["id"] = host_groups[group["rights"][i]["id"]]
-                # Создание группы пользователей в Zabbix.
-                self.zbx.usergroup.create(**group)
-                print(f"    -> {group['name']}")
-            except api.ZabbixAPIException as e:
-                if e.error["code"] == -32602:  # Уже есть такая группа пользователей
-                    print(f"    -> {group['name']} {C.OKBLUE}exists{C.ENDC}")
             except Exception as e:
                 print(C.FAIL, e, C.ENDC)
+                not_prepared += 1
+            else:
+                prepared_groups.append(group)
+
+        # Создание групп пользователей в Zabbix.
+        created, existed, failed = self._bulk_create(
+            "usergroup.create", prepared_groups
+        )
+        for group in created:
+            print(f"    -> {group['name']}")
+        for group in existed:
+            print(f"    -> {group['name']} {C.OKBLUE}exists{C.ENDC}")
+        for _, e in failed:
+            print(C.FAIL, e, C.ENDC)
+        self._resolve_created("usergroup", created, existed, "usrgrpid")
 
         print(f"    Восстановление {STATUS_OK}")
+        if failed or not_prepared:
+            raise StageFailed(len(failed) + not_prepared)
 
+    @journaled("media_types.json")
     def media_types(self):
         """
         Восстанавливаем способы оповещения
@@ -370,40 +1022,59 @@ class RestoreZabbix:
             C.ENDC,
         )
 
-        with (BASE_DIR / "backup" / "media_types.json").open("r") as file:
-            media_types: list = json.load(file)
+        media_types: list = self.storage.load_json("media_types.json")
 
         added_media = 0
         updated_media = 0
+        failed_media = 0
+
+        # Имеющиеся на сервере способы оповещения: имя -> способ оповещения.
+        # Их ID нужны и этапу users
+        current_media_types = self.zbx.mediatype.get(output="extend")
+        self.resolver.load("mediatype", current_media_types)
+        existed_media_types = {mt["name"]: mt for mt in current_media_types}
 
         for mtype in media_types:
             try:
-                # Добавляем способ оповещения
-                self.zbx.mediatype.create(**mtype)
-                added_media += 1
-
-            except api.ZabbixAPIException as e:
-                if e.error["code"] == -32602:
-                    # Уже есть такой способ оповещения
-
-                    # Ищем имеющийся ID по его имени mtype["name"]
-                    mediatypeid = self.zbx.mediatype.get(
-                        output=["mediatypeid"], filter={"name": mtype["name"]}
-                    )[0]["mediatypeid"]
+                current = existed_media_types.get(mtype["name"])
+                if current is None:
+                    # Добавляем способ оповещения
+                    result = self.zbx.mediatype.create(**mtype)
+                    self.resolver.add(
+                        "mediatype", mtype["name"], result["mediatypeids"][0]
+                    )
+                    added_media += 1
 
+                elif self._media_type_changed(mtype, current):
+                    # Уже есть такой способ оповещения, но он отличается.
                     # Используем его ID для обновления
-                    mtype["mediatypeid"] = mediatypeid
+                    mtype["mediatypeid"] = current["mediatypeid"]
                     self.zbx.mediatype.update(**mtype)
                     updated_media += 1
 
             except Exception as e:
                 print(C.FAIL, e, C.ENDC)
+                failed_media += 1
 
         print(f"    Восстановление {STATUS_OK}")
         if added_media:
             print(f"    {C.OKGREEN}Добавлено{C.ENDC} : {added_media}")
         if updated_media:
             print(f"    {C.OKBLUE}Обновлено{C.ENDC} : {updated_media}")
+        if failed_media:
+            raise StageFailed(failed_media)
+
+    @staticmethod
+    def _media_type_changed(mtype: dict, current: dict) -> bool:
+        """
+        Отличается ли способ оповещения из резервной копии от имеющегося на сервере.
+        Сравниваются только поля, которые вернул сервер, кроме ID
+        """
+
+        for key, value in mtype.items():
+            if key != "mediatypeid" and key in current and current[key] != value:
+                return True
+        return False
 
     @staticmethod
     def generate_password(length: int = 9):
@@ -422,6 +1093,7 @@ class RestoreZabbix:
             new_passwd += random.choice(ascii_letters + digits)
         return new_passwd
 
+    @journaled("users.json")
     def users(self):
         """
         It restores users from a backup file
@@ -434,21 +1106,27 @@ class RestoreZabbix:
             C.ENDC,
         )
 
-        with (BASE_DIR / "backup" / "users.json").open("r") as file:
-            users: list = json.load(file)
+        users: list = self.storage.load_json("users.json")
 
         max_length_of_username = max([len(u["alias"]) for u in users])
 
-        user_groups = {
-            ug["name"]: ug["usrgrpid"] for ug in self.zbx.usergroup.get(output=["name"])
-        }
-        media_types = {
-            mt["name"]: mt["mediatypeid"]
-            for mt in self.zbx.mediatype.get(output=["name"])
-        }
+        user_groups = self.resolver.ids("usergroup")
+        media_types = self.resolver.ids("mediatype")
+
+        # Начиная с Zabbix 5.4 поле alias называется username
+        username_field = (
+            "username" if version_tuple(self.api_version) >= (5, 4) else "alias"
+        )
+        existed_names = self._existing_names("user.get", username_field)
+        failed_users = 0
 
         # Смотрим отсортированных по username пользователей
         for user in sorted(users, key=lambda u: u["alias"]):
+            if user["alias"] in existed_names:
+                print(
+                    f"    -> {user['alias']:{max_length_of_username}} {C.OKBLUE}exists{C.ENDC}"
+                )
+                continue
             try:
                 # Генерация случайного пароля для пользователя.
                 user_password = self.generate_password()
@@ -476,6 +1154,242 @@ class RestoreZabbix:
                     print(
                         f"    -> {user['alias']:{max_length_of_username}} {C.OKBLUE}exists{C.ENDC}"
                     )
+                else:
+                    print(C.FAIL, e, C.ENDC)
+                    failed_users += 1
 
             except Exception as e:
                 print(C.FAIL, e, C.ENDC)
+                failed_users += 1
+
+        if failed_users:
+            raise StageFailed(failed_users)
+
+    def plan(self) -> dict:
+        """
+        Составляет план восстановления, ничего не изменяя на сервере
+
+        Для каждого этапа определяется, какие объекты будут созданы, обновлены
+        или пропущены, сколько будет вызовов API и размер передаваемых
+        в configuration.import данных. Используются только файлы резервной
+        копии и запросы на чтение к серверу.
+
+        Шаблоны и узлы сети импортируются пачками, поэтому для них количество
+        вызовов - оценка по весу объектов и начальному весу пачки: во время
+        восстановления вес пачки подстраивается под фактическое время импорта.
+
+        План сохраняется в backup/restore_plan.json:
+            {
+                "host_groups": {
+                    "create": ["Имя группы", ...],
+                    "update": [],
+                    "skip": ["Имя группы", ...],
+                    "api_calls": 2,
+                    "import_bytes": {}
+                },
+                "hosts": {..., "import_bytes": {"group-1.json": 1048576, ...}},
+                ...
+            }
+
+        :return: план восстановления
+        """
+
+        print()
+        print(C.OKBLUE, "---> Составляем план восстановления", C.ENDC, "\n")
+
+        plan = {}
+
+        def stage(name, create=(), update=(), skip=(), api_calls=0, import_bytes=None):
+            plan[name] = {
+                "create": list(create),
+                "update": list(update),
+                "skip": list(skip),
+                "api_calls": api_calls,
+                "import_bytes": import_bytes or {},
+            }
+
+        def bulk_calls(count: int) -> int:
+            return -(-count // BULK_CREATE_CHUNK_SIZE)
+
+        def split(names, existed_names):
+            return (
+                [n for n in names if n not in existed_names],
+                [n for n in names if n in existed_names],
+            )
+
+        def load(file_name: str):
+            return self.storage.load_json(file_name, [])
+
+        def export_names(file_name: str, section: str, field: str) -> list:
+            with self.storage.open(file_name) as file:
+                return export_object_names(
+                    json_stream.read_chunks(file), section, field
+                )
+
+        def import_batches(parts) -> int:
+            # Пачки собираются так же, как при восстановлении, с начальным весом
+            return sum(1 for _ in self._pack_parts(parts))
+
+        # Изображения
+        images = load_images_manifest(self.storage)
+        image_names = []
+        for image in images.values():
+            if image["name"] is None:
+                image["name"] = self.storage.load_json(f"images/{image['file']}")[
+                    "name"
+                ]
+            image_names.append(image["name"])
+        create, skip = split(image_names, self._existing_names("image.get"))
+        stage("images", create, skip=skip, api_calls=1 + len(create))
+
+        # Глобальные макросы
+        macros = [m["macro"] for m in load("global_macros.json")]
+        create, skip = split(
+            macros, self._existing_names("usermacro.get", "macro", globalmacro=True)
+        )
+        stage("global_macros", create, skip=skip, api_calls=1 + bulk_calls(len(create)))
+
+        # Группы узлов сети
+        create, skip = split(load("host_groups.json"), self.resolver.names("hostgroup"))
+        stage("host_groups", create, skip=skip, api_calls=1 + bulk_calls(len(create)))
+
+        # Шаблоны: имеющиеся шаблоны обновляются импортом
+        templates_index = self.storage.load_json("templates_index.json")
+        templates_levels = self._templates_levels()
+        if templates_levels:
+            existed_templates = self.resolver.names("template")
+            create, update, import_bytes, api_calls = [], [], {}, 0
+            for file_name in sum(templates_levels, []):
+                if templates_index is not None:
+                    templates = templates_index["files"][file_name.split("/", 1)[1]]
+                else:
+                    templates = export_names(file_name, "templates", "template")
+                file_create, file_update = split(templates, existed_templates)
+                create += file_create
+                update += file_update
+                import_bytes[file_name] = self._import_payload_size(file_name)
+                if file_name.startswith("templates/"):
+                    api_calls += import_batches(
+                        self._file_parts(file_name, "templates", "template")
+                    )
+                else:
+                    # templates.json прежних версий импортируется одним вызовом
+                    api_calls += 1
+            stage(
+                "templates",
+                create,
+                update,
+                api_calls=api_calls,
+                import_bytes=import_bytes,
+            )
+
+        # Узлы сети: имеющиеся узлы сети обновляются импортом
+        existed_hosts = self._existing_names("host.get", "host")
+        hosts_index = self.storage.load_json("hosts_index.json")
+        create, update, import_bytes = [], [], {}
+        for file_name, _ in self._hosts_files([]):
+            if hosts_index is not None:
+                hosts = hosts_index["files"][file_name]
+            else:
+                hosts = export_names(f"hosts/{file_name}", "hosts", "host")
+            file_create, file_update = split(hosts, existed_hosts)
+            create += file_create
+            update += file_update
+            import_bytes[file_name] = self._import_payload_size(f"hosts/{file_name}")
+        # Части всех файлов узлов сети собираются в общие пачки
+        api_calls = import_batches(
+            itertools.chain.from_iterable(
+                self._file_parts(f"hosts/{file_name}", "hosts", "host")
+                for file_name in import_bytes
+            )
+        )
+        stage(
+            "hosts",
+            create,
+            update,
+            api_calls=api_calls,
+            import_bytes=import_bytes,
+        )
+
+        # Карты сетей
+        if self.storage.exists("maps.json"):
+            create, update = split(
+                export_names("maps.json", "maps", "name"),
+                self._existing_names("map.get"),
+            )
+            stage(
+                "maps",
+                create,
+                update,
+                api_calls=1,
+                import_bytes={"maps.json": self._import_payload_size("maps.json")},
+            )
+
+        # Группы пользователей
+        create, skip = split(
+            [g["name"] for g in load("user_groups.json")],
+            self.resolver.names("usergroup"),
+        )
+        stage("user_groups", create, skip=skip, api_calls=2 + bulk_calls(len(create)))
+
+        # Глобальные скрипты
+        create, skip = split(
+            [s["name"] for s in load("global_scripts.json")],
+            self._existing_names("script.get"),
+        )
+        stage("scripts", create, skip=skip, api_calls=1 + bulk_calls(len(create)))
+
+        # Способы оповещения: обновляются только отличающиеся
+        existed_media_types = {
+            mt["name"]: mt for mt in self.zbx.mediatype.get(output="extend")
+        }
+        create, update, skip = [], [], []
+        for mtype in load("media_types.json"):
+            current = existed_media_types.get(mtype["name"])
+            if current is None:
+                create.append(mtype["name"])
+            elif self._media_type_changed(mtype, current):
+                update.append(mtype["name"])
+            else:
+                skip.append(mtype["name"])
+        stage(
+            "media_types", create, update, skip, api_calls=1 + len(create) + len(update)
+        )
+
+        # Пользователи
+        username_field = (
+            "username" if version_tuple(self.api_version) >= (5, 4) else "alias"
+        )
+        create, skip = split(
+            [u["alias"] for u in load("users.json")],
+            self._existing_names("user.get", username_field),
+        )
+        stage("users", create, skip=skip, api_calls=3 + len(create))
+
+        # План читает человек, поэтому он сохраняется без сжатия
+        Storage(self.storage.root).dump_json("restore_plan.json", plan)
+
+        for name, item in plan.items():
+            print(
+                f"    {name:15}",
+                f"{C.OKGREEN}создать{C.ENDC}: {len(item['create']):<6}",
+                f"{C.OKBLUE}обновить{C.ENDC}: {len(item['update']):<6}",
+                f"{C.HEADER}пропустить{C.ENDC}: {len(item['skip']):<6}",
+                f"вызовов API: {item['api_calls']:<6}",
+                f"импорт: {sum(item['import_bytes'].values())} байт",
+            )
+        print(f"\n    План сохранен в {self.storage.find('restore_plan.json')}")
+
+        return plan
+
+    def _import_payload_size(self, file_name: str) -> int:
+        """
+        Размер файла экспорта в байтах после кодирования в JSON строку
+        параметра source метода configuration.import
+        """
+
+        size = 2  # Кавычки строки
+        with self.storage.open(file_name) as file:
+            for chunk in json_stream.read_chunks(file):
+                size += len(json.dumps(chunk)) - 2
+        return size
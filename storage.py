@@ -0,0 +1,269 @@
+"""
+Хранилище файлов резервной копии
+
+Все этапы резервного копирования и восстановления работают с файлами через
+`Storage` по логическим именам ("templates.json", "hosts/group-1.json").
+При записи файл сжимается потоково выбранным способом и получает расширение
+(.gz или .zst). При чтении находится любой из вариантов файла, поэтому старые
+несжатые резервные копии читаются без изменений.
+"""
+
+import fnmatch
+import gzip
+import io
+import json
+import os
+import pathlib
+import threading
+from contextlib import contextmanager
+
+try:
+    import zstandard
+except ImportError:  # zstd - необязательная зависимость
+    zstandard = None
+
+# Расширения файлов для способов сжатия
+COMPRESSION_SUFFIXES = {None: "", "gzip": ".gz", "zstd": ".zst"}
+
+
+class Storage:
+    """
+    Файлы резервной копии в папке `root` с потоковым сжатием
+
+    :param root: папка резервной копии, например BASE_DIR / "backup"
+    :param compression: None, "gzip" или "zstd" (требуется пакет zstandard)
+    """
+
+    def __init__(self, root: pathlib.Path, compression: str = None):
+        if compression not in COMPRESSION_SUFFIXES:
+            raise ValueError(f"Неизвестный способ сжатия: {compression}")
+        if compression == "zstd" and zstandard is None:
+            raise RuntimeError("Для сжатия zstd установите пакет zstandard")
+
+        self.root = pathlib.Path(root)
+        self.compression = compression
+
+    def find(self, name: str):
+        """
+        Находит файл с логическим именем `name` в любом из вариантов сжатия.
+        Если вариантов несколько, то берется самый новый
+
+        :return: путь к файлу или None
+        """
+
+        variants = [
+            path
+            for path in (
+                self.root / (name + suffix) for suffix in COMPRESSION_SUFFIXES.values()
+            )
+            if path.exists()
+        ]
+        if not variants:
+            return None
+        return max(variants, key=lambda path: path.stat().st_mtime)
+
+    def exists(self, name: str) -> bool:
+        return self.find(name) is not None
+
+    def size(self, name: str) -> int:
+        """
+        Размер файла на диске (после сжатия)
+        """
+        return self.find(name).stat().st_size
+
+    def glob(self, pattern: str) -> list:
+        """
+        Логические имена файлов по шаблону, например "hosts/*.json"
+        """
+
+        names = set()
+        for suffix in COMPRESSION_SUFFIXES.values():
+            for path in self.root.glob(pattern + suffix):
+                name = path.relative_to(self.root).as_posix()
+                names.add(name[: len(name) - len(suffix)] if suffix else name)
+        return sorted(names)
+
+    def unlink(self, name: str) -> None:
+        """
+        Удаляет все варианты файла
+        """
+        for suffix in COMPRESSION_SUFFIXES.values():
+            (self.root / (name + suffix)).unlink(missing_ok=True)
+
+    @contextmanager
+    def open(self, name: str, mode: str = "r"):
+        """
+        Открывает файл в текстовом режиме "r" или "w"
+
+        Запись выполняется во временный файл, который заменяет прежний только
+        после успешного завершения записи. Прежние варианты файла с другим
+        сжатием при этом удаляются.
+        """
+
+        if mode == "r":
+            path = self.find(name)
+            if path is None:
+                raise FileNotFoundError(self.root / name)
+            with _open_compressed(path, "r") as file:
+                yield file
+            return
+
+        if mode != "w":
+            raise ValueError(f"Неподдерживаемый режим: {mode}")
+
+        path = self.root / (name + COMPRESSION_SUFFIXES[self.compression])
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = path.with_name(path.name + ".tmp")
+        try:
+            with _open_compressed(tmp_path, "w") as file:
+                yield file
+        except BaseException:
+            tmp_path.unlink(missing_ok=True)
+            raise
+
+        os.replace(tmp_path, path)
+        for suffix in COMPRESSION_SUFFIXES.values():
+            other = self.root / (name + suffix)
+            if other != path:
+                other.unlink(missing_ok=True)
+
+    def load_json(self, name: str, default=None):
+        """
+        Загружает JSON файл, если его нет - возвращает `default`
+        """
+
+        if not self.exists(name):
+            return default
+        with self.open(name) as file:
+            return json.load(file)
+
+    def dump_json(self, name: str, data) -> None:
+        """
+        Атомарно записывает JSON файл
+        """
+
+        with self.open(name, "w") as file:
+            json.dump(data, file)
+
+
+class MemoryStorage(Storage):
+    """
+    Файлы в памяти, для переноса данных между серверами без промежуточных файлов
+
+    Файл существует от записи до удаления, поэтому прочитанные файлы нужно
+    удалять, чтобы расход памяти оставался ограниченным. У файлов нет пути
+    на диске: `root` и `find` возвращают None
+    """
+
+    def __init__(self):
+        self.root = None
+        self.compression = None
+        self._files = {}
+        self._lock = threading.Lock()
+
+    def find(self, name: str):
+        return None
+
+    def exists(self, name: str) -> bool:
+        with self._lock:
+            return name in self._files
+
+    def size(self, name: str) -> int:
+        with self._lock:
+            return len(self._files[name])
+
+    def glob(self, pattern: str) -> list:
+        with self._lock:
+            return sorted(fnmatch.filter(self._files, pattern))
+
+    def unlink(self, name: str) -> None:
+        with self._lock:
+            self._files.pop(name, None)
+
+    def clear(self) -> None:
+        """
+        Удаляет все файлы
+        """
+        with self._lock:
+            self._files.clear()
+
+    @contextmanager
+    def open(self, name: str, mode: str = "r"):
+        if mode == "r":
+            with self._lock:
+                if name not in self._files:
+                    raise FileNotFoundError(name)
+                content = self._files[name]
+            yield io.StringIO(content)
+            return
+
+        if mode != "w":
+            raise ValueError(f"Неподдерживаемый режим: {mode}")
+
+        file = io.StringIO()
+        yield file
+        with self._lock:
+            self._files[name] = file.getvalue()
+
+
+@contextmanager
+def _open_compressed(path: pathlib.Path, mode: str):
+    """
+    Открывает файл как текстовый поток, сжимая или распаковывая его
+    в зависимости от расширения
+    """
+
+    if path.name.endswith(".tmp"):
+        suffix = pathlib.Path(path.name[:-4]).suffix
+    else:
+        suffix = path.suffix
+
+    if suffix == ".gz":
+        with gzip.open(path, mode + "t", encoding="utf-8", compresslevel=6) as file:
+            yield file
+
+    elif suffix == ".zst":
+        if zstandard is None:
+            raise RuntimeError(f"Для чтения {path} установите пакет zstandard")
+        with path.open(mode + "b") as raw:
+            if mode == "r":
+                stream = zstandard.ZstdDecompressor().stream_reader(raw)
+            else:
+                stream = zstandard.ZstdCompressor().stream_writer(raw)
+            with io.TextIOWrapper(stream, encoding="utf-8") as file:
+                yield file
+
+    else:
+        with path.open(mode, encoding="utf-8") as file:
+            yield file
+
+
+def load_images_manifest(storage: Storage) -> dict:
+    """
+    Загружает манифест изображений images_manifest.json
+
+    Если манифеста нет (резервная копия сделана старой версией), то он
+    один раз строится по именам файлов в папке изображений. ID, имя и тип
+    изображения в этом случае неизвестны и будут заполнены при следующем копировании.
+
+    :param storage: хранилище резервной копии
+    :return: словарь {"слаг изображения": {"file": ..., "md5": ..., "size": ..., ...}}
+    """
+
+    manifest = storage.load_json("images_manifest.json")
+    if manifest is not None:
+        return manifest
+
+    manifest = {}
+    for name in storage.glob("images/*.json"):
+        file_name = name.split("/", 1)[1]
+        image_slug, _, image_md5 = file_name[:-5].partition("_md5")
+        manifest[image_slug] = {
+            "imageid": None,
+            "name": None,
+            "imagetype": None,
+            "file": file_name,
+            "md5": image_md5,
+            "size": storage.size(name),
+        }
+    return manifest
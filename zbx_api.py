@@ -0,0 +1,497 @@
+import gzip
+import json
+import queue
+import socket
+import threading
+import time
+from contextlib import contextmanager, nullcontext
+
+from pyzabbix import ZabbixAPI
+from pyzabbix.api import ZabbixAPIException
+from requests.adapters import HTTPAdapter
+from urllib3.connection import HTTPConnection
+
+from json_stream import CHUNK_SIZE, RPCError, decode_chunks, iter_rpc_result
+from zbx_metrics import ApiMetrics
+from zbx_scheduler import RequestScheduler
+
+
+def version_tuple(api_version: str) -> tuple:
+    """
+    Преобразует версию Zabbix API "6.2.1" в кортеж (6, 2) для сравнения
+    """
+    return tuple(int(part) for part in api_version.split(".")[:2])
+
+
+# Тела запросов меньше этого размера не сжимаются: выигрыш меньше затрат на сжатие
+REQUEST_COMPRESSION_MIN_SIZE = 16 * 1024
+
+# Код ошибки JSON-RPC "Parse error"
+PARSE_ERROR_CODE = -32700
+
+
+class RequestCompression:
+    """
+    Сжатие gzip тел больших запросов (configuration.import)
+
+    Фронтенд Zabbix читает тело запроса как есть, поэтому сжатые запросы работают,
+    только если их распаковывает веб-сервер (например, Apache с SetInputFilter DEFLATE).
+    Если сервер отклонил сжатый запрос, запрос повторяется без сжатия, а сжатие
+    отключается для всех сессий, использующих этот объект
+
+    :param min_size: минимальный размер тела запроса для сжатия, байт
+    :param level: степень сжатия gzip
+    """
+
+    def __init__(self, min_size: int = REQUEST_COMPRESSION_MIN_SIZE, level: int = 6):
+        self.enabled = True
+        self.min_size = min_size
+        self.level = level
+
+    def compress(self, body: bytes):
+        """
+        Сжатое тело запроса или None, если сжимать не нужно
+        """
+
+        if not self.enabled or len(body) < self.min_size:
+            return None
+        compressed = gzip.compress(body, compresslevel=self.level)
+        if len(compressed) >= len(body):
+            return None
+        return compressed
+
+    def rejected(self, status: int, content: bytes) -> bool:
+        """
+        Проверяет ответ на сжатый запрос. Если сервер не смог его прочитать
+        (400/415 от веб-сервера или ошибка разбора JSON от фронтенда), то сжатие
+        отключается. Такой запрос не был выполнен, поэтому его можно повторить
+        """
+
+        if status in (400, 415):
+            self.enabled = False
+            return True
+        if status != 200:
+            return False
+        try:
+            error = json.loads(content).get("error")
+        except (ValueError, AttributeError):
+            return False
+        if isinstance(error, dict) and error.get("code") == PARSE_ERROR_CODE:
+            self.enabled = False
+            return True
+        return False
+
+
+class TunedHTTPAdapter(HTTPAdapter):
+    """
+    Пул keep-alive соединений одной сессии Zabbix API
+
+    Сессию использует один поток, поэтому достаточно одного соединения. Включен
+    TCP keepalive, чтобы простаивающее соединение не закрывалось по пути (NAT,
+    межсетевые экраны), повторы urllib3 отключены (повторяет планировщик запросов).
+    Большие тела запросов сжимаются, если передан `compression`
+
+    :param compression: общие для всех сессий настройки сжатия запросов
+    """
+
+    def __init__(self, compression: RequestCompression = None):
+        self.compression = compression
+        super().__init__(pool_connections=1, pool_maxsize=1, max_retries=0)
+
+    def init_poolmanager(self, *args, **kwargs):
+        kwargs["socket_options"] = HTTPConnection.default_socket_options + [
+            (socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+        ]
+        super().init_poolmanager(*args, **kwargs)
+
+    def send(self, request, **kwargs):
+        body = request.body
+        if isinstance(body, str):
+            body = body.encode()
+        compressed = None
+        if self.compression is not None and body:
+            compressed = self.compression.compress(body)
+        if compressed is None:
+            return super().send(request, **kwargs)
+
+        plain_request = request.copy()
+        request.body = compressed
+        request.headers["Content-Encoding"] = "gzip"
+        request.headers["Content-Length"] = str(len(compressed))
+        # Для статистики: сколько байт сэкономлено на отправке
+        request.uncompressed_bytes = len(body)
+        response = super().send(request, **kwargs)
+        if not self.compression.rejected(response.status_code, response.content):
+            return response
+        response.close()
+        return super().send(plain_request, **kwargs)
+
+
+def saved_response_bytes(response) -> int:
+    """
+    Сколько байт ответа сэкономлено сжатием при передаче (Content-Encoding)
+    """
+
+    wire_bytes = response.headers.get("Content-Length")
+    if not response.headers.get("Content-Encoding") or not wire_bytes:
+        return 0
+    return max(0, len(response.content) - int(wire_bytes))
+
+
+# Движки клиента Zabbix API: потоки с pyzabbix или asyncio с aiohttp (zbx_async.py)
+ENGINES = ("threads", "async")
+
+
+def create_api(
+    url: str,
+    engine: str = "threads",
+    max_in_flight: int = 1,
+    metrics: ApiMetrics = None,
+    scheduler: RequestScheduler = None,
+    compress_requests: bool = False,
+):
+    """
+    Создает подключение к Zabbix API выбранным движком
+
+    :param engine: "threads" - InstrumentedZabbixAPI и пул сессий для потоков,
+        "async" - один сеанс асинхронного клиента (требуется пакет aiohttp)
+    :param max_in_flight: максимальное количество одновременных запросов
+    :param compress_requests: сжимать gzip большие тела запросов,
+        если сервер их принимает
+    """
+
+    if engine not in ENGINES:
+        raise ValueError(f"Неизвестный движок Zabbix API: {engine}")
+    compression = RequestCompression() if compress_requests else None
+    if engine == "async":
+        from zbx_async import SyncZabbixAPI
+
+        return SyncZabbixAPI(
+            url,
+            max_in_flight=max_in_flight,
+            metrics=metrics,
+            scheduler=scheduler,
+            compression=compression,
+        )
+    return InstrumentedZabbixAPI(
+        server=url, metrics=metrics, scheduler=scheduler, compression=compression
+    )
+
+
+class InstrumentedZabbixAPI(ZabbixAPI):
+    """
+    ZabbixAPI, который учитывает время, объем данных и ошибки каждого вызова,
+    а также ограничивает нагрузку на сервер через планировщик запросов
+
+    :param metrics: общий сборщик статистики (например, для всех сессий пула)
+    :param scheduler: общий планировщик запросов, None - без ограничений и повторов
+    :param compression: сжатие больших тел запросов, None - без сжатия
+    """
+
+    def __init__(
+        self,
+        *args,
+        metrics: ApiMetrics = None,
+        scheduler: RequestScheduler = None,
+        compression: RequestCompression = None,
+        **kwargs,
+    ):
+        self.metrics = metrics if metrics is not None else ApiMetrics()
+        self.scheduler = scheduler
+        self.compression = compression
+        self._last_response = None
+        super().__init__(*args, **kwargs)
+        adapter = TunedHTTPAdapter(compression)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self.session.hooks["response"].append(self._remember_response)
+
+    def _remember_response(self, response, *args, **kwargs):
+        self._last_response = response
+
+    def do_request(self, method: str, params=None) -> dict:
+        if self.scheduler is None:
+            return self._timed_request(method, params)
+        return self.scheduler.call(method, lambda: self._timed_request(method, params))
+
+    def _timed_request(self, method: str, params) -> dict:
+        """
+        Одна попытка запроса с учетом в статистике
+        """
+
+        self._last_response = None
+        error = False
+        start = time.perf_counter()
+        try:
+            return super().do_request(method, params)
+        except Exception:
+            error = True
+            raise
+        finally:
+            seconds = time.perf_counter() - start
+            request_bytes, response_bytes, saved_bytes = 0, 0, 0
+            response = self._last_response
+            if response is not None:
+                request_bytes = len(response.request.body or b"")
+                # Размер по сети (после сжатия), если сервер его сообщил
+                response_bytes = int(
+                    response.headers.get("Content-Length") or len(response.content)
+                )
+                saved_bytes = (
+                    getattr(response.request, "uncompressed_bytes", request_bytes)
+                    - request_bytes
+                    + saved_response_bytes(response)
+                )
+            self.metrics.record(
+                method, seconds, request_bytes, response_bytes, error, saved_bytes
+            )
+
+
+class SessionPool:
+    """
+    Пул авторизованных сессий Zabbix API для параллельной работы нескольких потоков
+
+    Каждая сессия имеет свой `requests.Session` (он не потокобезопасен), но использует
+    токен авторизации основного подключения, поэтому повторный вход не требуется.
+    Сессии создаются по мере необходимости, но не более `size` штук.
+    """
+
+    def __init__(self, zbx: ZabbixAPI, size: int):
+        self._zbx = zbx
+        self.size = max(1, size)
+        self._free = queue.LifoQueue()
+        self._all = []
+        self._lock = threading.Lock()
+
+    def _clone(self) -> ZabbixAPI:
+        """
+        Создаем новое подключение с токеном авторизации основного подключения
+        """
+        kwargs = {}
+        if isinstance(self._zbx, InstrumentedZabbixAPI):
+            # Вызовы всех сессий пула попадают в общую статистику
+            # и ограничиваются общим планировщиком
+            kwargs["metrics"] = self._zbx.metrics
+            kwargs["scheduler"] = self._zbx.scheduler
+            kwargs["compression"] = self._zbx.compression
+        zbx = type(self._zbx)(
+            server=self._zbx.url,
+            timeout=self._zbx.timeout,
+            detect_version=False,
+            **kwargs,
+        )
+        zbx.version = self._zbx.version
+        zbx.auth = self._zbx.auth
+        zbx.use_api_token = self._zbx.use_api_token
+        return zbx
+
+    @contextmanager
+    def session(self):
+        """
+        Выдаем свободную сессию из пула на время работы с ней
+        """
+        if not isinstance(self._zbx, ZabbixAPI):
+            # Асинхронный движок потокобезопасен, все потоки используют один сеанс
+            yield self._zbx
+            return
+
+        try:
+            zbx = self._free.get_nowait()
+        except queue.Empty:
+            with self._lock:
+                zbx = self._clone()
+                self._all.append(zbx)
+        try:
+            yield zbx
+        finally:
+            self._free.put(zbx)
+
+    @contextmanager
+    def dedicated(self):
+        """
+        Выдаем отдельную сессию вне пула на время работы одного потока, например
+        этапа, выполняемого одновременно с другими этапами. Размер пула она не
+        занимает: одновременные запросы ограничивает общий планировщик
+        """
+        if not isinstance(self._zbx, ZabbixAPI):
+            yield self._zbx
+            return
+
+        zbx = self._clone()
+        try:
+            yield zbx
+        finally:
+            zbx.session.close()
+
+    def close(self):
+        """
+        Закрываем HTTP соединения всех сессий пула.
+        Выход из Zabbix не выполняется, токен принадлежит основному подключению
+        """
+        with self._lock:
+            for zbx in self._all:
+                zbx.session.close()
+            self._all.clear()
+        self._free = queue.LifoQueue()
+
+
+class StageSessions:
+    """
+    Основное подключение `zbx` для этапов, выполняемых одновременно в разных потоках
+
+    Внутри `stage_session()` атрибут `zbx` возвращает отдельную сессию текущего
+    потока, в остальное время - основное подключение. Наследник присваивает
+    основное подключение `self.zbx` и создает пул сессий `self.pool`
+    """
+
+    @property
+    def zbx(self):
+        zbx = getattr(self._stage_local, "zbx", None)
+        return self._main_zbx if zbx is None else zbx
+
+    @zbx.setter
+    def zbx(self, zbx):
+        self._main_zbx = zbx
+        self._stage_local = threading.local()
+
+    @contextmanager
+    def stage_session(self):
+        """
+        Выполнение этапа в отдельном потоке с собственной сессией
+        """
+        with self.pool.dedicated() as zbx:
+            self._stage_local.zbx = zbx
+            try:
+                yield self
+            finally:
+                del self._stage_local.zbx
+
+
+def stream_request(zbx: ZabbixAPI, method: str, params: dict):
+    """
+    Выполняет запрос к Zabbix API, не загружая ответ в память целиком
+
+    Если у подключения есть планировщик запросов, то запрос занимает место среди
+    одновременных запросов до конца чтения ответа. Повтор при перегрузке возможен,
+    только пока ответ еще не начал поступать
+
+    :return: генератор частей тела ответа (строки)
+    """
+
+    # Не getattr: у ZabbixAPI любой неизвестный атрибут - объект API
+    scheduler = vars(zbx).get("scheduler")
+    attempt = 0
+    while True:
+        chunks = _stream_attempt(zbx, method, params, scheduler)
+        try:
+            first_chunk = next(chunks, None)
+        except Exception as error:
+            delay = None
+            if scheduler is not None:
+                delay = scheduler.retry_delay(method, error, attempt)
+            if delay is None:
+                raise
+            attempt += 1
+            time.sleep(delay)
+            continue
+
+        try:
+            if first_chunk is not None:
+                yield first_chunk
+                yield from chunks
+        finally:
+            # Освобождаем место планировщика, даже если ответ прочитан не до конца
+            chunks.close()
+        return
+
+
+def _stream_attempt(zbx: ZabbixAPI, method: str, params: dict, scheduler):
+    """
+    Одна попытка потокового запроса с учетом в статистике
+    """
+
+    if not isinstance(zbx, ZabbixAPI):
+        # Асинхронный движок (zbx_async.SyncZabbixAPI) сам учитывает статистику
+        with scheduler.slot(method) if scheduler else nullcontext():
+            yield from zbx.stream_request(method, params)
+        return
+
+    payload = {"jsonrpc": "2.0", "method": method, "params": params, "id": zbx.id}
+    headers = {}
+    if zbx.auth:
+        # Начиная с Zabbix 6.4 токен передается в заголовке
+        if zbx.version and version_tuple(str(zbx.version)) >= (6, 4):
+            headers["Authorization"] = f"Bearer {zbx.auth}"
+        else:
+            payload["auth"] = zbx.auth
+
+    metrics = vars(zbx).get("metrics")
+    resp = None
+    received = 0
+    error = True
+
+    def counted(chunks):
+        # Сколько байт ответа получено после распаковки
+        nonlocal received
+        for chunk in chunks:
+            received += len(chunk)
+            yield chunk
+
+    start = time.perf_counter()
+    try:
+        with scheduler.slot(method) if scheduler else nullcontext():
+            with zbx.session.post(
+                zbx.url,
+                json=payload,
+                headers=headers,
+                timeout=zbx.timeout,
+                stream=True,
+            ) as resp:
+                resp.raise_for_status()
+                zbx.id += 1
+                yield from decode_chunks(counted(resp.iter_content(CHUNK_SIZE)))
+        error = False
+    except GeneratorExit:
+        # Потребитель прочитал все, что ему нужно, и закрыл генератор
+        error = False
+        raise
+    finally:
+        # Время включает обработку частей ответа, она идет одновременно с получением
+        if metrics is not None:
+            # Сколько байт получено по сети (до распаковки gzip)
+            wire_bytes = resp.raw.tell() if resp is not None else 0
+            metrics.record(
+                method,
+                time.perf_counter() - start,
+                len(resp.request.body or b"") if resp is not None else 0,
+                wire_bytes,
+                error,
+                max(0, received - wire_bytes) if wire_bytes else 0,
+            )
+
+
+def stream_export(zbx: ZabbixAPI, options: dict):
+    """
+    Потоковый configuration.export в формате JSON
+
+    Ответ раскрывается по мере получения, поэтому расход памяти не зависит
+    от размера экспорта
+
+    :param options: объекты для экспорта, например {"templates": ["10001", ...]}
+    :return: генератор частей документа экспорта
+    """
+
+    try:
+        yield from iter_rpc_result(
+            stream_request(
+                zbx, "configuration.export", {"format": "json", "options": options}
+            )
+        )
+    except RPCError as e:
+        error = e.error
+        error.setdefault("data", "No data")
+        raise ZabbixAPIException(
+            f"Error {error['code']}: {error['message']}, {error['data']}",
+            error["code"],
+            error=error,
+        ) from None
@@ -0,0 +1,476 @@
+"""
+Асинхронный клиент Zabbix API (необязательный движок, требуется пакет aiohttp)
+
+Один авторизованный сеанс работает через общий пул keep-alive соединений,
+количество одновременно выполняемых вызовов ограничено `max_in_flight`
+(asyncio.Semaphore). Методы вызываются так же, как в pyzabbix:
+
+    async with AsyncZabbixAPI("https://zabbix.example", max_in_flight=1000) as zbx:
+        await zbx.login("Admin", "zabbix")
+        groups = await zbx.hostgroup.get(output=["groupid"])
+        hosts = await asyncio.gather(
+            *(zbx.host.get(groupids=[g["groupid"]]) for g in groups)
+        )
+
+SyncZabbixAPI - синхронная потокобезопасная обертка с набором методов ZabbixAPI:
+цикл событий работает в отдельном потоке, а BackupZabbix и RestoreZabbix
+вызывают методы API из своих потоков как обычно. Для них это другой транспорт,
+а не другая модель параллелизма: каждый поток ждет свой вызов, поэтому
+одновременно выполняется не больше запросов, чем потоков (--workers).
+"""
+
+import asyncio
+import codecs
+import json
+import threading
+import time
+
+try:
+    import aiohttp
+except ImportError:  # aiohttp - необязательная зависимость
+    aiohttp = None
+
+from pyzabbix.api import ZabbixAPIException
+
+from json_stream import CHUNK_SIZE
+from zbx_api import RequestCompression, version_tuple
+from zbx_metrics import ApiMetrics
+from zbx_scheduler import RequestScheduler
+
+# Сколько секунд держать простаивающее соединение открытым для следующих запросов
+KEEPALIVE_TIMEOUT = 60
+
+# Методы, которые вызываются без токена авторизации (как в pyzabbix)
+ANONYMOUS_METHODS = {"apiinfo.version", "user.checkAuthentication", "user.login"}
+
+
+def _login_params(api_version: str, user: str, password: str) -> dict:
+    # Начиная с Zabbix 5.4 параметр user переименован в username
+    if version_tuple(api_version) >= (5, 4):
+        return {"username": user, "password": password}
+    return {"user": user, "password": password}
+
+
+def _parse_response(content: bytes) -> dict:
+    """
+    Разбирает ответ JSON-RPC, ошибки превращаются в ZabbixAPIException, как в pyzabbix
+    """
+
+    if not content:
+        raise ZabbixAPIException("Received empty response")
+    try:
+        response = json.loads(content)
+    except ValueError as exception:
+        raise ZabbixAPIException(f"Unable to parse json: {content!r}") from exception
+
+    if "error" in response:
+        error = response["error"]
+        error.setdefault("data", "No data")
+        raise ZabbixAPIException(
+            f"Error {error['code']}: {error['message']}, {error['data']}",
+            error["code"],
+            error=error,
+        )
+    return response
+
+
+class _ApiObject:
+    """
+    Объект API (host, template, ...), атрибуты которого - методы API
+    """
+
+    def __init__(self, name: str, parent):
+        self._name = name
+        self._parent = parent
+
+    def __getattr__(self, attr: str):
+        return _ApiMethod(f"{self._name}.{attr}", self._parent)
+
+    __getitem__ = __getattr__
+
+
+class _ApiMethod:
+    def __init__(self, method: str, parent):
+        self._method = method
+        self._parent = parent
+
+    def __call__(self, *args, **kwargs):
+        if args and kwargs:
+            raise TypeError("Found both args and kwargs")
+        return self._parent.call(self._method, args or kwargs)
+
+
+class AsyncZabbixAPI:
+    """
+    Асинхронный клиент Zabbix API
+
+    :param server: адрес Zabbix
+    :param timeout: таймаут одного запроса, секунд
+    :param max_in_flight: максимальное количество одновременных запросов
+        (и соединений в пуле)
+    :param metrics: сборщик статистики вызовов
+    :param scheduler: планировщик, определяющий повторы идемпотентных запросов
+        при перегрузке, None - без повторов
+    :param compression: сжатие больших тел запросов, None - без сжатия
+    """
+
+    def __init__(
+        self,
+        server: str,
+        timeout: float = None,
+        max_in_flight: int = 100,
+        metrics: ApiMetrics = None,
+        scheduler: RequestScheduler = None,
+        compression: RequestCompression = None,
+    ):
+        if aiohttp is None:
+            raise RuntimeError("Для асинхронного движка установите пакет aiohttp")
+
+        if not server.endswith("/api_jsonrpc.php"):
+            server = server.rstrip("/") + "/api_jsonrpc.php"
+        self.url = server
+        self.timeout = timeout
+        self.max_in_flight = max(1, max_in_flight)
+        self.metrics = metrics if metrics is not None else ApiMetrics()
+        self.scheduler = scheduler
+        self.compression = compression
+        self.auth = ""
+        self.version = None
+        self.id = 0
+        # Создаются в цикле событий при первом запросе
+        self._session = None
+        self._semaphore = None
+
+    def __getattr__(self, name: str):
+        if name.startswith("_"):
+            raise AttributeError(name)
+        return _ApiObject(name, self)
+
+    def __getitem__(self, name: str):
+        return _ApiObject(name, self)
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        try:
+            if exc_val is None or isinstance(exc_val, ZabbixAPIException):
+                await self.logout()
+        finally:
+            await self.close()
+
+    def _client(self):
+        if self._session is None:
+            self._semaphore = asyncio.Semaphore(self.max_in_flight)
+            self._session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(
+                    limit=self.max_in_flight, keepalive_timeout=KEEPALIVE_TIMEOUT
+                ),
+                timeout=aiohttp.ClientTimeout(total=self.timeout),
+            )
+        return self._session
+
+    def _request(self, method: str, params) -> tuple:
+        """
+        Тело и заголовки запроса JSON-RPC
+        """
+
+        self.id += 1
+        payload = {
+            "jsonrpc": "2.0",
+            "method": method,
+            "params": params or {},
+            "id": self.id,
+        }
+        headers = {"Content-Type": "application/json-rpc"}
+        if self.auth and method not in ANONYMOUS_METHODS:
+            # Начиная с Zabbix 6.4 токен передается в заголовке
+            if self.version and version_tuple(str(self.version)) >= (6, 4):
+                headers["Authorization"] = f"Bearer {self.auth}"
+            else:
+                payload["auth"] = self.auth
+        return json.dumps(payload).encode(), headers
+
+    def call(self, method: str, params=None):
+        """
+        Корутина, возвращающая результат вызова метода API
+        """
+        return self._result(method, params)
+
+    async def _result(self, method: str, params):
+        return (await self.do_request(method, params))["result"]
+
+    async def do_request(self, method: str, params=None) -> dict:
+        attempt = 0
+        while True:
+            try:
+                return await self._timed_request(method, params)
+            except Exception as error:
+                delay = None
+                if self.scheduler is not None:
+                    delay = self.scheduler.retry_delay(method, error, attempt)
+                if delay is None:
+                    raise
+            attempt += 1
+            await asyncio.sleep(delay)
+
+    async def _timed_request(self, method: str, params) -> dict:
+        """
+        Одна попытка запроса с учетом в статистике
+        """
+
+        body, headers = self._request(method, params)
+        # Сеанс и семафор создаются при первом запросе
+        self._client()
+        compressed = None
+        if self.compression is not None:
+            compressed = self.compression.compress(body)
+        request_bytes = len(body)
+        response_bytes = 0
+        saved_bytes = 0
+        error = True
+        start = time.perf_counter()
+        try:
+            async with self._semaphore:
+                if compressed is not None:
+                    resp, content = await self._post(
+                        compressed, {**headers, "Content-Encoding": "gzip"}
+                    )
+                    if self.compression.rejected(resp.status, content):
+                        # Сервер не принимает сжатые запросы, повторяем без сжатия
+                        compressed = None
+                    else:
+                        request_bytes = len(compressed)
+                        saved_bytes = len(body) - len(compressed)
+                if compressed is None:
+                    resp, content = await self._post(body, headers)
+            resp.raise_for_status()
+            # Размер по сети (после сжатия), если сервер его сообщил
+            response_bytes = resp.content_length or len(content)
+            if resp.headers.get("Content-Encoding"):
+                saved_bytes += max(0, len(content) - response_bytes)
+            response = _parse_response(content)
+            error = False
+            return response
+        finally:
+            self.metrics.record(
+                method,
+                time.perf_counter() - start,
+                request_bytes,
+                response_bytes,
+                error,
+                saved_bytes,
+            )
+
+    async def _post(self, body: bytes, headers: dict) -> tuple:
+        """
+        Отправляет запрос и читает ответ целиком
+
+        :return: ответ и его тело (после распаковки)
+        """
+
+        async with self._client().post(self.url, data=body, headers=headers) as resp:
+            return resp, await resp.read()
+
+    async def stream_request(self, method: str, params: dict):
+        """
+        Выполняет запрос, не загружая ответ в память целиком.
+        Повтор при перегрузке - на стороне вызывающего кода
+
+        :return: асинхронный генератор частей тела ответа (строки)
+        """
+
+        body, headers = self._request(method, params)
+        session = self._client()
+        decoder = codecs.getincrementaldecoder("utf-8")()
+        resp = None
+        received = 0
+        error = True
+        start = time.perf_counter()
+        try:
+            async with self._semaphore:
+                async with session.post(self.url, data=body, headers=headers) as resp:
+                    resp.raise_for_status()
+                    async for chunk in resp.content.iter_chunked(CHUNK_SIZE):
+                        received += len(chunk)
+                        text = decoder.decode(chunk)
+                        if text:
+                            yield text
+                    text = decoder.decode(b"", final=True)
+                    if text:
+                        yield text
+            error = False
+        except GeneratorExit:
+            # Потребитель прочитал все, что ему нужно, и закрыл генератор
+            error = False
+            raise
+        finally:
+            # Размер по сети, если сервер его сообщил, иначе размер после распаковки
+            wire_bytes = (resp.content_length if resp is not None else None) or received
+            self.metrics.record(
+                method,
+                time.perf_counter() - start,
+                len(body),
+                wire_bytes,
+                error,
+                max(0, received - wire_bytes),
+            )
+
+    async def api_version(self) -> str:
+        return await self.apiinfo.version()
+
+    async def login(self, user: str = "", password: str = "") -> None:
+        self.version = await self.api_version()
+        self.auth = ""
+        self.auth = await self.user.login(**_login_params(self.version, user, password))
+
+    async def logout(self) -> None:
+        if self.auth:
+            await self.user.logout()
+            self.auth = ""
+
+    async def close(self) -> None:
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+
+class SyncZabbixAPI:
+    """
+    Синхронная обертка AsyncZabbixAPI с набором методов pyzabbix.ZabbixAPI
+
+    Цикл событий работает в отдельном потоке, поэтому методы можно вызывать
+    одновременно из любого количества потоков: все они используют один
+    авторизованный сеанс и общий пул соединений. Ограничение нагрузки и повторы
+    выполняет планировщик запросов, как для ZabbixAPI
+
+    :param server: адрес Zabbix
+    :param timeout: таймаут одного запроса, секунд
+    :param max_in_flight: максимальное количество одновременных запросов
+    :param metrics: сборщик статистики вызовов
+    :param scheduler: общий планировщик запросов, None - без ограничений и повторов
+    :param compression: сжатие больших тел запросов, None - без сжатия
+    """
+
+    def __init__(
+        self,
+        server: str,
+        timeout: float = None,
+        max_in_flight: int = 100,
+        metrics: ApiMetrics = None,
+        scheduler: RequestScheduler = None,
+        compression: RequestCompression = None,
+    ):
+        self.metrics = metrics if metrics is not None else ApiMetrics()
+        self.scheduler = scheduler
+        # Повторы выполняются здесь, через планировщик, а не в клиенте
+        self.client = AsyncZabbixAPI(
+            server,
+            timeout=timeout,
+            max_in_flight=max_in_flight,
+            metrics=self.metrics,
+            compression=compression,
+        )
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(
+            target=self._loop.run_forever, name="zabbix-async", daemon=True
+        )
+        self._thread.start()
+
+    @property
+    def url(self) -> str:
+        return self.client.url
+
+    @property
+    def timeout(self):
+        return self.client.timeout
+
+    @property
+    def auth(self) -> str:
+        return self.client.auth
+
+    @property
+    def version(self):
+        return self.client.version
+
+    def __getattr__(self, name: str):
+        if name.startswith("_"):
+            raise AttributeError(name)
+        return _ApiObject(name, self)
+
+    def __getitem__(self, name: str):
+        return _ApiObject(name, self)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        try:
+            if exc_val is None or isinstance(exc_val, ZabbixAPIException):
+                if self.client.auth:
+                    self.user.logout()
+                    self.client.auth = ""
+        finally:
+            self.close()
+
+    def _run(self, coroutine):
+        """
+        Выполняет корутину в цикле событий и ждет результата
+        """
+        return asyncio.run_coroutine_threadsafe(coroutine, self._loop).result()
+
+    def call(self, method: str, params=None):
+        return self.do_request(method, params)["result"]
+
+    def do_request(self, method: str, params=None) -> dict:
+        if self.scheduler is None:
+            return self._run(self.client.do_request(method, params))
+        return self.scheduler.call(
+            method, lambda: self._run(self.client.do_request(method, params))
+        )
+
+    def stream_request(self, method: str, params: dict):
+        """
+        Потоковый запрос, см. AsyncZabbixAPI.stream_request
+
+        :return: генератор частей тела ответа (строки)
+        """
+
+        chunks = self.client.stream_request(method, params)
+
+        async def next_chunk():
+            try:
+                return await chunks.__anext__()
+            except StopAsyncIteration:
+                return None
+
+        try:
+            while True:
+                chunk = self._run(next_chunk())
+                if chunk is None:
+                    return
+                yield chunk
+        finally:
+            self._run(chunks.aclose())
+
+    def api_version(self) -> str:
+        return self.apiinfo.version()
+
+    def login(self, user: str = "", password: str = "") -> None:
+        self.client.version = self.api_version()
+        self.client.auth = ""
+        self.client.auth = self.user.login(
+            **_login_params(self.client.version, user, password)
+        )
+
+    def close(self) -> None:
+        """
+        Закрывает соединения и останавливает цикл событий
+        """
+
+        if self._loop.is_closed():
+            return
+        self._run(self.client.close())
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join()
+        self._loop.close()
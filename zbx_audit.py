@@ -0,0 +1,277 @@
+"""
+Изменения узлов сети и шаблонов по журналу аудита Zabbix
+
+Для инкрементного резервного копирования записи auditlog.get после прошлого
+копирования сводятся к ID узлов сети и шаблонов, экспорт которых мог измениться.
+Записи о дочерних объектах (элементы данных, триггеры, графики, макросы, ...)
+относятся к узлу сети или шаблону, которому они принадлежат, записи о группах -
+ко всем узлам сети и шаблонам группы.
+
+Владелец уже удаленного объекта определяется по записям журнала об этом объекте
+(ID узла сети в подробностях записи) или по операции, в которой вместе с ним
+изменился узел сети или шаблон.
+
+Если журнал не позволяет определить изменения (журнал выключен, записи за период
+удалены очисткой истории, нет прав на чтение журнала или настроек, владельца
+удаленного объекта определить нельзя), то возвращается None и нужно полное
+копирование.
+"""
+
+import json
+
+from pyzabbix.api import ZabbixAPIException
+
+from zbx_api import version_tuple
+from zbx_colors import C
+
+# Запас на расхождение часов сервера Zabbix и этой машины, секунд
+CLOCK_MARGIN = 300
+
+# Типы ресурсов журнала аудита
+RESOURCE_HOST = 4
+RESOURCE_HOST_GROUP = 14
+RESOURCE_MACRO = 29
+RESOURCE_TEMPLATE = 30
+RESOURCE_TEMPLATE_GROUP = 50
+
+# Объекты, принадлежащие узлу сети или шаблону:
+# тип ресурса -> (метод API, параметр с ID объектов, поле с владельцем)
+OWNED_RESOURCES = {
+    6: ("graph.get", "graphids", "hosts"),
+    13: ("trigger.get", "triggerids", "hosts"),
+    15: ("item.get", "itemids", "hostid"),
+    17: ("valuemap.get", "valuemapids", "hostid"),
+    22: ("httptest.get", "httptestids", "hostid"),
+    23: ("discoveryrule.get", "itemids", "hostid"),
+    31: ("triggerprototype.get", "triggerids", "hosts"),
+    35: ("graphprototype.get", "graphids", "hosts"),
+    36: ("itemprototype.get", "itemids", "hostid"),
+    37: ("hostprototype.get", "hostids", "discoveryRule"),
+    43: ("templatedashboard.get", "dashboardids", "templateid"),
+}
+
+
+def audit_covers(zbx, since: float, api_version: str) -> bool:
+    """
+    Содержит ли журнал аудита все записи начиная с `since`
+
+    Очистка истории удаляет самые старые записи, поэтому журнал полон, если
+    самая старая запись не новее `since`
+    """
+
+    if version_tuple(api_version) >= (5, 4):
+        settings = zbx.settings.get(output="extend")
+        if settings.get("auditlog_enabled", "1") == "0":
+            return False
+
+    oldest = zbx.auditlog.get(
+        output=["clock"], sortfield="clock", sortorder="ASC", limit=1
+    )
+    return bool(oldest) and int(oldest[0]["clock"]) <= since - CLOCK_MARGIN
+
+
+def changed_owners(zbx, since: float, api_version: str):
+    """
+    ID узлов сети и шаблонов, экспорт которых мог измениться после `since`
+
+    :param since: время прошлого успешного копирования (unix time)
+    :return: множество hostid/templateid или None, если изменения определить нельзя
+    """
+
+    try:
+        return _changed_owners(zbx, since, api_version)
+    except ZabbixAPIException as e:
+        # Нет прав Super admin на журнал аудита, метод недоступен и т.п.
+        print(f"    {C.WARNING}Журнал аудита недоступен{C.ENDC}: {e}")
+        return None
+
+
+def _changed_owners(zbx, since: float, api_version: str):
+    if not audit_covers(zbx, since, api_version):
+        return None
+
+    # Начиная с Zabbix 5.4 записи одной операции объединены в recordsetid
+    output = ["resourcetype", "resourceid"]
+    if version_tuple(api_version) >= (5, 4):
+        output.append("recordsetid")
+    records = zbx.auditlog.get(output=output, time_from=int(since) - CLOCK_MARGIN)
+    ids_by_type = {}
+    for record in records:
+        ids_by_type.setdefault(int(record["resourcetype"]), set()).add(
+            record["resourceid"]
+        )
+
+    owners = ids_by_type.pop(RESOURCE_HOST, set())
+    owners |= ids_by_type.pop(RESOURCE_TEMPLATE, set())
+
+    for resource_type, ids in ids_by_type.items():
+        deleted = set()
+        if resource_type in OWNED_RESOURCES:
+            resolved, deleted = _owners(zbx, resource_type, ids)
+        elif resource_type == RESOURCE_MACRO:
+            resolved, deleted = _macro_owners(zbx, ids)
+        elif resource_type in (RESOURCE_HOST_GROUP, RESOURCE_TEMPLATE_GROUP):
+            resolved = _group_members(zbx, resource_type, ids, api_version)
+        else:
+            # Пользователи, действия, карты и т.п. не входят в экспорт узлов и шаблонов
+            continue
+        if resolved is None:
+            return None
+        if deleted:
+            deleted_owners = _deleted_owners(
+                zbx, resource_type, deleted, records, api_version
+            )
+            if deleted_owners is None:
+                return None
+            resolved |= deleted_owners
+        owners |= resolved
+
+    return owners
+
+
+def _owners(zbx, resource_type: int, ids: set) -> tuple:
+    """
+    ID узлов сети и шаблонов, которым принадлежат объекты
+
+    :return: (ID владельцев или None, если владельца определить нельзя,
+        ID уже удаленных объектов)
+    """
+
+    method, ids_param, owner_field = OWNED_RESOURCES[resource_type]
+    api_object, api_method = method.split(".")
+    # Первичный ключ объекта: graphids -> graphid
+    params = {ids_param: list(ids), "output": [ids_param[:-1]]}
+    if owner_field == "hosts":
+        params["selectHosts"] = ["hostid"]
+    elif owner_field == "discoveryRule":
+        params["selectDiscoveryRule"] = ["hostid"]
+    else:
+        params["output"].append(owner_field)
+
+    objects = zbx[api_object][api_method](**params)
+    deleted = ids - {obj[ids_param[:-1]] for obj in objects}
+
+    owners = set()
+    for obj in objects:
+        if owner_field == "hosts":
+            obj_owners = {host["hostid"] for host in obj.get("hosts", [])}
+        elif owner_field == "discoveryRule":
+            obj_owners = {obj.get("discoveryRule", {}).get("hostid")}
+        else:
+            # В Zabbix < 5.4 соответствия значений глобальные и поля hostid нет
+            obj_owners = {obj.get(owner_field)}
+        obj_owners.discard(None)
+        if not obj_owners:
+            return None, deleted
+        owners |= obj_owners
+    return owners, deleted
+
+
+def _macro_owners(zbx, ids: set) -> tuple:
+    """
+    Владельцы макросов узлов сети и шаблонов. Глобальные макросы
+    имеют тот же тип ресурса, но в экспорт узлов сети не входят
+
+    :return: (ID владельцев, ID уже удаленных макросов)
+    """
+
+    macros = zbx.usermacro.get(hostmacroids=list(ids), output=["hostmacroid", "hostid"])
+    missing = ids - {m["hostmacroid"] for m in macros}
+    if missing:
+        global_macros = zbx.usermacro.get(
+            globalmacroids=list(missing), globalmacro=True, output=["globalmacroid"]
+        )
+        missing -= {m["globalmacroid"] for m in global_macros}
+    return {m["hostid"] for m in macros}, missing
+
+
+def _deleted_owners(zbx, resource_type: int, ids: set, records: list, api_version: str):
+    """
+    ID узлов сети и шаблонов, которым принадлежали уже удаленные объекты
+
+    Записи о создании и изменении объекта содержат ID его владельца в подробностях
+    (например "item.hostid"). Если таких записей нет, но объект удален одной
+    операцией с изменением узла сети или шаблона (общий recordsetid), то владелец
+    уже учтен записью об узле сети или шаблоне
+
+    :param records: записи журнала аудита с прошлого копирования
+    :return: множество ID или None, если владельца хотя бы одного объекта
+        определить нельзя
+    """
+
+    # В Zabbix < 5.4 записи журнала не содержат подробностей и recordsetid
+    if version_tuple(api_version) < (5, 4):
+        return None
+
+    owners = set()
+    unresolved = set(ids)
+    history = zbx.auditlog.get(
+        output=["resourceid", "details"],
+        filter={"resourcetype": resource_type, "resourceid": list(ids)},
+    )
+    for record in history:
+        owner = _details_hostid(record.get("details"))
+        if owner is not None:
+            owners.add(owner)
+            unresolved.discard(record["resourceid"])
+
+    if unresolved:
+        owner_recordsets = {
+            record.get("recordsetid")
+            for record in records
+            if int(record["resourcetype"]) in (RESOURCE_HOST, RESOURCE_TEMPLATE)
+        }
+        owner_recordsets.discard(None)
+        unresolved -= {
+            record["resourceid"]
+            for record in records
+            if int(record["resourcetype"]) == resource_type
+            and record.get("recordsetid") in owner_recordsets
+        }
+    return None if unresolved else owners
+
+
+def _details_hostid(details):
+    """
+    ID узла сети или шаблона из подробностей записи журнала аудита:
+    {"item.hostid": ["add", "10084"], ...}
+    """
+
+    if isinstance(details, str):
+        try:
+            details = json.loads(details) if details else {}
+        except ValueError:
+            return None
+    if not isinstance(details, dict):
+        return None
+    for key, value in details.items():
+        if key.endswith(".hostid") and isinstance(value, list) and len(value) > 1:
+            return value[1]
+    return None
+
+
+def _group_members(zbx, resource_type: int, ids: set, api_version: str):
+    """
+    Узлы сети и шаблоны групп: имя группы входит в их экспорт
+    """
+
+    # Начиная с Zabbix 6.2 шаблоны входят в отдельные группы шаблонов
+    separate_groups = version_tuple(api_version) >= (6, 2)
+    if resource_type == RESOURCE_TEMPLATE_GROUP:
+        groups = zbx.templategroup.get(groupids=list(ids), output=["groupid"])
+    else:
+        groups = zbx.hostgroup.get(groupids=list(ids), output=["groupid"])
+    if len(groups) < len(ids):
+        return None
+
+    members = set()
+    if resource_type == RESOURCE_HOST_GROUP:
+        members |= {
+            h["hostid"] for h in zbx.host.get(groupids=list(ids), output=["hostid"])
+        }
+    if resource_type == RESOURCE_TEMPLATE_GROUP or not separate_groups:
+        members |= {
+            t["templateid"]
+            for t in zbx.template.get(groupids=list(ids), output=["templateid"])
+        }
+    return members
@@ -0,0 +1,272 @@
+import json
+import re
+
+import json_stream
+
+# Ссылки на узлы сети в выражениях триггеров:
+#   Zabbix 5.4+  -> last(/host/key)
+#   Zabbix < 5.4 -> {host:key.last()}
+_EXPRESSION_HOST_RE = re.compile(r"\(/([^/]+)/|\{([^:{}$][^:{}]*):")
+
+
+def referenced_hosts(obj) -> set:
+    """
+    Находит технические имена узлов сети, на которые ссылается объект экспорта
+    (триггер или график верхнего уровня)
+
+    :param obj: объект из секций "triggers" или "graphs" экспорта Zabbix
+    :return: множество имен узлов сети
+    """
+
+    hosts = set()
+    if isinstance(obj, dict):
+        for key, value in obj.items():
+            if key in ("expression", "recovery_expression") and isinstance(value, str):
+                for new_style, old_style in _EXPRESSION_HOST_RE.findall(value):
+                    hosts.add(new_style or old_style)
+            elif key == "host" and isinstance(value, str):
+                hosts.add(value)
+            else:
+                hosts |= referenced_hosts(value)
+    elif isinstance(obj, list):
+        for value in obj:
+            hosts |= referenced_hosts(value)
+    return hosts
+
+
+# Вложенные объекты, от количества которых зависит время импорта узла сети
+WEIGHT_KEYS = {
+    "items",
+    "triggers",
+    "graphs",
+    "discovery_rules",
+    "item_prototypes",
+    "trigger_prototypes",
+    "graph_prototypes",
+    "host_prototypes",
+    "httptests",
+}
+
+# Триггеры и графики верхнего уровня: ссылаются на один или несколько узлов сети
+# (шаблонов) и импортируются вместе с ними
+LINKED_SECTIONS = ("triggers", "graphs")
+
+# Секции групп: в часть попадают только группы ее узлов сети (шаблонов)
+GROUP_SECTIONS = ("groups", "host_groups", "template_groups")
+
+# Соответствия значений верхнего уровня (Zabbix < 5.4): в часть попадают только
+# соответствия, на которые ссылаются ее элементы данных
+VALUE_MAPS_SECTION = "value_maps"
+
+
+def export_weight(obj) -> int:
+    """
+    Оценка трудоемкости импорта объекта: 1 + вес элементов данных, триггеров,
+    графиков, правил обнаружения с прототипами и веб-сценариев
+    """
+
+    weight = 1
+    if isinstance(obj, dict):
+        for key, value in obj.items():
+            if key in WEIGHT_KEYS and isinstance(value, list):
+                weight += sum(export_weight(child) for child in value)
+    return weight
+
+
+def _references(obj, groups: set, value_maps: set) -> None:
+    """
+    Собирает имена групп и соответствий значений, на которые ссылается объект
+    """
+
+    if isinstance(obj, dict):
+        for key, value in obj.items():
+            if key in GROUP_SECTIONS and isinstance(value, list):
+                groups.update(g["name"] for g in value if isinstance(g, dict))
+            elif key == "valuemap" and isinstance(value, dict) and "name" in value:
+                value_maps.add(value["name"])
+            else:
+                _references(value, groups, value_maps)
+    elif isinstance(obj, list):
+        for value in obj:
+            _references(value, groups, value_maps)
+
+
+def iter_export_parts(read_chunks, section: str, field: str, names: set = None):
+    """
+    Потоково делит документ экспорта на независимые части для импорта пачками
+
+    Часть - узел сети (шаблон) вместе с триггерами и графиками верхнего уровня,
+    которые на него ссылаются. Объекты, связанные общим триггером или графиком,
+    попадают в одну часть, чтобы такой триггер импортировался вместе с ними.
+    К каждой части прилагаются только группы и соответствия значений, на которые
+    она ссылается, поэтому часть - самостоятельный документ экспорта.
+
+    Документ читается дважды: сначала собираются имена объектов и остальные
+    секции (группы, соответствия значений, триггеры и графики верхнего уровня),
+    затем объекты разбираются по одному. В памяти находятся только остальные
+    секции и части, которые еще не выданы
+
+    :param read_chunks: функция без аргументов, возвращающая новый итератор
+        частей документа
+    :param section: секция объектов, "hosts" или "templates"
+    :param field: поле с именем объекта, "host" или "template"
+    :param names: оставить только объекты с этими именами, None - все.
+        Триггеры и графики остаются, только если все их объекты остались
+    :return: генератор (остальные секции части, часть
+        {section: [...], "triggers": [...], "graphs": [...], "weight": вес})
+    """
+
+    shared, linked = {}, {key: [] for key in LINKED_SECTIONS}
+    object_names = []
+
+    events = json_stream.parse(read_chunks())
+    for prefix, event, key in events:
+        if prefix != "zabbix_export" or event != "map_key":
+            continue
+        first = next(events)
+        if key == section:
+            name_prefix = f"zabbix_export.{section}.item.{field}"
+            object_names = [
+                value
+                for event_prefix, event, value in json_stream.iter_value(first, events)
+                if event == "string" and event_prefix == name_prefix
+            ]
+        elif key in LINKED_SECTIONS:
+            linked[key] = json_stream.build_value(first, events)
+        else:
+            shared[key] = json_stream.build_value(first, events)
+
+    if names is not None:
+        object_names = [name for name in object_names if name in names]
+
+    # Объединение объектов, связанных триггерами и графиками верхнего уровня
+    parent = {name: name for name in object_names}
+
+    def root(name):
+        while parent[name] != name:
+            parent[name] = parent[parent[name]]
+            name = parent[name]
+        return name
+
+    linked_objects = []
+    for key in LINKED_SECTIONS:
+        for obj in linked[key]:
+            refs = referenced_hosts(obj)
+            if names is not None and not refs <= names:
+                continue
+            refs = [name for name in refs if name in parent]
+            # Триггер без объектов этого документа импортировать не с чем
+            if not refs:
+                continue
+            for name in refs[1:]:
+                parent[root(name)] = root(refs[0])
+            linked_objects.append((key, obj, refs[0]))
+
+    left = {}  # корень -> сколько объектов части еще не прочитано
+    for name in object_names:
+        left[root(name)] = left.get(root(name), 0) + 1
+    part_linked = {}
+    for key, obj, name in linked_objects:
+        part_linked.setdefault(root(name), []).append((key, obj))
+    del linked, linked_objects
+
+    pending = {}  # корень -> (часть, группы, соответствия значений)
+    for obj in json_stream.items(
+        json_stream.parse(read_chunks()), f"zabbix_export.{section}.item"
+    ):
+        if obj.get(field) not in parent:
+            continue
+        name_root = root(obj[field])
+        part, groups, value_maps = pending.setdefault(
+            name_root,
+            ({section: [], "triggers": [], "graphs": [], "weight": 0}, set(), set()),
+        )
+        part[section].append(obj)
+        part["weight"] += export_weight(obj)
+        _references(obj, groups, value_maps)
+
+        left[name_root] -= 1
+        if left[name_root]:
+            continue
+        del pending[name_root]
+        for key, linked_obj in part_linked.pop(name_root, []):
+            part[key].append(linked_obj)
+            part["weight"] += export_weight(linked_obj)
+        yield _part_shared(shared, groups, value_maps), part
+
+
+def _part_shared(shared: dict, groups: set, value_maps: set) -> dict:
+    """
+    Остальные секции документа, необходимые части
+    """
+
+    part_shared = {}
+    for key, value in shared.items():
+        if key in GROUP_SECTIONS and isinstance(value, list):
+            value = [g for g in value if g.get("name") in groups]
+        elif key == VALUE_MAPS_SECTION and isinstance(value, list):
+            value = [v for v in value if v.get("name") in value_maps]
+        part_shared[key] = value
+    return part_shared
+
+
+def join_parts(parts, section: str) -> dict:
+    """
+    Собирает документ экспорта из частей iter_export_parts, в том числе из разных
+    документов
+
+    Списки остальных секций (группы, соответствия значений) объединяются
+    без повторов, остальные значения берутся из первой части
+
+    :param parts: [(остальные секции, часть), ...]
+    :param section: секция объектов, "hosts" или "templates"
+    :return: документ экспорта {"zabbix_export": {...}}
+    """
+
+    data = {}
+    seen = {}
+    for shared, part in parts:
+        _join_shared(data, seen, shared)
+        for key in (section,) + LINKED_SECTIONS:
+            if part[key]:
+                data.setdefault(key, []).extend(part[key])
+
+    return {"zabbix_export": data}
+
+
+def _join_shared(data: dict, seen: dict, shared: dict) -> None:
+    """
+    Добавляет в документ `data` остальные секции части без повторов
+
+    :param seen: {секция: множество JSON уже добавленных элементов}
+    """
+
+    for key, value in shared.items():
+        if not isinstance(value, list):
+            data.setdefault(key, value)
+            continue
+        section = data.setdefault(key, [])
+        section_seen = seen.setdefault(key, set())
+        for item in value:
+            item_key = json.dumps(item, sort_keys=True)
+            if item_key not in section_seen:
+                section_seen.add(item_key)
+                section.append(item)
+
+
+def export_object_names(chunks, section: str, field: str) -> list:
+    """
+    Потоково собирает имена объектов экспорта, не загружая документ целиком
+
+    :param chunks: части документа экспорта
+    :param section: секция экспорта, например "hosts"
+    :param field: поле с именем объекта, например "host"
+    :return: список имен
+    """
+
+    prefix = f"zabbix_export.{section}.item.{field}"
+    return [
+        value
+        for event_prefix, event, value in json_stream.parse(chunks)
+        if event == "string" and event_prefix == prefix
+    ]
@@ -0,0 +1,249 @@
+"""
+Статистика вызовов Zabbix API
+
+Для каждого метода API (host.get, configuration.export, ...) считается количество
+вызовов, ошибки, задержки (p50, p95, максимум), объем переданных данных и сколько
+байт сэкономлено сжатием запросов и ответов.
+В конце работы статистика сохраняется в JSON отчет и в файл для textfile collector
+Prometheus node_exporter.
+"""
+
+import json
+import math
+import os
+import pathlib
+import threading
+import time
+
+# Префикс имен метрик Prometheus
+METRICS_PREFIX = "zabbix_migration"
+
+
+def percentile(sorted_values: list, q: float) -> float:
+    """
+    Процентиль методом ближайшего ранга
+
+    :param sorted_values: отсортированные значения
+    :param q: процентиль от 0 до 1
+    """
+
+    if not sorted_values:
+        return 0.0
+    rank = max(math.ceil(q * len(sorted_values)), 1)
+    return sorted_values[rank - 1]
+
+
+class ApiMetrics:
+    """
+    Потокобезопасный сборщик статистики вызовов API
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._methods = {}
+        self.started = time.time()
+
+    def record(
+        self,
+        method: str,
+        seconds: float,
+        request_bytes: int = 0,
+        response_bytes: int = 0,
+        error: bool = False,
+        saved_bytes: int = 0,
+    ) -> None:
+        """
+        Учитывает один вызов метода API
+
+        :param saved_bytes: на сколько байт меньше передано по сети благодаря
+            сжатию тела запроса и ответа
+        """
+
+        with self._lock:
+            stat = self._methods.get(method)
+            if stat is None:
+                stat = self._methods[method] = {
+                    "latencies": [],
+                    "errors": 0,
+                    "request_bytes": 0,
+                    "response_bytes": 0,
+                    "saved_bytes": 0,
+                }
+            stat["latencies"].append(seconds)
+            stat["request_bytes"] += request_bytes
+            stat["response_bytes"] += response_bytes
+            stat["saved_bytes"] += saved_bytes
+            if error:
+                stat["errors"] += 1
+
+    def summary(self) -> dict:
+        """
+        Статистика по методам:
+            {
+                "host.get": {
+                    "count": 3,
+                    "errors": 0,
+                    "total_s": 1.5,
+                    "p50_s": 0.4,
+                    "p95_s": 0.7,
+                    "max_s": 0.7,
+                    "request_bytes": 512,
+                    "response_bytes": 1048576,
+                    "saved_bytes": 4194304
+                },
+                ...
+            }
+        """
+
+        with self._lock:
+            methods = {
+                method: (sorted(stat["latencies"]), dict(stat))
+                for method, stat in self._methods.items()
+            }
+
+        summary = {}
+        for method, (latencies, stat) in sorted(methods.items()):
+            summary[method] = {
+                "count": len(latencies),
+                "errors": stat["errors"],
+                "total_s": round(sum(latencies), 6),
+                "p50_s": round(percentile(latencies, 0.5), 6),
+                "p95_s": round(percentile(latencies, 0.95), 6),
+                "max_s": round(latencies[-1] if latencies else 0.0, 6),
+                "request_bytes": stat["request_bytes"],
+                "response_bytes": stat["response_bytes"],
+                "saved_bytes": stat["saved_bytes"],
+            }
+        return summary
+
+    def report(self, **info) -> dict:
+        """
+        Отчет о работе: время начала и окончания, итоги и статистика по методам
+
+        :param info: дополнительные сведения (действие, адрес сервера, версия API)
+        """
+
+        finished = time.time()
+        methods = self.summary()
+        return {
+            **info,
+            "started": self.started,
+            "finished": finished,
+            "duration_s": round(finished - self.started, 3),
+            "totals": {
+                "count": sum(m["count"] for m in methods.values()),
+                "errors": sum(m["errors"] for m in methods.values()),
+                "total_s": round(sum(m["total_s"] for m in methods.values()), 6),
+                "request_bytes": sum(m["request_bytes"] for m in methods.values()),
+                "response_bytes": sum(m["response_bytes"] for m in methods.values()),
+                "saved_bytes": sum(m["saved_bytes"] for m in methods.values()),
+            },
+            "methods": methods,
+        }
+
+    def prometheus(self, action: str) -> str:
+        """
+        Статистика в текстовом формате Prometheus
+
+        :param action: действие (backup или restore), добавляется меткой action
+        """
+
+        methods = self.summary()
+        lines = []
+
+        def metric(name: str, metric_type: str, help_text: str, values):
+            full_name = f"{METRICS_PREFIX}_{name}"
+            lines.append(f"# HELP {full_name} {help_text}")
+            lines.append(f"# TYPE {full_name} {metric_type}")
+            for suffix, labels, value in values:
+                label_text = ",".join(
+                    f'{key}="{label}"'
+                    for key, label in {"action": action, **labels}.items()
+                )
+                lines.append(f"{full_name}{suffix}{{{label_text}}} {value}")
+
+        metric(
+            "api_request_duration_seconds",
+            "summary",
+            "Zabbix API call latency.",
+            [
+                (suffix, {"method": method, **labels}, stat[key])
+                for method, stat in methods.items()
+                for suffix, labels, key in (
+                    ("", {"quantile": "0.5"}, "p50_s"),
+                    ("", {"quantile": "0.95"}, "p95_s"),
+                    ("", {"quantile": "1"}, "max_s"),
+                    ("_sum", {}, "total_s"),
+                    ("_count", {}, "count"),
+                )
+            ],
+        )
+        metric(
+            "api_errors_total",
+            "counter",
+            "Zabbix API calls that failed.",
+            [("", {"method": m}, stat["errors"]) for m, stat in methods.items()],
+        )
+        metric(
+            "api_request_bytes_total",
+            "counter",
+            "Bytes sent to Zabbix API.",
+            [("", {"method": m}, stat["request_bytes"]) for m, stat in methods.items()],
+        )
+        metric(
+            "api_response_bytes_total",
+            "counter",
+            "Bytes received from Zabbix API.",
+            [
+                ("", {"method": m}, stat["response_bytes"])
+                for m, stat in methods.items()
+            ],
+        )
+        metric(
+            "api_saved_bytes_total",
+            "counter",
+            "Bytes not transferred thanks to request and response compression.",
+            [("", {"method": m}, stat["saved_bytes"]) for m, stat in methods.items()],
+        )
+        metric(
+            "run_duration_seconds",
+            "gauge",
+            "Duration of the last run.",
+            [("", {}, round(time.time() - self.started, 3))],
+        )
+        metric(
+            "run_finished_timestamp_seconds",
+            "gauge",
+            "Time the last run finished.",
+            [("", {}, round(time.time(), 3))],
+        )
+        return "\n".join(lines) + "\n"
+
+    def write(self, directory: pathlib.Path, action: str, **info) -> pathlib.Path:
+        """
+        Сохраняет отчет <action>_report.json и файл zabbix_migration_<action>.prom
+
+        Файлы заменяются атомарно, чтобы node_exporter не прочитал
+        недописанный файл
+
+        :return: путь к JSON отчету
+        """
+
+        directory = pathlib.Path(directory)
+        directory.mkdir(parents=True, exist_ok=True)
+
+        report_path = directory / f"{action}_report.json"
+        _write_atomic(
+            report_path, json.dumps(self.report(action=action, **info), indent=2)
+        )
+        _write_atomic(
+            directory / f"{METRICS_PREFIX}_{action}.prom", self.prometheus(action)
+        )
+        return report_path
+
+
+def _write_atomic(path: pathlib.Path, text: str) -> None:
+    tmp_path = path.with_name(path.name + ".tmp")
+    with tmp_path.open("w", encoding="utf-8") as file:
+        file.write(text)
+    os.replace(tmp_path, path)
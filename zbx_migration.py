@@ -1,15 +1,198 @@
+import argparse
+import os
 import pathlib
 import sys
 
-from backup_zabbix import BackupZabbix, C
-from restore_zabbix import RestoreZabbix
-
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
 from configparser import ConfigParser
-from requests import ConnectionError as ZabbixConnectionError
+from contextlib import nullcontext
+
+# Модули резервного копирования и восстановления (pyzabbix, requests, ...)
+# импортируются только при запуске действия, чтобы `--help` выполнялся сразу
+from zbx_colors import C
 
 # Получение текущего каталога файла.
 BASE_DIR = pathlib.Path(__file__).parent
 
+# Максимальное количество одновременных запросов к Zabbix API
+WORKERS = 4
+
+# Сжатие файлов резервной копии: None, "gzip" или "zstd" (пакет zstandard)
+COMPRESSION = "gzip"
+
+# Транспорт Zabbix API: "threads" (pyzabbix) или "async" (aiohttp, см. zbx_async.py),
+# одновременных запросов в обоих случаях не больше WORKERS
+ENGINE = "threads"
+
+# Сжимать gzip большие тела запросов (configuration.import). Работает, только если
+# веб-сервер Zabbix распаковывает запросы, иначе сжатие отключается автоматически
+COMPRESS_REQUESTS = False
+
+ACTION_CHOOSE = {
+    1: "images",
+    2: "global_macros",
+    3: "host_groups",
+    4: "templates",
+    5: "hosts",
+    6: "maps",
+    7: "user_groups",
+    8: "scripts",
+    9: "media_types",
+    10: "users",
+}
+
+# Этапы восстановления, которые должны завершиться до начала этапа: импорт
+# ссылается на созданные ими объекты по именам. Этапы без общих зависимостей
+# выполняются одновременно, зависимости выбранных этапов добавляются автоматически
+STAGE_DEPENDENCIES = {
+    "images": (),
+    "global_macros": (),
+    "host_groups": (),
+    "templates": ("host_groups",),
+    "hosts": ("host_groups", "templates"),
+    "maps": ("images", "host_groups", "hosts"),
+    "user_groups": ("host_groups",),
+    "scripts": ("host_groups", "user_groups"),
+    "media_types": (),
+    "users": ("user_groups", "media_types"),
+}
+
+# Желаемое время одного импорта пачки узлов сети (configuration.import), секунд.
+# Размер пачек подстраивается под фактическое время импорта
+IMPORT_BATCH_SECONDS = 20.0
+
+# Перенос между серверами: сколько экспортированных частей может ожидать импорта.
+# В памяти одновременно находится не более WORKERS + MIGRATE_QUEUE_SIZE частей
+MIGRATE_QUEUE_SIZE = 8
+
+# Коды завершения при запуске с аргументами
+EXIT_OK = 0
+EXIT_STAGE_FAILED = 1  # Один или несколько этапов завершились ошибкой
+EXIT_USAGE = 2  # Неверные аргументы (код argparse)
+EXIT_AUTH = 3  # Не указаны данные для подключения
+EXIT_CONNECTION = 4  # Не удалось подключиться или войти в Zabbix API
+
+
+def create_action(action_type: str, url: str, login: str, password: str, **kwargs):
+    """
+    Создает экземпляр BackupZabbix или RestoreZabbix
+
+    :param action_type: "Backup" или "Restore"
+    :param kwargs: workers, compression, metrics_dir, backup_dir, engine,
+        compress_requests, resume и import_batch_seconds (только для Restore)
+    """
+
+    if action_type == "Backup":
+        from backup_zabbix import BackupZabbix
+
+        return BackupZabbix(url, login, password, **kwargs)
+
+    from restore_zabbix import RestoreZabbix
+
+    return RestoreZabbix(url, login, password, **kwargs)
+
+
+def with_dependencies(stages: list) -> list:
+    """
+    Добавляет к этапам все этапы, от которых они зависят (STAGE_DEPENDENCIES)
+
+    :return: имена этапов в порядке ACTION_CHOOSE
+    """
+
+    names = set()
+    required = list(stages)
+    while required:
+        name = required.pop()
+        if name not in names:
+            names.add(name)
+            required.extend(STAGE_DEPENDENCIES.get(name, ()))
+    return [name for name in ACTION_CHOOSE.values() if name in names]
+
+
+def run_stages(
+    zbx_session, stages: list, stage_kwargs: dict = None, ordered: bool = True
+) -> list:
+    """
+    Выполняет этапы резервного копирования или восстановления
+
+    Этап начинается, как только завершены выбранные этапы, от которых он зависит
+    (STAGE_DEPENDENCIES), независимые этапы выполняются одновременно. Если этап
+    завершился ошибкой (в том числе не восстановил часть объектов, StageFailed),
+    то зависящие от него этапы не выполняются
+
+    :param zbx_session: экземпляр BackupZabbix, RestoreZabbix или MigrateZabbix
+    :param stages: имена этапов (значения ACTION_CHOOSE)
+    :param stage_kwargs: аргументы этапов, например {"hosts": {"groups": [...]}}
+    :param ordered: учитывать зависимости этапов. Резервному копированию порядок
+        не нужен: этапы только читают данные сервера
+    :return: имена этапов, завершившихся ошибкой или пропущенных
+    """
+
+    # Сбой соединения, таймаут или ошибка HTTP, после исчерпания повторов
+    from requests import RequestException as ZabbixConnectionError
+
+    stage_kwargs = stage_kwargs or {}
+    dependencies = {
+        name: [
+            required
+            for required in (STAGE_DEPENDENCIES.get(name, ()) if ordered else ())
+            if required in stages
+        ]
+        for name in stages
+    }
+    # Этап в отдельном потоке получает собственную сессию Zabbix API
+    stage_session = getattr(zbx_session, "stage_session", nullcontext)
+
+    def run_stage(method_name: str):
+        with stage_session():
+            # Выполняем требуемый метод Backup или Restore
+            getattr(zbx_session, method_name)(**stage_kwargs.get(method_name, {}))
+
+    failed = []
+    done = set()
+    waiting = list(stages)
+    running = {}
+    with ThreadPoolExecutor(max_workers=max(1, len(stages))) as executor:
+        while waiting or running:
+            # Этапы упорядочены по ACTION_CHOOSE, зависимости всегда раньше этапа
+            for method_name in list(waiting):
+                missing = [
+                    required
+                    for required in dependencies[method_name]
+                    if required in failed
+                ]
+                if missing:
+                    waiting.remove(method_name)
+                    failed.append(method_name)
+                    print(
+                        C.FAIL,
+                        f"Этап {method_name} пропущен, ошибка этапа:",
+                        ", ".join(missing),
+                        C.ENDC,
+                    )
+                elif all(required in done for required in dependencies[method_name]):
+                    waiting.remove(method_name)
+                    running[executor.submit(run_stage, method_name)] = method_name
+            if not running:
+                break
+
+            finished, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in finished:
+                method_name = running.pop(future)
+                try:
+                    future.result()
+
+                # Отлов ошибки, возникающей при сбое подключения к Zabbix API.
+                except ZabbixConnectionError as e:
+                    print(C.FAIL, "Ошибка подключения:", e, C.ENDC)
+                    failed.append(method_name)
+                except Exception as e:
+                    print(C.FAIL, f"Ошибка этапа {method_name}:", e, C.ENDC)
+                    failed.append(method_name)
+                else:
+                    done.add(method_name)
+    return failed
+
 
 def backup_restore_line(action_type: str):
     """
@@ -20,36 +203,25 @@ def backup_restore_line(action_type: str):
 
     url, login, password = get_auth(for_=action_type)  # Backup/Restore
 
-    ACTION_CHOOSE = {
-        1: "images",
-        2: "global_macros",
-        3: "host_groups",
-        4: "templates",
-        5: "hosts",
-        6: "maps",
-        7: "user_groups",
-        8: "scripts",
-        9: "media_types",
-        10: "users",
-    }
-
     while True:
         print(
             "\n",
-            f" Выберите, какую резервную копию необходимо",
+            " Выберите, какую резервную копию необходимо",
             f"{'сделать' if action_type == 'Backup' else 'восстановить'}. \n",
             " (несколько пунктов передавать через пробел) -> 1 2 5 \n\n",
             "  0.  " + C.HEADER + "Все" + C.ENDC + "\n",
             "  1.  Изображения \n",
             "  2.  Глобальные макросы \n",
             "  3.  Группы узлов сети \n",
-            "  4.  Шаблоны \n",
-            "  5.  Узлы сети \n",
-            "  6.  Карты сетей \n",
-            "  7.  Группы пользователей\n",
+            "  4.  Шаблоны (зависит от 3)\n",
+            "  5.  Узлы сети (зависит от 3, 4)\n",
+            "  6.  Карты сетей (зависит от 1, 3, 5)\n",
+            "  7.  Группы пользователей (зависит от 3)\n",
             "  8.  Глобальные скрипты (зависит от `3, 7`)\n",
             "  9.  Способы оповещения \n",
             "  10. Пользователи (зависит от 7, 9)\n",
+            "\n  Этапы, от которых зависят выбранные, при восстановлении добавляются\n",
+            "  автоматически, независимые этапы выполняются одновременно\n",
         )
         operation = input(" > ")
         numbers = list(
@@ -65,27 +237,66 @@ def backup_restore_line(action_type: str):
             break
         print(C.FAIL, "Неверный вариант", C.ENDC)
 
-    # Проверка, соответствует ли тип действия строке «Backup».
-    if action_type == "Backup":
-        action_instance = BackupZabbix(url, login, password)
-    elif action_type == "Restore":
-        action_instance = RestoreZabbix(url, login, password)
-    else:
+    if action_type not in ("Backup", "Restore"):
         print(f"Неверное действие! {action_type}")
         sys.exit()
 
+    action_instance = create_action(
+        action_type,
+        url,
+        login,
+        password,
+        workers=WORKERS,
+        compression=COMPRESSION,
+        engine=ENGINE,
+        compress_requests=COMPRESS_REQUESTS,
+    )
+
+    # Проверяем, ввел ли пользователь «0» или «n» в списке чисел.
+    stages = [
+        method_name
+        for n, method_name in ACTION_CHOOSE.items()
+        if n in numbers or 0 in numbers
+    ]
+    stage_kwargs = {}
+    if action_type == "Restore":
+        added = [name for name in with_dependencies(stages) if name not in stages]
+        if added:
+            print(
+                C.OKBLUE,
+                "Добавлены этапы, от которых зависят выбранные:",
+                ", ".join(added),
+                C.ENDC,
+            )
+            stages = with_dependencies(stages)
+        if "hosts" in stages:
+            # Спрашиваем заранее: этапы выполняются одновременно
+            from restore_zabbix import RestoreZabbix
+
+            stage_kwargs["hosts"] = {"groups": RestoreZabbix.ask_groups()}
+
     with action_instance as zbx_session:
-        for n, method_name in ACTION_CHOOSE.items():
-            # Проходимся по действия
-            # Проверяем, ввел ли пользователь «0» или «n» в списке чисел.
-            if n in numbers or 0 in numbers:
-                try:
-                    # Выполняем требуемый метод Backup или Restore
-                    getattr(zbx_session, method_name)()
+        run_stages(zbx_session, stages, stage_kwargs, ordered=action_type == "Restore")
 
-                # Отлов ошибки, возникающей при сбое подключения к Zabbix API.
-                except ZabbixConnectionError:
-                    print(C.FAIL, "Ошибка подключения", C.ENDC)
+
+def restore_plan_line():
+    """
+    Составляет план восстановления, ничего не изменяя на сервере Zabbix
+    """
+
+    url, login, password = get_auth(for_="Restore")
+
+    with create_action(
+        "Restore",
+        url,
+        login,
+        password,
+        workers=WORKERS,
+        compression=COMPRESSION,
+        engine=ENGINE,
+        compress_requests=COMPRESS_REQUESTS,
+    ) as zbx_session:
+        run_stages(zbx_session, ["plan"])
 
 
 def get_auth(for_: str) -> tuple:
@@ -162,7 +373,7 @@ def get_auth(for_: str) -> tuple:
                 f" Имеются сохраненные данные для подключения:\n{C.HEADER}",
                 f"   Адрес: {url}\n",
                 f"   Логин: {login}\n",
-                f"   Пароль: **********",
+                "   Пароль: **********",
                 C.ENDC,
                 sep="",
             )
@@ -183,7 +394,353 @@ def get_auth(for_: str) -> tuple:
     return url, login, password
 
 
-if __name__ == "__main__":
+def get_auth_non_interactive(
+    for_: str, args: argparse.Namespace, prefix: str = ""
+) -> tuple:
+    """
+    Возвращаем URL, логин, пароль без вопросов пользователю
+
+    Каждое значение берется из первого найденного источника:
+        1. аргументы --url, --login, --password-file;
+        2. переменные окружения ZABBIX_<BACKUP|RESTORE>_URL, ..._LOGIN, ..._PASSWORD,
+           затем общие ZABBIX_URL, ZABBIX_LOGIN, ZABBIX_PASSWORD;
+        3. раздел Zabbix_<Backup|Restore> файла --auth-file (формат файла `auth`).
+
+    :param for_: "Backup" или "Restore"
+    :param prefix: префикс аргументов, например "source_" для --source-url
+        команды migrate
+    :return: URL, логин, пароль; пустая строка, если значение не найдено
+    """
+
+    cfg_section_name = f"Zabbix_{for_}"
+    cfg = ConfigParser()
+    cfg.read(args.auth_file)
+
+    password = ""
+    password_file = getattr(args, f"{prefix}password_file")
+    if password_file:
+        password = pathlib.Path(password_file).read_text().strip()
+
+    values = {
+        "url": getattr(args, f"{prefix}url") or "",
+        "login": getattr(args, f"{prefix}login") or "",
+        "password": password,
+    }
+    for key in values:
+        values[key] = (
+            values[key]
+            or os.environ.get(f"ZABBIX_{for_.upper()}_{key.upper()}")
+            or os.environ.get(f"ZABBIX_{key.upper()}")
+            or cfg.get(cfg_section_name, key, fallback="")
+        )
+
+    return values["url"], values["login"], values["password"]
+
+
+def parse_stages(values: list) -> list:
+    """
+    Имена или номера этапов (как в меню) -> имена этапов в порядке выполнения
+
+    :param values: например ["hosts", "4"] или ["all"]
+    """
+
+    names = set()
+    for value in values:
+        for item in value.replace(",", " ").split():
+            if item in ("all", "0"):
+                names.update(ACTION_CHOOSE.values())
+            elif item.isdigit() and int(item) in ACTION_CHOOSE:
+                names.add(ACTION_CHOOSE[int(item)])
+            elif item in ACTION_CHOOSE.values():
+                names.add(item)
+            else:
+                raise argparse.ArgumentTypeError(f"неизвестный этап: {item}")
+    return [name for name in ACTION_CHOOSE.values() if name in names]
+
+
+def parse_args(argv=None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        description="Резервное копирование и восстановление Zabbix через API. "
+        "Без аргументов запускается интерактивное меню.",
+        epilog=f"Коды завершения: {EXIT_OK} - успешно, "
+        f"{EXIT_STAGE_FAILED} - ошибка одного из этапов, {EXIT_USAGE} - неверные аргументы, "
+        f"{EXIT_AUTH} - нет данных для подключения, "
+        f"{EXIT_CONNECTION} - не удалось подключиться к Zabbix API.",
+    )
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    connection_parser = argparse.ArgumentParser(add_help=False)
+    connection = connection_parser.add_argument_group("подключение к Zabbix API")
+    connection.add_argument("--url", help="адрес Zabbix")
+    connection.add_argument("--login", help="имя пользователя")
+    connection.add_argument(
+        "--password-file", type=pathlib.Path, help="файл, содержащий пароль"
+    )
+
+    # Параметры работы с Zabbix API, общие для всех команд
+    api = argparse.ArgumentParser(add_help=False)
+    api.add_argument(
+        "--auth-file",
+        type=pathlib.Path,
+        default=BASE_DIR / "auth",
+        help="файл с сохраненными данными подключения (по умолчанию %(default)s)",
+    )
+    api.add_argument(
+        "--workers",
+        type=int,
+        default=WORKERS,
+        help="максимальное количество одновременных запросов к API (%(default)s)",
+    )
+    api.add_argument(
+        "--engine",
+        choices=["threads", "async"],
+        default=ENGINE,
+        help="транспорт Zabbix API: pyzabbix или aiohttp (один сеанс, пул keep-alive"
+        " соединений); число одновременных запросов задает --workers (%(default)s)",
+    )
+    api.add_argument(
+        "--compress-requests",
+        action=argparse.BooleanOptionalAction,
+        default=COMPRESS_REQUESTS,
+        help="сжимать gzip большие тела запросов, если веб-сервер их принимает"
+        " (%(default)s)",
+    )
+    api.add_argument(
+        "--metrics-dir",
+        type=pathlib.Path,
+        help="папка для отчета о вызовах API (по умолчанию папка резервной копии)",
+    )
+
+    common = argparse.ArgumentParser(add_help=False, parents=[connection_parser, api])
+    common.add_argument(
+        "--backup-dir",
+        type=pathlib.Path,
+        default=BASE_DIR / "backup",
+        help="папка резервной копии (по умолчанию %(default)s)",
+    )
+    common.add_argument(
+        "--compression",
+        choices=["none", "gzip", "zstd"],
+        default=COMPRESSION or "none",
+        help="сжатие файлов резервной копии (%(default)s)",
+    )
+
+    stages_help = (
+        "этапы: all или имена/номера из меню через пробел или запятую: "
+        + ", ".join(f"{n}={name}" for n, name in ACTION_CHOOSE.items())
+    )
+    backup = subparsers.add_parser(
+        "backup", parents=[common], help="сделать резервную копию"
+    )
+    backup.add_argument("--stages", nargs="+", default=["all"], help=stages_help)
+    backup.add_argument(
+        "--incremental",
+        action="store_true",
+        help="экспортировать заново только узлы сети и шаблоны, измененные по журналу"
+        " аудита с прошлого копирования",
+    )
+
+    restore = subparsers.add_parser(
+        "restore", parents=[common], help="восстановить резервную копию"
+    )
+    restore.add_argument("--stages", nargs="+", default=["all"], help=stages_help)
+    restore.add_argument(
+        "--groups",
+        nargs="*",
+        default=[],
+        help="группы узлов сети для восстановления (по умолчанию все)",
+    )
+    restore.add_argument(
+        "--import-batch-seconds",
+        type=float,
+        default=IMPORT_BATCH_SECONDS,
+        help="желаемое время импорта одной пачки узлов сети, размер пачек"
+        " подстраивается под него (%(default)s)",
+    )
+    restore.add_argument(
+        "--resume",
+        action="store_true",
+        help="продолжить прерванное восстановление: пропустить этапы и файлы,"
+        " которые уже восстановлены и с тех пор не изменились",
+    )
+
+    subparsers.add_parser(
+        "plan",
+        parents=[common],
+        help="план восстановления (без изменений на сервере)",
+    )
+
+    migrate = subparsers.add_parser(
+        "migrate",
+        parents=[api],
+        help="перенести данные с одного сервера Zabbix на другой без резервной копии",
+        description="Данные передаются через память: экспорт с источника и импорт"
+        " в целевой сервер выполняются одновременно. Данные подключения также"
+        " берутся из переменных окружения ZABBIX_BACKUP_* (источник),"
+        " ZABBIX_RESTORE_* (целевой сервер) и разделов Zabbix_Backup и"
+        " Zabbix_Restore файла --auth-file.",
+    )
+    for side, title in (("source", "сервер-источник"), ("target", "целевой сервер")):
+        group = migrate.add_argument_group(title)
+        group.add_argument(f"--{side}-url", help="адрес Zabbix")
+        group.add_argument(f"--{side}-login", help="имя пользователя")
+        group.add_argument(
+            f"--{side}-password-file", type=pathlib.Path, help="файл, содержащий пароль"
+        )
+    migrate.add_argument("--stages", nargs="+", default=["all"], help=stages_help)
+    migrate.add_argument(
+        "--import-batch-seconds",
+        type=float,
+        default=IMPORT_BATCH_SECONDS,
+        help="желаемое время импорта одной пачки узлов сети (%(default)s)",
+    )
+    for subparser in (restore, migrate):
+        subparser.add_argument(
+            "--no-dependencies",
+            action="store_true",
+            help="выполнить только указанные этапы, не добавляя этапы, от которых"
+            " они зависят",
+        )
+    migrate.add_argument(
+        "--queue-size",
+        type=int,
+        default=MIGRATE_QUEUE_SIZE,
+        help="сколько экспортированных групп узлов сети или частей шаблонов может"
+        " ожидать импорта (%(default)s)",
+    )
+
+    args = parser.parse_args(argv)
+    if args.command != "plan":
+        try:
+            args.stages = parse_stages(args.stages)
+        except argparse.ArgumentTypeError as e:
+            parser.error(str(e))
+        # Резервному копированию зависимости не нужны: этапы только читают данные
+        if args.command != "backup" and not args.no_dependencies:
+            args.stages = with_dependencies(args.stages)
+    return args
+
+
+def main(argv: list) -> int:
+    """
+    Запуск без вопросов пользователю (cron, CI)
+
+    :return: код завершения
+    """
+
+    args = parse_args(argv)
+    if args.command == "migrate":
+        # Источник подключается как Backup, целевой сервер - как Restore
+        sides = {"Backup": "source_", "Restore": "target_"}
+    else:
+        sides = {"Backup" if args.command == "backup" else "Restore": ""}
+
+    auth = {}
+    for action_type, prefix in sides.items():
+        url, login, password = get_auth_non_interactive(action_type, args, prefix)
+        if not url or not login or not password:
+            option = "--" + prefix.replace("_", "-")
+            print(
+                C.FAIL,
+                f"Не указаны данные для подключения к Zabbix API ({action_type}):",
+                f"{option}url, {option}login, {option}password-file,",
+                "переменные окружения ZABBIX_*",
+                f"или раздел Zabbix_{action_type} в {args.auth_file}",
+                C.ENDC,
+                file=sys.stderr,
+            )
+            return EXIT_AUTH
+        auth[action_type] = (url, login, password)
+
+    if args.command == "migrate" and auth["Backup"][0] == auth["Restore"][0]:
+        print(
+            C.FAIL,
+            "Сервер-источник и целевой сервер совпадают:",
+            auth["Backup"][0],
+            C.ENDC,
+            file=sys.stderr,
+        )
+        return EXIT_USAGE
+
+    from pyzabbix import ZabbixAPIException
+    from requests import RequestException
+
+    connection_errors = (RequestException, ZabbixAPIException)
+    if args.engine == "async":
+        import asyncio
+        from aiohttp import ClientError
+
+        connection_errors += (ClientError, asyncio.TimeoutError)
+
+    # Ошибки этапов обрабатываются в run_stages, сюда доходят только ошибки
+    # подключения и входа в Zabbix API
+    failed = []
+    try:
+        if args.command == "migrate":
+            from migrate_zabbix import MigrateZabbix
+
+            action_instance = MigrateZabbix(
+                auth["Backup"],
+                auth["Restore"],
+                workers=args.workers,
+                queue_size=args.queue_size,
+                import_batch_seconds=args.import_batch_seconds,
+                metrics_dir=args.metrics_dir,
+                engine=args.engine,
+                compress_requests=args.compress_requests,
+            )
+        else:
+            # Журнал восстановления ведется всегда, продолжить можно только
+            # восстановление. Пачки импорта тоже есть только у восстановления
+            action_kwargs = {}
+            if args.command == "restore":
+                action_kwargs = {
+                    "resume": args.resume,
+                    "import_batch_seconds": args.import_batch_seconds,
+                }
+            (action_type,) = auth
+            action_instance = create_action(
+                action_type,
+                *auth[action_type],
+                workers=args.workers,
+                compression=None if args.compression == "none" else args.compression,
+                metrics_dir=args.metrics_dir,
+                backup_dir=args.backup_dir,
+                engine=args.engine,
+                compress_requests=args.compress_requests,
+                **action_kwargs,
+            )
+        with action_instance as zbx_session:
+            if args.command == "plan":
+                failed = run_stages(zbx_session, ["plan"])
+            elif args.command == "restore":
+                failed = run_stages(
+                    zbx_session, args.stages, {"hosts": {"groups": args.groups}}
+                )
+            elif args.command == "migrate":
+                failed = run_stages(zbx_session, args.stages)
+            else:
+                incremental = {"incremental": args.incremental}
+                failed = run_stages(
+                    zbx_session,
+                    args.stages,
+                    {"hosts": incremental, "templates": incremental},
+                    ordered=False,
+                )
+    except connection_errors as e:
+        print(C.FAIL, "Ошибка подключения:", e, C.ENDC, file=sys.stderr)
+        return EXIT_CONNECTION
+
+    if failed:
+        print(C.FAIL, "Этапы с ошибками:", ", ".join(failed), C.ENDC, file=sys.stderr)
+        return EXIT_STAGE_FAILED
+    return EXIT_OK
+
+
+if __name__ == "__main__" and len(sys.argv) > 1:
+    sys.exit(main(sys.argv[1:]))
+
+elif __name__ == "__main__":
     print(
         C.BOLD,
         f"Добро пожаловать в программу резервного копирования {C.FAIL}Zabbix{C.ENDC}\n",
@@ -196,12 +753,13 @@ if __name__ == "__main__":
             " Выберите, какое действие необходимо выполнить: \n",
             "  1. Сделать резервную копию \n",
             "  2. Восстановить резервную копию \n",
+            "  3. План восстановления (без изменений на сервере) \n",
             "> ",
             end="",
         )
         operation = input()
-        # Проверка, является ли ввод числом и находится ли он между 1 и 2.
-        if operation.isdigit() and 1 <= int(operation) <= 2:
+        # Проверка, является ли ввод числом и находится ли он между 1 и 3.
+        if operation.isdigit() and 1 <= int(operation) <= 3:
             break
 
         print(C.FAIL, "Неверный вариант", C.ENDC)
@@ -210,3 +768,5 @@ if __name__ == "__main__":
         backup_restore_line("Backup")
     elif operation == "2":
         backup_restore_line("Restore")
+    elif operation == "3":
+        restore_plan_line()
@@ -0,0 +1,98 @@
+"""
+Соответствие имен объектов Zabbix их ID на время одного сеанса восстановления
+
+Этапы восстановления ссылаются друг на друга по именам: права групп пользователей -
+на группы узлов сети, пользователи - на группы пользователей и способы оповещения.
+NameResolver загружает соответствие имя -> ID для каждого вида объектов одним
+запросом при первом обращении и дополняет его объектами, которые создают этапы,
+поэтому следующие этапы не запрашивают сервер повторно.
+"""
+
+import threading
+
+# Вид объектов -> (метод API, поле с именем, поле с ID)
+ENTITIES = {
+    "hostgroup": ("hostgroup.get", "name", "groupid"),
+    "usergroup": ("usergroup.get", "name", "usrgrpid"),
+    "mediatype": ("mediatype.get", "name", "mediatypeid"),
+    "template": ("template.get", "host", "templateid"),
+}
+
+
+class NameResolver:
+    """
+    Потокобезопасный кэш соответствий имя -> ID
+
+    Этапы восстановления выполняются одновременно, поэтому все обращения к кэшу,
+    включая запрос для его загрузки, выполняются под блокировкой: add и invalidate
+    другого этапа не теряются, даже если пришлись на время загрузки
+
+    :param zbx: функция, возвращающая клиент Zabbix API текущего потока
+    """
+
+    def __init__(self, zbx):
+        self.zbx = zbx
+        self._ids = {}  # вид объектов -> {имя: ID}
+        self._lock = threading.Lock()
+
+    def ids(self, entity: str) -> dict:
+        """
+        Соответствие имя -> ID объектов вида `entity` (копия)
+
+        :param entity: вид объектов из ENTITIES, например "hostgroup"
+        """
+
+        with self._lock:
+            ids = self._ids.get(entity)
+            if ids is None:
+                method, name_field, id_field = ENTITIES[entity]
+                api_object, api_method = method.split(".")
+                objects = self.zbx()[api_object][api_method](
+                    output=[name_field, id_field]
+                )
+                ids = self._store(entity, objects)
+            return dict(ids)
+
+    def names(self, entity: str) -> set:
+        """
+        Имена имеющихся на сервере объектов вида `entity`
+        """
+        return set(self.ids(entity))
+
+    def load(self, entity: str, objects: list) -> dict:
+        """
+        Заполняет соответствие из уже полученных объектов, например
+        из mediatype.get(output="extend"), чтобы не запрашивать их еще раз
+
+        :return: соответствие имя -> ID (копия)
+        """
+
+        with self._lock:
+            return dict(self._store(entity, objects))
+
+    def _store(self, entity: str, objects: list) -> dict:
+        # Вызывается под блокировкой
+        _, name_field, id_field = ENTITIES[entity]
+        ids = {obj[name_field]: obj[id_field] for obj in objects}
+        self._ids[entity] = ids
+        return ids
+
+    def add(self, entity: str, name: str, object_id: str) -> None:
+        """
+        Добавляет созданный объект. Если соответствие еще не загружено,
+        то объект появится в нем при загрузке
+        """
+
+        with self._lock:
+            if entity in self._ids:
+                self._ids[entity][name] = object_id
+
+    def invalidate(self, entity: str) -> None:
+        """
+        Сбрасывает соответствие, если объекты создавались без известных ID
+        (configuration.import, объект уже существовал). Оно будет загружено
+        заново при следующем обращении
+        """
+
+        with self._lock:
+            self._ids.pop(entity, None)
@@ -0,0 +1,288 @@
+"""
+Управление нагрузкой на Zabbix API
+
+Количество одновременных запросов подстраивается под сервер по принципу AIMD:
+каждый успешный запрос немного увеличивает лимит (в среднем на 1 за "окно"
+из `limit` запросов), а ошибка перегрузки (таймаут, обрыв соединения, HTTP 5xx/429)
+или резкий рост задержки уменьшает лимит вдвое.
+
+Запросы, которые можно безопасно повторить (чтение: *.get, configuration.export),
+при ошибке перегрузки повторяются с экспоненциальной задержкой со случайной
+составляющей (full jitter), чтобы потоки не возвращались к серверу одновременно.
+"""
+
+import asyncio
+import random
+import threading
+import time
+from contextlib import contextmanager
+
+import requests
+
+try:
+    import aiohttp
+except ImportError:  # aiohttp - необязательная зависимость (zbx_async.py)
+    aiohttp = None
+
+# Методы, которые не изменяют данные и могут быть повторены
+# (повторный вход или выход лишь создает или закрывает сессию)
+IDEMPOTENT_METHODS = {
+    "apiinfo.version",
+    "user.checkAuthentication",
+    "user.login",
+    "user.logout",
+    "configuration.export",
+}
+
+# Во сколько раз задержка должна превысить обычную для метода, чтобы считаться перегрузкой
+LATENCY_FACTOR = 3.0
+
+# Сколько ответов метода нужно, чтобы судить о его обычной задержке
+LATENCY_MIN_SAMPLES = 5
+
+# Не уменьшать лимит чаще, чем раз в столько секунд: одна перегрузка
+# обычно приводит к ошибкам сразу нескольких одновременных запросов
+DECREASE_INTERVAL = 1.0
+
+# Вес пачки импорта (узлы сети, элементы данных, триггеры, ...) до первых замеров
+IMPORT_BATCH_WEIGHT = 2000
+
+# Границы веса пачки импорта
+MIN_BATCH_WEIGHT = 50
+MAX_BATCH_WEIGHT = 200_000
+
+# Доля нового замера в сглаженной скорости импорта
+BATCH_RATE_SMOOTHING = 0.3
+
+
+def is_idempotent(method: str) -> bool:
+    return method.endswith(".get") or method in IDEMPOTENT_METHODS
+
+
+def is_overload_error(error: Exception) -> bool:
+    """
+    Ошибка говорит о перегрузке сервера или сети, а не о неверном запросе
+    """
+
+    if isinstance(error, (requests.ConnectionError, requests.Timeout)):
+        return True
+    if isinstance(error, requests.HTTPError) and error.response is not None:
+        return error.response.status_code >= 500 or error.response.status_code == 429
+    if aiohttp is not None:
+        # Ошибки асинхронного движка
+        if isinstance(error, aiohttp.ClientResponseError):
+            return error.status >= 500 or error.status == 429
+        if isinstance(error, (aiohttp.ClientConnectionError, asyncio.TimeoutError)):
+            return True
+    return False
+
+
+class AdaptiveLimiter:
+    """
+    Лимит одновременных запросов, изменяемый по принципу AIMD
+
+    :param max_limit: максимальный лимит (количество потоков)
+    :param min_limit: минимальный лимит
+    """
+
+    def __init__(self, max_limit: int, min_limit: int = 1):
+        self.max_limit = max(1, max_limit)
+        self.min_limit = max(1, min(min_limit, self.max_limit))
+        self.limit = float(self.max_limit)
+        self.lowest_limit = self.limit
+        self.decreases = 0
+        self.in_flight = 0
+        self._latency = {}  # Метод -> (сглаженная задержка, количество ответов)
+        self._last_decrease = 0.0
+        self._condition = threading.Condition()
+
+    def acquire(self) -> None:
+        with self._condition:
+            while self.in_flight >= int(self.limit):
+                self._condition.wait()
+            self.in_flight += 1
+
+    def release(self) -> None:
+        with self._condition:
+            self.in_flight -= 1
+            self._condition.notify_all()
+
+    def on_success(self, method: str, latency: float) -> None:
+        with self._condition:
+            average, samples = self._latency.get(method, (latency, 0))
+            self._latency[method] = (average * 0.8 + latency * 0.2, samples + 1)
+
+            if samples >= LATENCY_MIN_SAMPLES and latency > average * LATENCY_FACTOR:
+                self._decrease()
+            else:
+                # Аддитивное увеличение: +1 за limit успешных запросов
+                self.limit = min(self.max_limit, self.limit + 1 / self.limit)
+            self._condition.notify_all()
+
+    def on_overload(self) -> None:
+        with self._condition:
+            self._decrease()
+
+    def _decrease(self) -> None:
+        now = time.monotonic()
+        if now - self._last_decrease < DECREASE_INTERVAL:
+            return
+        self._last_decrease = now
+        # Мультипликативное уменьшение
+        self.limit = max(self.min_limit, self.limit / 2)
+        self.lowest_limit = min(self.lowest_limit, self.limit)
+        self.decreases += 1
+
+
+class RequestScheduler:
+    """
+    Общий для всех сессий планировщик запросов к Zabbix API:
+    адаптивный лимит одновременных запросов и повтор идемпотентных запросов
+
+    :param max_concurrency: максимальное количество одновременных запросов
+    :param max_attempts: сколько раз всего пытаться выполнить запрос
+    :param base_delay: начальная задержка перед повтором, секунд
+    :param max_delay: максимальная задержка перед повтором, секунд
+    """
+
+    def __init__(
+        self,
+        max_concurrency: int,
+        max_attempts: int = 5,
+        base_delay: float = 0.5,
+        max_delay: float = 30.0,
+    ):
+        self.limiter = AdaptiveLimiter(max_concurrency)
+        self.max_attempts = max(1, max_attempts)
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.retries = 0
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def slot(self, method: str):
+        """
+        Занимает место среди одновременных запросов на время выполнения запроса
+        и сообщает лимиту результат
+        """
+
+        self.limiter.acquire()
+        start = time.perf_counter()
+        try:
+            yield
+        except GeneratorExit:
+            # Потоковый ответ закрыт потребителем - запрос выполнен
+            self.limiter.on_success(method, time.perf_counter() - start)
+            raise
+        except Exception as error:
+            if is_overload_error(error):
+                self.limiter.on_overload()
+            raise
+        else:
+            self.limiter.on_success(method, time.perf_counter() - start)
+        finally:
+            self.limiter.release()
+
+    def retry_delay(self, method: str, error: Exception, attempt: int):
+        """
+        Задержка перед повтором запроса или None, если повторять нельзя
+
+        :param attempt: номер неудачной попытки, начиная с 0
+        """
+
+        if (
+            not is_idempotent(method)
+            or not is_overload_error(error)
+            or attempt + 1 >= self.max_attempts
+        ):
+            return None
+        with self._lock:
+            self.retries += 1
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2**attempt))
+
+    def call(self, method: str, request):
+        """
+        Выполняет запрос `request()` с учетом лимита и повторами при перегрузке
+        """
+
+        attempt = 0
+        while True:
+            try:
+                with self.slot(method):
+                    return request()
+            except Exception as error:
+                delay = self.retry_delay(method, error, attempt)
+                if delay is None:
+                    raise
+            attempt += 1
+            time.sleep(delay)
+
+    def stats(self) -> dict:
+        return {
+            "max_concurrency": self.limiter.max_limit,
+            "final_limit": round(self.limiter.limit, 2),
+            "lowest_limit": round(self.limiter.lowest_limit, 2),
+            "decreases": self.limiter.decreases,
+            "retries": self.retries,
+        }
+
+
+class BatchSizer:
+    """
+    Вес пачки configuration.import, подстраиваемый под время импорта
+
+    По каждой импортированной пачке уточняется скорость импорта (вес в секунду),
+    следующая пачка собирается такого веса, чтобы ее импорт занял около
+    `target_seconds`. При ошибке перегрузки (таймаут веб-сервера) вес уменьшается вдвое
+
+    :param target_seconds: желаемое время импорта одной пачки, секунд
+    :param initial_weight: вес пачки до первых замеров
+    """
+
+    def __init__(
+        self, target_seconds: float, initial_weight: int = IMPORT_BATCH_WEIGHT
+    ):
+        self.target_seconds = target_seconds
+        self.weight = initial_weight
+        self.batches = 0
+        self.shrinks = 0
+        self._rate = None  # Сглаженный вес в секунду
+        self._lock = threading.Lock()
+
+    def record(self, weight: int, seconds: float) -> None:
+        """
+        Учитывает время импорта пачки весом `weight`
+        """
+
+        rate = weight / max(seconds, 0.001)
+        with self._lock:
+            self.batches += 1
+            if self._rate is None:
+                self._rate = rate
+            else:
+                self._rate += (rate - self._rate) * BATCH_RATE_SMOOTHING
+            self.weight = self._clamp(self._rate * self.target_seconds)
+
+    def shrink(self) -> None:
+        """
+        Пачка не импортирована из-за перегрузки: уменьшаем вес вдвое
+        """
+
+        with self._lock:
+            self.shrinks += 1
+            if self._rate is not None:
+                self._rate /= 2
+            self.weight = self._clamp(self.weight / 2)
+
+    @staticmethod
+    def _clamp(weight: float) -> int:
+        return int(min(MAX_BATCH_WEIGHT, max(MIN_BATCH_WEIGHT, weight)))
+
+    def stats(self) -> dict:
+        return {
+            "target_seconds": self.target_seconds,
+            "batches": self.batches,
+            "final_weight": self.weight,
+            "rate_per_second": round(self._rate or 0, 2),
+            "shrinks": self.shrinks,
+        }